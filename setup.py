@@ -23,4 +23,9 @@ setuptools.setup(
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.6",
+    entry_points={
+        "console_scripts": [
+            "cameron-pdf=cameron_pdf_tools.cli:main",
+        ],
+    },
 )
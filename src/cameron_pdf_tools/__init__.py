@@ -1,6 +1,6 @@
 
 import re
-from functools import partial
+from functools import lru_cache, partial
 
 
 
@@ -35,13 +35,11 @@ def entity_to_unicode(match, exceptions=[], encoding='cp1252',
                 num = int(ent[1:])
         except:
             return '&'+ent+';'
-        if encoding is None or num > 255:
-            return check(my_unichr(num))
-
-        try:
-            return check(bytes(bytearray((num,))).decode(encoding))
-        except UnicodeDecodeError:
+        if num < 0:
+            return '&'+ent+';'
+        if num > 255:
             return check(my_unichr(num))
+        return check(_numeric_table(encoding)[num])
 
     from cameron_pdf_tools.html_entities import html5_entities
 
@@ -50,7 +48,7 @@ def entity_to_unicode(match, exceptions=[], encoding='cp1252',
     except KeyError:
         pass
 
-    from polyglot.html_entities import name2codepoint
+    from html.entities import name2codepoint
     try:
         return check(my_unichr(name2codepoint[ent]))
     except KeyError:
@@ -58,17 +56,178 @@ def entity_to_unicode(match, exceptions=[], encoding='cp1252',
 
 
 _ent_pat = re.compile(r'&(\S+?);')
-xml_entity_to_unicode = partial(entity_to_unicode, result_exceptions={
+_xml_result_exceptions = {
     '"' : '&quot;',
     "'" : '&apos;',
     '<' : '&lt;',
     '>' : '&gt;',
-    '&' : '&amp;'})
+    '&' : '&amp;'}
+xml_entity_to_unicode = partial(entity_to_unicode, result_exceptions=_xml_result_exceptions)
 
 
 
 def my_unichr(num):
     try:
-        return safe_chr(num)
+        return chr(num)
     except (ValueError, OverflowError):
-        return '?'
\ No newline at end of file
+        return '?'
+
+
+# Decoded values of the numeric entities below 256 - keyed by encoding and built the first time that encoding is used
+_numeric_tables = {}
+
+
+def _numeric_table(encoding):
+    """
+    Return a 256 entry tuple mapping the numbers below 256 to the characters they decode to in the given encoding.
+    If the encoding is None the Unicode UCS encoding is used.
+    Bytes the encoding can't decode (e.g. 0x81 in cp1252) fall back to their UCS code point.
+    :param encoding:
+    :return:
+    """
+    try:
+        return _numeric_tables[encoding]
+    except KeyError:
+        pass
+
+    if encoding is None:
+        table = tuple(chr(num) for num in range(256))
+    else:
+        table = []
+        for num in range(256):
+            try:
+                table.append(bytes((num,)).decode(encoding))
+            except UnicodeDecodeError:
+                table.append(chr(num))
+        table = tuple(table)
+
+    _numeric_tables[encoding] = table
+    return table
+
+
+# The encodings seen in practice - build them now, rather than on the first entity found
+for _encoding in ('cp1252', 'latin-1', None):
+    _numeric_table(_encoding)
+del _encoding
+
+
+# Translation tables for encode_entities - keyed by mode and built the first time that mode is used
+_xml_encode_table = {ord(ch): ent for ch, ent in _xml_result_exceptions.items()}
+_encode_tables = {'xml': _xml_encode_table}
+
+
+_non_ascii_pat = re.compile('[^\x00-\x7f]')
+
+
+class _NumericEntityTable(dict):
+    """
+    str.translate table which escapes every non-ASCII character as a numeric entity.
+    Entries are created on first lookup - there are too many code points to build the table up front.
+    """
+    def __missing__(self, num):
+        if num < 128:
+            raise LookupError(num)
+        self[num] = ans = '&#%d;' % num
+        return ans
+
+
+def _build_encode_table(mode):
+    """
+    Build the str.translate table for one of the encode_entities modes.
+    :param mode: 'html5' or 'ascii'
+    :return:
+    """
+    if mode == 'ascii':
+        return _NumericEntityTable(_xml_encode_table)
+
+    from html.entities import codepoint2name
+    from cameron_pdf_tools.html_entities import html5_entities
+
+    # Several entities can map to the same character (e.g. 'nbsp' and 'NonBreakingSpace') - prefer the HTML 4 name,
+    # then the shortest
+    table = dict(_xml_encode_table)
+    html4_names = set(codepoint2name.values())
+    for name in sorted(html5_entities, key=lambda n: (n not in html4_names, len(n), n)):
+        ch = html5_entities[name]
+        # Multi-character entities can't go in a translate table, and ASCII is left alone so that the output stays
+        # readable
+        if len(ch) != 1 or ord(ch) < 128:
+            continue
+        table.setdefault(ord(ch), '&' + name + ';')
+    return table
+
+
+def encode_entities(text, mode='xml'):
+    """
+    Escape a string using entities - the reverse of xml_entity_to_unicode.
+    :param text: The string to encode
+    :param mode: 'xml' - escape only the five characters with special meaning in XML.
+                 'html5' - as xml, also using named HTML5 entities for any non-ASCII character which has one.
+                 'ascii' - as xml, also escaping every non-ASCII character as a numeric entity. The output is pure
+                 ASCII and safe in both XML and HTML.
+    decode_entities reverses every mode - with one exception. The C1 controls (U+0080 to U+009F) are written as
+    &#128; to &#159; in 'ascii' mode, which decode_entities reads as cp1252 by default (so &#128; comes back as the euro
+    sign, as HTML says it should). Pass encoding=None to decode_entities to get them back as they were.
+    :return:
+    """
+    try:
+        table = _encode_tables[mode]
+    except KeyError:
+        if mode not in ('html5', 'ascii'):
+            raise ValueError('Unknown entity encoding mode - {}'.format(mode))
+        table = _encode_tables[mode] = _build_encode_table(mode)
+
+    # Fast path - the only ASCII characters which are ever encoded are the XML specials
+    if _non_ascii_pat.search(text) is None:
+        if not ('&' in text or '<' in text or '>' in text or '"' in text or "'" in text):
+            return text
+        return text.translate(_xml_encode_table)
+
+    return text.translate(table)
+
+
+def decode_entities(text, encoding='cp1252'):
+    """
+    Replace every entity in a string with the character(s) it stands for.
+    :param text: The string to decode
+    :param encoding: As for entity_to_unicode
+    :return:
+    """
+    if '&' not in text:
+        return text
+    return _ent_pat.sub(partial(entity_to_unicode, encoding=encoding), text)
+
+
+# The same few values (publishers, series authors, e.t.c.) repeat across a whole corpus - so decoded values are memoized
+DECODE_ENTITIES_CACHE_SIZE = 65536
+_cached_decode_entities = lru_cache(maxsize=DECODE_ENTITIES_CACHE_SIZE)(decode_entities)
+
+
+def decode_entities_many(values, encoding='cp1252'):
+    """
+    Decode the entities in a batch of metadata values, returning a list of the results in the same order.
+    Values which are not strings, or contain no entities, are passed through as is (and don't touch the memo).
+    :param values: An iterable of values
+    :param encoding: As for entity_to_unicode
+    :return:
+    """
+    return [
+        _cached_decode_entities(v, encoding) if isinstance(v, str) and '&' in v else v
+        for v in values
+    ]
+
+
+def decode_entities_cache_info():
+    """
+    Hit and miss counters (along with the maxsize and current size) of the decode_entities_many memo.
+    :return:
+    """
+    return _cached_decode_entities.cache_info()
+
+
+def decode_entities_cache_clear():
+    """
+    Empty the decode_entities_many memo, and reset its counters.
+    :return:
+    """
+    _cached_decode_entities.cache_clear()
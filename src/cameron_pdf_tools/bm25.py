@@ -0,0 +1,348 @@
+
+# Ranked (BM25) search over the pages of a TextIndex.
+# The varint postings of a TextIndex are compact, but slow to score in python. compile_index flattens the live segments
+# of an index into numpy arrays - one entry per (term, page) - which BM25Engine memory maps, and scores a term at a time
+# with array operations. Recompile after the index changes.
+#
+# Compiled layout (a directory)
+#   - sources.json - the pdf path of each document
+#   - page_docs.npy, page_numbers.npy, page_lengths.npy - for each page id, its document, page number and length
+#   - terms.json - term -> [start, count] into the postings arrays
+#   - postings.npy, tfs.npy - the page ids each term is on (ascending) and how often it occurs there
+#   - pos_offsets.npy, positions.npy - the positions of each posting (for phrase queries)
+
+import json
+import os
+import re
+import time
+
+from array import array
+
+import numpy as np
+
+from cameron_pdf_tools.text_index import tokenize
+
+
+K1 = 1.2
+B = 0.75
+
+# Candidates are found by sorting the postings touched while they're fewer than 1/this of the pages, and by scanning
+# every page's score (np.flatnonzero) past that. Measured here: the scan costs about 1ns a page, sorting about 16ns a
+# posting.
+DENSE_CANDIDATES_FRACTION = 16
+
+_phrase_pat = re.compile(r'"([^"]*)"')
+
+
+def compile_index(index, out_dir):
+    """
+    Flatten the live contents of a TextIndex into the arrays BM25Engine searches.
+    :param index: A text_index.TextIndex
+    :param out_dir: Directory to write to - created if it doesn't exist
+    :return:
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    # Held open until everything's read - a merge can't close them under us
+    with index.snapshot() as (segments, deleted):
+        sources = []
+        page_docs = array("i")
+        page_numbers = array("i")
+        page_lengths = array("f")
+        # (segment number, doc id) -> the page id of the document's first page
+        first_page = dict()
+
+        for seg_num, segment in enumerate(segments):
+            for doc_id in sorted(segment.docs):
+                if doc_id in deleted:
+                    continue
+                doc = segment.docs[doc_id]
+                first_page[(seg_num, doc_id)] = len(page_docs)
+                for page_number, length in enumerate(doc["page_lengths"], start=1):
+                    page_docs.append(len(sources))
+                    page_numbers.append(page_number)
+                    page_lengths.append(length)
+                sources.append(doc["source"])
+
+        terms = dict()
+        postings = array("i")
+        tfs = array("i")
+        pos_offsets = array("q", [0])
+        positions = array("i")
+
+        all_terms = sorted(set(term for segment in segments for term in segment.terms))
+        for term in all_terms:
+            entries = []
+            for seg_num, segment in enumerate(segments):
+                for doc_id, page, term_positions in segment.postings(term):
+                    start = first_page.get((seg_num, doc_id))
+                    if start is not None:
+                        entries.append((start + page - 1, term_positions))
+            if not entries:
+                continue
+            entries.sort(key=lambda entry: entry[0])
+
+            terms[term] = [len(postings), len(entries)]
+            for page_id, term_positions in entries:
+                postings.append(page_id)
+                tfs.append(len(term_positions))
+                positions.extend(term_positions)
+                pos_offsets.append(len(positions))
+
+    np.save(os.path.join(out_dir, "page_docs.npy"), np.frombuffer(page_docs, dtype=np.int32))
+    np.save(os.path.join(out_dir, "page_numbers.npy"), np.frombuffer(page_numbers, dtype=np.int32))
+    np.save(os.path.join(out_dir, "page_lengths.npy"), np.frombuffer(page_lengths, dtype=np.float32))
+    np.save(os.path.join(out_dir, "postings.npy"), np.frombuffer(postings, dtype=np.int32))
+    np.save(os.path.join(out_dir, "tfs.npy"), np.frombuffer(tfs, dtype=np.int32))
+    np.save(os.path.join(out_dir, "pos_offsets.npy"), np.frombuffer(pos_offsets, dtype=np.int64))
+    np.save(os.path.join(out_dir, "positions.npy"), np.frombuffer(positions, dtype=np.int32))
+    with open(os.path.join(out_dir, "terms.json"), "w", encoding="utf-8") as stream:
+        json.dump(terms, stream)
+    with open(os.path.join(out_dir, "sources.json"), "w", encoding="utf-8") as stream:
+        json.dump(sources, stream)
+
+
+def parse_query(query):
+    """
+    Split a query into its terms and its phrases (runs of terms in double quotes).
+    :param query:
+    :return: A tuple of the list of every term, and a list of phrases - each a list of terms
+    """
+    phrases = [tokenize(phrase) for phrase in _phrase_pat.findall(query)]
+    phrases = [phrase for phrase in phrases if len(phrase) > 1]
+    terms = tokenize(_phrase_pat.sub(" ", query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return terms, phrases
+
+
+def _sorted_unique(values):
+    """
+    np.unique, by sorting - newer numpys unique integers by hashing, which is many times slower for this.
+    """
+    values = np.sort(values)
+    if not len(values):
+        return values
+    keep = np.empty(len(values), dtype=bool)
+    keep[0] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+class BM25Engine(object):
+    """
+    BM25 top-k search over a compiled index (see compile_index).
+
+    Usage:
+
+        engine = BM25Engine("/var/index-compiled")
+        for pdf_path, page, score in engine.search('"annual report" 2019', k=10):
+            ...
+    """
+
+    def __init__(self, path, k1=K1, b=B):
+        """
+        :param path: The directory compile_index wrote to
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 length normalization
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        self.page_docs = load("page_docs.npy")
+        self.page_numbers = load("page_numbers.npy")
+        self.page_lengths = load("page_lengths.npy")
+        self.postings = load("postings.npy")
+        self.tfs = load("tfs.npy")
+        self.pos_offsets = load("pos_offsets.npy")
+        self.positions = load("positions.npy")
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as stream:
+            self.terms = json.load(stream)
+        with open(os.path.join(path, "sources.json"), "r", encoding="utf-8") as stream:
+            self.sources = json.load(stream)
+
+        self.num_pages = len(self.page_lengths)
+        self.avg_length = float(np.mean(self.page_lengths)) if self.num_pages else 0.0
+        # Per page length normalization - k1 * (1 - b + b * length / average length) - the same for every query
+        if self.num_pages:
+            self._norm = (
+                self.k1 * (1.0 - self.b + self.b * np.asarray(self.page_lengths) / max(self.avg_length, 1.0))
+            ).astype(np.float32)
+        else:
+            self._norm = np.zeros(0, dtype=np.float32)
+
+    def _term_postings(self, term):
+        """
+        :param term:
+        :return: A tuple of the start of the term in the postings arrays, and the number of pages it's on
+        """
+        return self.terms.get(term, (0, 0))
+
+    def idf(self, df):
+        return np.log1p((self.num_pages - df + 0.5) / (df + 0.5))
+
+    def score_term(self, term):
+        """
+        BM25 scores of every page a term is on.
+        :param term:
+        :return: A tuple of arrays - the page ids, and their scores
+        """
+        start, count = self._term_postings(term)
+        page_ids = self.postings[start:start + count]
+        tf = self.tfs[start:start + count].astype(np.float32)
+        scores = self.idf(count) * tf * (self.k1 + 1.0) / (tf + self._norm[page_ids])
+        return page_ids, scores.astype(np.float32)
+
+    def _positions(self, posting):
+        return self.positions[self.pos_offsets[posting]:self.pos_offsets[posting + 1]]
+
+    def phrase_pages(self, phrase):
+        """
+        Find the pages a phrase occurs on.
+        Candidates are the pages holding every term of the phrase - only those have their positions checked.
+        :param phrase: A list of terms
+        :return: A sorted array of page ids
+        """
+        spans = [self._term_postings(term) for term in phrase]
+        if any(count == 0 for _, count in spans):
+            return np.zeros(0, dtype=np.int32)
+
+        candidates = None
+        for start, count in spans:
+            page_ids = self.postings[start:start + count]
+            candidates = page_ids if candidates is None else np.intersect1d(candidates, page_ids, assume_unique=True)
+            if not len(candidates):
+                return np.zeros(0, dtype=np.int32)
+
+        # Index of each candidate within each term's postings - postings are sorted by page id
+        indices = [
+            start + np.searchsorted(self.postings[start:start + count], candidates)
+            for start, count in spans
+        ]
+
+        found = []
+        for i, page_id in enumerate(candidates):
+            # Start positions of the phrase - the first term's positions, shifted back by each later term's offset
+            starts = self._positions(indices[0][i])
+            for offset in range(1, len(phrase)):
+                starts = np.intersect1d(starts, self._positions(indices[offset][i]) - offset)
+                if not len(starts):
+                    break
+            else:
+                found.append(page_id)
+        return np.asarray(found, dtype=np.int32)
+
+    def search(self, query, k=10):
+        """
+        The top k pages for a query, by BM25 score.
+        Terms in double quotes must occur on the page as a phrase.
+        :param query:
+        :param k:
+        :return: A list of (pdf_path, page, score) tuples, best first
+        """
+        terms, phrases = parse_query(query)
+        if not terms or not self.num_pages:
+            return []
+
+        # Page ids are unique within one term's postings - so scores can be added with fancy indexing
+        totals = np.zeros(self.num_pages, dtype=np.float32)
+        touched = []
+        for term in set(terms):
+            page_ids, scores = self.score_term(term)
+            totals[page_ids] += scores
+            touched.append(page_ids)
+        if sum(len(page_ids) for page_ids in touched) * DENSE_CANDIDATES_FRACTION < self.num_pages:
+            candidates = _sorted_unique(np.concatenate(touched))
+        else:
+            # Every score is positive (idf and tf both are) - so the pages touched are the non-zero totals. For common
+            # terms one pass over the dense array is much cheaper than sorting their postings.
+            candidates = np.flatnonzero(totals)
+
+        for phrase in phrases:
+            candidates = np.intersect1d(candidates, self.phrase_pages(phrase), assume_unique=True)
+        if not len(candidates):
+            return []
+
+        candidate_scores = totals[candidates]
+        if len(candidates) > k:
+            top = np.argpartition(-candidate_scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-candidate_scores[top], kind="stable")]
+
+        return [
+            (
+                self.sources[self.page_docs[candidates[i]]],
+                int(self.page_numbers[candidates[i]]),
+                float(candidate_scores[i]),
+            )
+            for i in top
+        ]
+
+
+########################################################################################################################
+# Benchmarking
+
+
+def build_synthetic_index(out_dir, pages=1000000, vocabulary=100000, page_length=300, seed=0):
+    """
+    Write a compiled index of random text - term frequencies following Zipf's law, as real text does - for benchmarking
+    BM25Engine at scale without a corpus to hand. Positions are not generated (phrase queries always fail).
+    :param out_dir:
+    :param pages: Number of pages
+    :param vocabulary: Number of distinct terms
+    :param page_length: Mean tokens per page
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    lengths = rng.poisson(page_length, size=pages).astype(np.float32)
+    # Zipf - the document frequency of the term of rank r falls off as 1/r
+    ranks = np.arange(1, vocabulary + 1)
+    dfs = np.minimum(pages, np.maximum(1, (pages * 0.5 / ranks).astype(np.int64)))
+
+    terms = dict()
+    postings = []
+    tfs = []
+    offset = 0
+    for rank, df in zip(ranks, dfs):
+        page_ids = np.sort(rng.choice(pages, size=int(df), replace=False)).astype(np.int32)
+        postings.append(page_ids)
+        tfs.append(rng.geometric(0.5, size=int(df)).astype(np.int32))
+        terms["t{}".format(rank)] = [offset, int(df)]
+        offset += int(df)
+
+    np.save(os.path.join(out_dir, "page_docs.npy"), (np.arange(pages) // 100).astype(np.int32))
+    np.save(os.path.join(out_dir, "page_numbers.npy"), (np.arange(pages) % 100 + 1).astype(np.int32))
+    np.save(os.path.join(out_dir, "page_lengths.npy"), lengths)
+    np.save(os.path.join(out_dir, "postings.npy"), np.concatenate(postings))
+    np.save(os.path.join(out_dir, "tfs.npy"), np.concatenate(tfs))
+    np.save(os.path.join(out_dir, "pos_offsets.npy"), np.zeros(offset + 1, dtype=np.int64))
+    np.save(os.path.join(out_dir, "positions.npy"), np.zeros(0, dtype=np.int32))
+    with open(os.path.join(out_dir, "terms.json"), "w", encoding="utf-8") as stream:
+        json.dump(terms, stream)
+    with open(os.path.join(out_dir, "sources.json"), "w", encoding="utf-8") as stream:
+        json.dump(["/synthetic/{}.pdf".format(i) for i in range((pages + 99) // 100)], stream)
+
+
+def benchmark_qps(engine, queries, k=10, seconds=5.0):
+    """
+    Run queries against an engine, round robin, for a while - returning the queries per second achieved.
+    :param engine: A BM25Engine
+    :param queries: A list of query strings
+    :param k:
+    :param seconds: How long to run for
+    :return:
+    """
+    done = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        engine.search(queries[done % len(queries)], k=k)
+        done += 1
+    return done / (time.perf_counter() - start)
@@ -0,0 +1,396 @@
+
+# Reading metadata from huge pdfs without memory growing with the size of the file.
+# pdfminer keeps every object it resolves, and every object stream it decompresses, for the life of the document - and
+# decompresses and reads streams whole, whatever their size. On multi-GB files that gets workers OOM-killed.
+# BoundedPDFDocument caps all of that (see MemoryLimits):
+#   - resolved objects and parsed object streams are kept in LRU caches of a fixed number of entries - and the objects
+#     cache also holds at most a fixed number of bytes of stream data. Streams decoded here (object streams, XMP) go
+#     back to their raw bytes once used, so the cache keeps those rather than the decoded data.
+#   - a stream is refused if its /Length is over the limit - before it's read
+#   - flate streams are decompressed a chunk at a time, up to the limit - so a small stream which decompresses to
+#     gigabytes is refused before it takes the memory. The chunks are kept as the decoded stream, so it's only
+#     decompressed once.
+#   - the number of xref entries kept is capped, counted as each section is read
+# Going over any limit raises ResourceLimitError - rather than growing. The xref chain is read lazily (see
+# xref_revisions), and broken xrefs aren't reconstructed - pdfminer's fallback reads the whole file.
+# Objects other than streams are still parsed whole - a single dictionary is never what takes the memory.
+
+import zlib
+
+from collections import OrderedDict, namedtuple
+
+from pdfminer.pdfdocument import PDFXRef, PDFXRefStream
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import LITERALS_FLATE_DECODE, PDFStream, int_value, stream_value
+from pdfminer.psparser import LIT
+from pdfminer.utils import apply_png_predictor, apply_tiff_predictor
+
+from cameron_pdf_tools.xref_revisions import LazyPDFDocument, _read_xref
+
+
+# cached_objects - resolved objects kept. cached_bytes - bytes of stream data held by the resolved objects kept.
+# object_streams - decompressed object streams kept. stream_size - largest stream read or decoded, in bytes.
+# xmp_size - largest XMP packet, in bytes. xref_entries - most xref entries kept, over every section read.
+# None for any means unlimited.
+MemoryLimits = namedtuple(
+    "MemoryLimits", ["cached_objects", "cached_bytes", "object_streams", "stream_size", "xmp_size", "xref_entries"]
+)
+
+# Enough for the metadata of any sane file - a few hundred MB at most
+DEFAULT_MEMORY_LIMITS = MemoryLimits(
+    cached_objects=4096,
+    cached_bytes=64 * 1024 * 1024,
+    object_streams=8,
+    stream_size=64 * 1024 * 1024,
+    xmp_size=4 * 1024 * 1024,
+    xref_entries=2000000,
+)
+
+# Bytes decompressed at a time when checking the size of a stream
+_DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+LITERAL_XREF = LIT("XRef")
+
+
+class ResourceLimitError(Exception):
+    """
+    Raised when reading a pdf would go over one of its MemoryLimits.
+    """
+
+    def __init__(self, limit, value, size):
+        """
+        :param limit: The name of the limit - a field of MemoryLimits
+        :param value: The limit
+        :param size: What was asked for - at least (it's not always read to the end)
+        """
+        self.limit = limit
+        self.value = value
+        self.size = size
+        super(ResourceLimitError, self).__init__(
+            "Over the {} limit - {} needed, {} allowed".format(limit, size, value)
+        )
+
+
+class _LRUCache(OrderedDict):
+    """
+    A dictionary of at most maxsize entries - the least recently used dropped to make room.
+    If max_bytes is given, it also holds at most that many bytes - as counted by weigh(value). Values with any weight
+    (streams) are weighed again whenever one is looked up or anything is added - a caller may have decoded one since.
+    """
+
+    def __init__(self, maxsize, *args, max_bytes=None, weigh=None, **kwargs):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.bytes = 0
+        self._sizes = dict()
+        super(_LRUCache, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = super(_LRUCache, self).__getitem__(key)
+        self.move_to_end(key)
+        if self.max_bytes is not None:
+            self._weigh(key, value)
+            self._shrink()
+        return value
+
+    def __setitem__(self, key, value):
+        super(_LRUCache, self).__setitem__(key, value)
+        self.move_to_end(key)
+        if self.max_bytes is not None:
+            for weighed in list(self._sizes):
+                if weighed != key:
+                    self._weigh(weighed, OrderedDict.__getitem__(self, weighed))
+            self._weigh(key, value)
+        self._shrink()
+
+    def __delitem__(self, key):
+        super(_LRUCache, self).__delitem__(key)
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def _weigh(self, key, value):
+        size = self.weigh(value)
+        self.bytes += size - self._sizes.pop(key, 0)
+        if size:
+            self._sizes[key] = size
+
+    def _shrink(self):
+        while self and (
+            (self.maxsize is not None and len(self) > self.maxsize)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            key, _ = self.popitem(last=False)
+            self.bytes -= self._sizes.pop(key, 0)
+
+
+def _stream_bytes(entry):
+    """
+    The bytes of stream data held by an entry of PDFDocument._cached_objs - an (object, generation) tuple.
+    """
+    obj = entry[0]
+    if not isinstance(obj, PDFStream):
+        return 0
+    return len(obj.data if obj.data is not None else obj.rawdata or b"")
+
+
+class _CappedDict(dict):
+    """
+    A dictionary which raises ResourceLimitError rather than grow past maxsize entries.
+    used - how much of the limit was already used elsewhere, for the error.
+    """
+
+    def __init__(self, limit, maxsize, used=0):
+        super(_CappedDict, self).__init__()
+        self.limit = limit
+        self.maxsize = maxsize
+        self.used = used
+
+    def __setitem__(self, key, value):
+        if key not in self and len(self) >= self.maxsize:
+            raise ResourceLimitError(self.limit, self.used + self.maxsize, self.used + len(self) + 1)
+        super(_CappedDict, self).__setitem__(key, value)
+
+
+def _apply_predictor(data, params):
+    """
+    Undo a filter's predictor - as pdfminer's PDFStream.decode does.
+    """
+    if not isinstance(params, dict) or "Predictor" not in params:
+        return data
+    pred = int_value(params["Predictor"])
+    if pred == 1:
+        return data
+    colors = int_value(params.get("Colors", 1))
+    columns = int_value(params.get("Columns", 1))
+    bitspercomponent = int_value(params.get("BitsPerComponent", 8))
+    if pred == 2:
+        return apply_tiff_predictor(colors, columns, bitspercomponent, data)
+    if pred >= 10:
+        return apply_png_predictor(pred, colors, columns, bitspercomponent, data)
+    return None
+
+
+def _finish_decode(stream, data, filters):
+    """
+    Decode the rest of a stream whose first filter (flate) has been undone already - setting stream.data, as pdfminer's
+    own decode would.
+    :return: False if it can't be done here (a predictor pdfminer doesn't know, say) - the stream is left as it was
+    """
+    data = _apply_predictor(data, filters[0][1])
+    if data is None:
+        return False
+    if len(filters) > 1:
+        # The rest is left to pdfminer - on a stream of the part decoded so far
+        rest = PDFStream(
+            dict(stream.attrs, Filter=[f for f, _ in filters[1:]], DecodeParms=[p for _, p in filters[1:]]), data
+        )
+        data = rest.get_data()
+    stream.data = data
+    stream.rawdata = None
+    return True
+
+
+def check_decoded_size(stream, limit, name="stream_size"):
+    """
+    Make sure a stream decodes to no more than limit bytes - without decoding all of it if it doesn't.
+    Flate is decompressed a chunk at a time - given up on as soon as it's over the limit, and otherwise kept as the
+    decoded stream (stream.data is set), so it isn't decompressed again. Other filters can't be checked without
+    decoding - their input is bounded by the stream's /Length, and they're checked once decoded.
+    :param stream: A pdfminer PDFStream
+    :param limit: In bytes - None for no limit
+    :param name: The name of the limit, for the error
+    :return:
+    """
+    if limit is None:
+        return
+    if stream.data is not None:
+        if len(stream.data) > limit:
+            raise ResourceLimitError(name, limit, len(stream.data))
+        return
+
+    data = stream.rawdata
+    if stream.decipher:
+        data = stream.decipher(stream.objid, stream.genno, data, stream.attrs)
+    filters = stream.get_filters()
+    if not filters:
+        if len(data) > limit:
+            raise ResourceLimitError(name, limit, len(data))
+        return
+
+    if filters[0][0] in LITERALS_FLATE_DECODE:
+        decompressor = zlib.decompressobj()
+        chunks = []
+        size = 0
+        try:
+            chunk = decompressor.decompress(data, _DECOMPRESS_CHUNK_SIZE)
+            while chunk:
+                size += len(chunk)
+                if size > limit:
+                    raise ResourceLimitError(name, limit, size)
+                chunks.append(chunk)
+                chunk = decompressor.decompress(decompressor.unconsumed_tail, _DECOMPRESS_CHUNK_SIZE)
+        except zlib.error:
+            # Damaged - pdfminer has its own ways of recovering what it can. Check what comes of it.
+            pass
+        else:
+            data = b"".join(chunks)
+            del chunks
+            if _finish_decode(stream, data, filters):
+                # A predictor never makes the data bigger - anything after flate might
+                if len(stream.data) > limit:
+                    raise ResourceLimitError(name, limit, len(stream.data))
+                return
+
+    decoded = stream.get_data()
+    if len(decoded) > limit:
+        raise ResourceLimitError(name, limit, len(decoded))
+
+
+class _BoundedParser(PDFParser):
+    """
+    A PDFParser which refuses streams longer than the limit - before reading them.
+    """
+
+    def __init__(self, fp, limits):
+        PDFParser.__init__(self, fp)
+        self.limits = limits
+
+    def do_keyword(self, pos, token):
+        if token is self.KEYWORD_STREAM and self.limits.stream_size is not None and self.curstack:
+            dic = self.curstack[-1][1]
+            if isinstance(dic, dict) and "Length" in dic:
+                length = int_value(dic["Length"])
+                if length > self.limits.stream_size:
+                    raise ResourceLimitError("stream_size", self.limits.stream_size, length)
+
+        PDFParser.do_keyword(self, pos, token)
+
+        if token is self.KEYWORD_STREAM and self.curstack:
+            stream = self.curstack[-1][1]
+            if isinstance(stream, PDFStream) and stream.get("Type") is LITERAL_XREF:
+                self._check_xref_stream(stream)
+
+    def _check_xref_stream(self, stream):
+        """
+        Check the number of entries an xref stream declares - and that it decodes to no more than they need.
+        """
+        index = stream.get("Index", (0, stream.get("Size", 0)))
+        entries = sum(int_value(count) for count in list(index)[1::2])
+        if self.limits.xref_entries is not None and entries > self.limits.xref_entries:
+            raise ResourceLimitError("xref_entries", self.limits.xref_entries, entries)
+        # Each row can have a predictor byte in front
+        row = sum(int_value(w) for w in stream.get("W", ())) + 1
+        limit = self.limits.stream_size
+        if limit is not None:
+            limit = min(limit, entries * row)
+        check_decoded_size(stream, limit, name="stream_size")
+
+
+class BoundedPDFDocument(LazyPDFDocument):
+    """
+    A PDFDocument which keeps its memory use within limits - see the top of the module.
+    """
+
+    def __init__(self, parser, limits=None, password=""):
+        """
+        :param parser: Made with bounded_parser - a plain PDFParser reads streams whatever their size
+        :param limits: A MemoryLimits - defaults to DEFAULT_MEMORY_LIMITS
+        :param password:
+        """
+        self.limits = DEFAULT_MEMORY_LIMITS if limits is None else limits
+        self.xref_entries = 0
+        LazyPDFDocument.__init__(self, parser, password=password, fallback=False)
+
+    # pdfminer sets these to plain dictionaries - swap in LRU caches whenever it does
+    @property
+    def _cached_objs(self):
+        return self.__cached_objs
+
+    @_cached_objs.setter
+    def _cached_objs(self, value):
+        self.__cached_objs = _LRUCache(
+            self.limits.cached_objects, value, max_bytes=self.limits.cached_bytes, weigh=_stream_bytes
+        )
+
+    @property
+    def _parsed_objs(self):
+        return self.__parsed_objs
+
+    @_parsed_objs.setter
+    def _parsed_objs(self, value):
+        self.__parsed_objs = _LRUCache(self.limits.object_streams, value)
+
+    def _read_xref_section(self, parser, start):
+        xref = _read_xref(parser, start, table_class=self._new_xref_table)
+        if isinstance(xref, PDFXRefStream):
+            self.xref_entries += sum(count for _, count in xref.ranges)
+        else:
+            self.xref_entries += len(xref.offsets)
+        if self.limits.xref_entries is not None and self.xref_entries > self.limits.xref_entries:
+            raise ResourceLimitError("xref_entries", self.limits.xref_entries, self.xref_entries)
+        return xref
+
+    def _new_xref_table(self):
+        xref = PDFXRef()
+        if self.limits.xref_entries is not None:
+            xref.offsets = _CappedDict(
+                "xref_entries", self.limits.xref_entries - self.xref_entries, used=self.xref_entries
+            )
+        return xref
+
+    def _get_objects(self, stream):
+        rawdata = stream.rawdata
+        check_decoded_size(stream, self.limits.stream_size)
+        try:
+            return LazyPDFDocument._get_objects(self, stream)
+        finally:
+            # The objects parsed out of it are kept (in _parsed_objs) - the decoded stream isn't needed again
+            _undecode(stream, rawdata)
+
+    def read_xmp(self):
+        """
+        The document's XMP packet - refused if it's over the xmp_size limit.
+        :return: The packet as bytes - None if the document doesn't have one
+        """
+        if "Metadata" not in self.catalog:
+            return None
+        stream = stream_value(self.catalog["Metadata"])
+        rawdata = stream.rawdata
+        check_decoded_size(stream, self.limits.xmp_size, name="xmp_size")
+        try:
+            return stream.get_data()
+        finally:
+            _undecode(stream, rawdata)
+
+
+def _undecode(stream, rawdata):
+    """
+    Put a decoded stream back to its raw bytes - so a cached stream doesn't keep its decoded data.
+    :param stream:
+    :param rawdata: The raw bytes, from before it was decoded - None if it already was
+    """
+    if rawdata is not None:
+        stream.rawdata = rawdata
+        stream.data = None
+
+
+def bounded_parser(stream, limits=None):
+    """
+    A parser for a BoundedPDFDocument.
+    :param stream: An open binary file
+    :param limits: A MemoryLimits - defaults to DEFAULT_MEMORY_LIMITS
+    :return:
+    """
+    return _BoundedParser(stream, DEFAULT_MEMORY_LIMITS if limits is None else limits)
+
+
+def open_bounded(stream, limits=None):
+    """
+    Open a pdf as a BoundedPDFDocument.
+    :param stream: An open binary file
+    :param limits: A MemoryLimits - defaults to DEFAULT_MEMORY_LIMITS
+    :return:
+    """
+    limits = DEFAULT_MEMORY_LIMITS if limits is None else limits
+    stream.seek(0)
+    return BoundedPDFDocument(bounded_parser(stream, limits), limits=limits)
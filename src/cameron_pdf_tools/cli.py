@@ -0,0 +1,334 @@
+
+# The cameron-pdf command - metadata extraction for many files from the shell.
+# One json object is written to stdout per file, as each finishes (not in input order):
+#   {"path": ..., "ok": true, "metadata": {...}}
+#   {"path": ..., "ok": false, "error": {"type": ..., "message": ...}}
+# Anything the library prints goes to stderr, so stdout stays valid NDJSON.
+#
+# This module is imported every time the command runs - even for --help - so nothing heavy (pdfminer in particular) is
+# imported at the top level. The extraction modules are only imported in the workers.
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from cameron_pdf_tools.process_limits import DEFAULT_LIMITS, DEFAULT_TIMEOUT
+
+
+EXIT_OK = 0
+# Some files failed
+EXIT_SOME_FAILED = 1
+# Bad arguments (as argparse uses)
+EXIT_USAGE = 2
+# Every file failed - or no files were found
+EXIT_ALL_FAILED = 3
+# --backend poppler, and poppler is missing (or too old)
+EXIT_TOOLS_MISSING = 4
+EXIT_INTERRUPTED = 130
+
+# Files queued per worker - so a long manifest is read as it's worked through, not all at once
+QUEUE_PER_JOB = 4
+
+_glob_chars = set("*?[")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="cameron-pdf",
+        description="Extract metadata from pdfs - writing one json line per file to stdout.",
+        epilog=(
+            "Exit codes: {} - every file succeeded, {} - some files failed, {} - bad arguments, {} - every file failed "
+            "(or none were found), {} - poppler is needed (--backend poppler) but missing.".format(
+                EXIT_OK, EXIT_SOME_FAILED, EXIT_USAGE, EXIT_ALL_FAILED, EXIT_TOOLS_MISSING
+            )
+        ),
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Files, directories (searched for pdfs) or glob patterns. With none - or '-' - paths are read from stdin, "
+        "one per line.",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of files to work on at once"
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("auto", "pdfminer", "poppler"),
+        default="auto",
+        help="How to read the metadata (default auto)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Seconds to allow each poppler call (default {}, 0 for no limit)".format(DEFAULT_TIMEOUT),
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        default=DEFAULT_LIMITS.memory // (1024 * 1024),
+        help="Megabytes of memory to allow each poppler process (default {}, 0 for no limit)".format(
+            DEFAULT_LIMITS.memory // (1024 * 1024)
+        ),
+    )
+    parser.add_argument(
+        "--cpu-limit",
+        type=int,
+        default=DEFAULT_LIMITS.cpu,
+        help="Seconds of cpu time to allow each poppler process (default {}, 0 for no limit)".format(DEFAULT_LIMITS.cpu),
+    )
+    parser.add_argument(
+        "--guess-title", action="store_true", help="Guess a title from the first page of files which have none"
+    )
+    parser.add_argument(
+        "--bounded",
+        action="store_true",
+        help="Keep pdfminer's memory use within fixed limits - files which need more fail, rather than the worker",
+    )
+    return parser
+
+
+def iter_paths(specs, stdin=None):
+    """
+    Expand the paths given on the command line into the pdfs to work on.
+    A generator - stdin is read a line at a time, as paths are needed.
+    :param specs: Files, directories and glob patterns. "-" reads more from stdin.
+    :param stdin: Where to read the manifest from - defaults to sys.stdin
+    :return:
+    """
+    stdin = sys.stdin if stdin is None else stdin
+    for spec in specs:
+        if spec == "-":
+            for line in stdin:
+                line = line.strip()
+                if line:
+                    # Paths from a manifest are taken as they are - not expanded
+                    yield line
+        elif os.path.isdir(spec):
+            for dirpath, dirnames, filenames in os.walk(spec):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.join(dirpath, name)
+        elif _glob_chars.intersection(spec) and not os.path.exists(spec):
+            for path in sorted(glob.iglob(spec, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield spec
+
+
+def _quiet_worker():
+    # The library prints progress messages - keep them out of the NDJSON
+    sys.stdout = sys.stderr
+
+
+def _init_worker(memory, cpu):
+    _quiet_worker()
+    from cameron_pdf_tools.process_limits import set_default_limits
+
+    set_default_limits(memory=memory, cpu=cpu)
+
+
+def process_file(path, backend="auto", timeout=None, guess_title=False, bounded=False):
+    """
+    Extract the metadata of one file, for the command line.
+    :param path:
+    :param backend: As for backends.extract
+    :param timeout: As for backends.extract
+    :param guess_title: If True, and the file has no title, guess one
+    :param bounded: As for backends.extract
+    :return: The json-able result line, as a dictionary
+    """
+    try:
+        if not os.path.isfile(path):
+            raise FileNotFoundError("No such file - {}".format(path))
+
+        from cameron_pdf_tools.backends import extract
+
+        md = extract(path, backend=backend, timeout=timeout, bounded=bounded)
+        if guess_title:
+            from cameron_pdf_tools.title_guess import fill_missing_title
+
+            fill_missing_title(md, path)
+    except Exception as e:
+        return {"path": path, "ok": False, "error": {"type": type(e).__name__, "message": str(e)}}
+    return {"path": path, "ok": True, "metadata": md}
+
+
+def _write(out, result):
+    out.write(json.dumps(result, ensure_ascii=False, default=str))
+    out.write("\n")
+    out.flush()
+
+
+def main(argv=None):
+    """
+    Run the cameron-pdf command.
+    :param argv: The arguments - defaults to sys.argv[1:]
+    :return: The exit code
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.paths and sys.stdin.isatty():
+        parser.print_usage(sys.stderr)
+        return EXIT_USAGE
+    if args.jobs < 1:
+        print("cameron-pdf: --jobs must be at least 1", file=sys.stderr)
+        return EXIT_USAGE
+    if min(args.timeout, args.memory_limit, args.cpu_limit) < 0:
+        print("cameron-pdf: --timeout, --memory-limit and --cpu-limit can't be negative", file=sys.stderr)
+        return EXIT_USAGE
+
+    backend = _check_tools(args.backend)
+    if backend is None:
+        return EXIT_TOOLS_MISSING
+
+    specs = args.paths or ["-"]
+    out = sys.stdout
+    limits = (args.memory_limit * 1024 * 1024 or None, args.cpu_limit or None)
+    _init_worker(*limits)
+
+    kwargs = {
+        "backend": backend,
+        "timeout": args.timeout or None,
+        "guess_title": args.guess_title,
+        "bounded": args.bounded,
+    }
+    done = 0
+    failed = 0
+    try:
+        if args.jobs == 1:
+            results = (process_file(path, **kwargs) for path in iter_paths(specs))
+        else:
+            results = _run_parallel(iter_paths(specs), args.jobs, kwargs, limits)
+        for result in results:
+            done += 1
+            if not result["ok"]:
+                failed += 1
+            _write(out, result)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
+    finally:
+        sys.stdout = out
+
+    if not done or failed == done:
+        return EXIT_ALL_FAILED
+    if failed:
+        return EXIT_SOME_FAILED
+    return EXIT_OK
+
+
+def _check_tools(backend):
+    """
+    Check for poppler once, before any file is looked at - rather than failing on every file.
+    :param backend: As given on the command line
+    :return: The backend to use - None if poppler is needed and missing (the error has been printed)
+    """
+    if backend == "pdfminer":
+        return backend
+
+    from cameron_pdf_tools.tools import ToolNotFoundError, require_tools
+
+    try:
+        require_tools({"pdfinfo": ("-meta",)})
+    except ToolNotFoundError as e:
+        if backend == "poppler":
+            print("cameron-pdf: {}".format(e), file=sys.stderr)
+            return None
+        print("cameron-pdf: {} - using pdfminer only".format(e), file=sys.stderr)
+        return "pdfminer"
+    return backend
+
+
+def _run_parallel(paths, jobs, kwargs, limits=(None, None)):
+    """
+    Run process_file over paths in a pool of processes - pdfminer is pure python, so threads wouldn't help.
+    Yields results as they finish, keeping at most QUEUE_PER_JOB files per worker queued.
+    A worker which dies outright (a crash in a C extension, say) takes the pool - and every file in it - down with it.
+    The pool is then rebuilt and the files which were in it are run again one at a time, so that only the file which
+    crashes a worker gets an error line.
+    :param limits: The memory and cpu limits for the poppler processes the workers run
+    """
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+    from itertools import islice
+
+    paths = iter(paths)
+    # Files taken from paths but not yet run - after a submit to an already broken pool
+    queued = deque()
+    # Files which were in the pool when it broke - run alone, until each has succeeded or been shown to crash a worker
+    suspects = deque()
+    pending = set()
+    futures = dict()
+    executor = None
+    try:
+        while True:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=limits)
+
+            isolating = bool(suspects)
+            if isolating:
+                to_run = [suspects.popleft()] if not pending else []
+            else:
+                to_run = [queued.popleft() for _ in range(min(len(queued), jobs * QUEUE_PER_JOB - len(pending)))]
+                to_run.extend(islice(paths, jobs * QUEUE_PER_JOB - len(pending) - len(to_run)))
+            broken = False
+            for index, path in enumerate(to_run):
+                try:
+                    future = executor.submit(process_file, path, **kwargs)
+                except BrokenProcessPool:
+                    # The pool broke since the last wait - these never ran, so they go back where they came from
+                    if isolating:
+                        suspects.appendleft(path)
+                    else:
+                        queued.extendleft(reversed(to_run[index:]))
+                    broken = True
+                    break
+                futures[future] = path
+                pending.add(future)
+            if not pending and not broken:
+                break
+
+            if pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                finished = set()
+            if broken or any(isinstance(future.exception(), BrokenProcessPool) for future in finished):
+                # Everything still in the pool is lost with it - let it all finish failing
+                finished |= pending
+                wait(pending)
+                pending = set()
+                broken = True
+
+            crashed = []
+            for future in finished:
+                path = futures.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool as e:
+                    crashed.append((path, e))
+                except Exception as e:
+                    # The worker itself failed (not just the extraction)
+                    yield {"path": path, "ok": False, "error": {"type": type(e).__name__, "message": str(e)}}
+
+            if broken:
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = None
+                if len(crashed) == 1:
+                    # Alone in the pool - so this is the file which crashed it
+                    path, e = crashed[0]
+                    yield {"path": path, "ok": False, "error": {"type": type(e).__name__, "message": str(e)}}
+                else:
+                    suspects.extend(path for path, e in crashed)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
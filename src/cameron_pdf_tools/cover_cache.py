@@ -0,0 +1,23 @@
+# An on disk cache of rendered covers - so ingesting the same book twice doesn't render it twice.
+# A FileCache of jpgs - see file_cache.
+
+# file_hash is still imported from here
+from cameron_pdf_tools.file_cache import DEFAULT_MAX_SIZE, FileCache, file_hash
+
+
+class CoverCache(FileCache):
+    """
+    A size capped, least recently used, cache of cover images on disk.
+
+    Usage:
+
+        cache = CoverCache("/var/cache/covers")
+        info = read_info(outputdir, True, src=pdf_path, cover_cache=cache)
+    """
+
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param root: Directory to keep the cache in - created if it doesn't exist
+        :param max_size: Cap on the total size of the cached covers, in bytes
+        """
+        FileCache.__init__(self, root, max_size=max_size, ext=".jpg")
@@ -0,0 +1,288 @@
+
+# Finding duplicate pdfs - so each distinct file is only parsed once.
+# Exact duplicates are found in stages, each only looking at the files the last couldn't tell apart:
+#   - size (from stat - free)
+#   - a hash of the first and last HEAD_TAIL_SIZE bytes (cheap - most files of the same size differ near the start, or
+#     in the trailer at the end)
+#   - a hash of the whole file (read through mmap, a chunk at a time)
+# Hashing runs in threads - hashlib releases the GIL for large buffers, and the rest is waiting on the disk.
+#
+# Separately, files can be clustered by their XMP DocumentID (shared by every version of a document) and InstanceID
+# (shared by copies of one saved version) - these catch re-saved and lightly edited copies, which hashing can't.
+
+import hashlib
+import mmap
+import os
+
+from collections import defaultdict
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Bytes hashed from each end of a file in the partial hash stage
+HEAD_TAIL_SIZE = 64 * 1024
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def partial_hash(path, size=HEAD_TAIL_SIZE):
+    """
+    Hash the first and last size bytes of a file - the whole file if it's smaller than 2 * size.
+    :param path:
+    :param size:
+    :return: The sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        file_size = os.fstat(stream.fileno()).st_size
+        if file_size <= 2 * size:
+            digest.update(stream.read())
+        else:
+            digest.update(stream.read(size))
+            stream.seek(file_size - size)
+            digest.update(stream.read(size))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    """
+    Hash the whole of a file - through mmap, a chunk at a time.
+    :param path:
+    :return: The sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        if not os.fstat(stream.fileno()).st_size:
+            return digest.hexdigest()
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(mapped), HASH_CHUNK_SIZE):
+                    digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def _split_groups(groups, key_function, executor):
+    """
+    Split every group by the value of key_function for each of its paths - keeping only the groups of more than one.
+    :param groups: A list of lists of paths
+    :param key_function: Called with each path
+    :param executor: Runs the key_function calls
+    :return:
+    """
+    paths = [path for group in groups for path in group]
+    keys = dict()
+    for path, key in zip(paths, executor.map(_safe(key_function), paths)):
+        keys[path] = key
+
+    ans = []
+    for group in groups:
+        split = defaultdict(list)
+        for path in group:
+            # Files which couldn't be read are never duplicates
+            if keys[path] is not None:
+                split[keys[path]].append(path)
+        ans.extend(sub_group for sub_group in split.values() if len(sub_group) > 1)
+    return ans
+
+
+def _safe(function):
+    def call(path):
+        try:
+            return function(path)
+        except OSError:
+            return None
+
+    return call
+
+
+def find_duplicates(paths, workers=None):
+    """
+    Find the groups of files with identical content.
+    Hard links to one file count as duplicates of each other (and aren't hashed). A path given more than once is only
+    counted once.
+    :param paths: An iterable of paths
+    :param workers: Number of files to hash at once. Defaults to the number of CPUs.
+    :return: A list of groups - each a sorted list of two or more paths - sorted by their first path
+    """
+    workers = workers or os.cpu_count() or 1
+
+    by_size = defaultdict(list)
+    for path in dict.fromkeys(paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        by_size[st.st_size].append((path, (st.st_dev, st.st_ino)))
+
+    groups = []
+    for entries in by_size.values():
+        if len(entries) < 2:
+            continue
+        # Hard links - only one of each needs hashing
+        by_inode = defaultdict(list)
+        for path, inode in entries:
+            by_inode[inode].append(path)
+        groups.append([sorted(linked) for linked in by_inode.values()])
+
+    # Stand in for each set of hard links with its first path - expanded again at the end
+    links = {linked[0]: linked for group in groups for linked in group}
+    candidates = [[linked[0] for linked in group] for group in groups if len(group) > 1]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as executor:
+        candidates = _split_groups(candidates, partial_hash, executor)
+        candidates = _split_groups(candidates, full_hash, executor)
+
+    found = [sorted(path for first in group for path in links[first]) for group in candidates]
+    # Hard links with no other copy
+    grouped = set(first for group in candidates for first in group)
+    found.extend(linked for first, linked in links.items() if len(linked) > 1 and first not in grouped)
+    return sorted(found)
+
+
+def canonical_map(groups):
+    """
+    Map every duplicate to the copy which stands for its group (the first of the group).
+    :param groups: As returned by find_duplicates
+    :return: A dictionary keyed by the path of each copy (canonical copies excluded) and valued with its canonical path
+    """
+    # A group can name its canonical copy twice (if it was given twice to find_duplicates, say) - it mustn't become a
+    # copy of itself
+    return {path: group[0] for group in groups for path in group[1:] if path != group[0]}
+
+
+_RDF_NS = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+_XMP_MM_NS = "{http://ns.adobe.com/xap/1.0/mm/}"
+
+
+def parse_xmp_ids(xmp):
+    """
+    Pull the DocumentID and InstanceID out of an XMP packet.
+    Only the document's own ids are read - not those in its history, or of the documents it was derived from. Both the
+    element and the attribute (short) forms of RDF are understood.
+    :param xmp: The XMP, as bytes or a string
+    :return: A tuple (document_id, instance_id) - either None if it's not set
+    """
+    from xml.etree import ElementTree as ET
+
+    ids = {"DocumentID": None, "InstanceID": None}
+    try:
+        tree = ET.fromstring(xmp)
+    except ET.ParseError:
+        return None, None
+    for desc in tree.iter(_RDF_NS + "Description"):
+        for name in ids:
+            if ids[name] is not None:
+                continue
+            value = desc.get(_XMP_MM_NS + name)
+            if value is None:
+                el = desc.find(_XMP_MM_NS + name)
+                value = el.text if el is not None else None
+            if value:
+                ids[name] = value.strip()
+    return ids["DocumentID"], ids["InstanceID"]
+
+
+def xmp_ids(path):
+    """
+    Read the XMP DocumentID and InstanceID of a pdf - without extracting the rest of its metadata.
+    :param path:
+    :return: A tuple (document_id, instance_id) - either None if it's not set
+    """
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    with open(path, "rb") as stream:
+        document = PDFDocument(PDFParser(stream))
+        if "Metadata" not in document.catalog:
+            return None, None
+        xmp = resolve1(document.catalog["Metadata"]).get_data()
+    return parse_xmp_ids(xmp)
+
+
+def cluster_by_xmp(paths, metadata=None, workers=None):
+    """
+    Cluster files by their XMP DocumentID and InstanceID.
+    :param paths: An iterable of paths
+    :param metadata: A mapping of path -> metadata dictionary - the "document_id" and "instance_id" from get_metadata
+                     are used for files in it which have them. Other files have their ids read with xmp_ids.
+    :param workers: Number of files to read at once. Defaults to the number of CPUs.
+    :return: A dictionary with keys "document_id" and "instance_id" - each valued with a dictionary keyed by the id and
+             valued with the sorted list of the paths which have it. Only ids shared by two or more files are included.
+    """
+    workers = workers or os.cpu_count() or 1
+    metadata = dict() if metadata is None else metadata
+
+    ids = dict()
+    to_read = []
+    for path in paths:
+        md = metadata.get(path)
+        if md is None or not ("document_id" in md or "instance_id" in md):
+            to_read.append(path)
+        else:
+            ids[path] = (md.get("document_id"), md.get("instance_id"))
+
+    def read(path):
+        try:
+            return xmp_ids(path)
+        except Exception:
+            return None, None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="xmp") as executor:
+        for path, path_ids in zip(to_read, executor.map(read, to_read)):
+            ids[path] = path_ids
+
+    clusters = {"document_id": defaultdict(list), "instance_id": defaultdict(list)}
+    for path, (document_id, instance_id) in ids.items():
+        if document_id:
+            clusters["document_id"][document_id].append(path)
+        if instance_id:
+            clusters["instance_id"][instance_id].append(path)
+    return {
+        kind: {key: sorted(group) for key, group in found.items() if len(group) > 1}
+        for kind, found in clusters.items()
+    }
+
+
+def extract_deduplicated(paths, workers=None, backend="auto", groups=None):
+    """
+    Extract the metadata of many files - parsing only one copy of each set of exact duplicates.
+    A generator - yields (path, metadata, canonical_path) as each file's metadata is known. metadata is the exception
+    raised if extraction failed. canonical_path is the copy which was actually parsed (path itself for unique files).
+    Copies get their own copy of the metadata dictionary. A path given more than once is only yielded once.
+    :param paths: An iterable of paths
+    :param workers: Number of processes to extract with. Defaults to the number of CPUs.
+    :param backend: As for backends.extract
+    :param groups: The result of find_duplicates for these paths, if it's already known
+    :return:
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from functools import partial
+
+    from cameron_pdf_tools.backends import extract
+
+    paths = list(dict.fromkeys(paths))
+    workers = workers or os.cpu_count() or 1
+    if groups is None:
+        groups = find_duplicates(paths, workers=workers)
+    canonical = canonical_map(groups)
+    copies = defaultdict(list)
+    for path, first in canonical.items():
+        copies[first].append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(partial(extract, backend=backend), path): path for path in paths if path not in canonical
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                md = future.result()
+            except Exception as e:
+                md = e
+            yield path, md, path
+            for copy in copies.get(path, ()):
+                yield copy, (md if isinstance(md, Exception) else deepcopy(md)), path
@@ -0,0 +1,235 @@
+
+# Writing metadata results out in bulk - to SQLite, CSV or JSONL.
+# Every exporter takes an iterator of (path, metadata) - as yielded by PopplerPool.map_info, extract_deduplicated,
+# e.t.c. - where metadata is the dictionary get_metadata returns or the exception raised for that file. Results are
+# written as they arrive, so memory use doesn't grow with the number of files.
+#
+# SQLite and CSV have a fixed set of columns (COLUMNS). List fields (author, tags, producer, ...) are flattened into one
+# string, joined with LIST_SEPARATOR. Anything else in the metadata goes into the "extra" column, as json. JSONL keeps
+# the metadata as it is.
+
+import csv
+import json
+import os
+import sqlite3
+
+from itertools import islice
+
+
+COLUMNS = (
+    "path",
+    "title",
+    "author",
+    "tags",
+    "producer",
+    "publisher",
+    "creator",
+    "timestamp",
+    "last_modified",
+    "uuid",
+    "document_id",
+    "instance_id",
+    "backend",
+    "extra",
+    "error",
+)
+
+LIST_SEPARATOR = "; "
+
+# Rows written per transaction
+BATCH_SIZE = 1000
+
+# Indexes made on the SQLite table - once the rows are loaded
+SQLITE_INDEXED_COLUMNS = ("title", "author", "document_id", "uuid")
+
+# Modes each kind of exporter takes - CSV and JSONL can't be updated in place, so only added to or rewritten
+SQLITE_MODES = ("upsert", "keep_existing", "replace")
+FILE_MODES = ("append", "replace")
+
+
+def _flatten_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return LIST_SEPARATOR.join(str(v) for v in value if v is not None)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def flatten_metadata(path, md):
+    """
+    Turn one result into a row - a dictionary keyed by each of COLUMNS.
+    :param path:
+    :param md: A metadata dictionary - or the exception raised trying to get one
+    :return:
+    """
+    row = dict.fromkeys(COLUMNS)
+    row["path"] = path
+    if isinstance(md, BaseException):
+        row["error"] = "{}: {}".format(type(md).__name__, md)
+        return row
+    if md is None:
+        return row
+
+    extra = dict()
+    for key, value in md.items():
+        if key in row and key not in ("path", "extra", "error"):
+            row[key] = _flatten_value(value)
+        else:
+            extra[key] = value
+    if extra:
+        row["extra"] = json.dumps(extra, ensure_ascii=False, default=str)
+    return row
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_sqlite(results, db_path, table="metadata", mode="upsert", batch_size=BATCH_SIZE):
+    """
+    Write results to a SQLite table (created if need be) - one row per file, keyed by path.
+    The database is put in WAL mode, rows are written with executemany a batch per transaction, and indexes are made
+    once everything is loaded.
+    :param results: An iterator of (path, metadata)
+    :param db_path:
+    :param table:
+    :param mode: "upsert" - rows for paths already in the table are replaced by the new result. "keep_existing" - rows
+                 for paths already in the table are kept, and the new result for them silently dropped (INSERT OR
+                 IGNORE) - for filling in files missing from an earlier run. "replace" - the table is emptied first.
+    :param batch_size: Rows per transaction
+    :return: The number of results written
+    """
+    if mode not in SQLITE_MODES:
+        raise ValueError("Unknown mode for sqlite - {}".format(mode))
+    if not table.isidentifier():
+        raise ValueError("Bad table name - {}".format(table))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            if mode == "replace":
+                conn.execute("DROP TABLE IF EXISTS {}".format(table))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS {} ({})".format(
+                    table,
+                    ", ".join("{} TEXT{}".format(c, " PRIMARY KEY" if c == "path" else "") for c in COLUMNS),
+                )
+            )
+
+        verb = "INSERT OR IGNORE" if mode == "keep_existing" else "INSERT OR REPLACE"
+        sql = "{} INTO {} ({}) VALUES ({})".format(verb, table, ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)))
+
+        count = 0
+        rows = (tuple(row[c] for c in COLUMNS) for row in (flatten_metadata(path, md) for path, md in results))
+        for batch in _batches(rows, batch_size):
+            with conn:
+                conn.executemany(sql, batch)
+            count += len(batch)
+
+        with conn:
+            for column in SQLITE_INDEXED_COLUMNS:
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})".format(
+                        table=table, column=column
+                    )
+                )
+    finally:
+        conn.close()
+    return count
+
+
+def _open_for(out, append):
+    """
+    :return: A tuple of the open file, whether it needs closing, and whether it was empty
+    """
+    if isinstance(out, str):
+        stream = open(out, "a" if append else "w", encoding="utf-8", newline="")
+        return stream, True, stream.tell() == 0
+    return out, False, True
+
+
+def export_csv(results, out, append=False):
+    """
+    Write results to CSV - a header line, then one row per file.
+    CSV can't be updated in place - for incremental runs either append (later rows for a path supersede earlier ones)
+    or use SQLite.
+    :param results: An iterator of (path, metadata)
+    :param out: A path, or a text file opened with newline=""
+    :param append: If True, add to the end of an existing file (the header is only written if the file is empty)
+    :return: The number of results written
+    """
+    stream, close, empty = _open_for(out, append)
+    try:
+        writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+        if empty:
+            writer.writeheader()
+        count = 0
+        for path, md in results:
+            writer.writerow(flatten_metadata(path, md))
+            count += 1
+    finally:
+        if close:
+            stream.close()
+    return count
+
+
+def export_jsonl(results, out, append=False):
+    """
+    Write results as json lines - {"path": ..., "metadata": {...}} or {"path": ..., "error": "..."} - the metadata kept
+    as it is, lists and all.
+    :param results: An iterator of (path, metadata)
+    :param out: A path, or a text file
+    :param append: If True, add to the end of an existing file
+    :return: The number of results written
+    """
+    stream, close, _ = _open_for(out, append)
+    try:
+        count = 0
+        for path, md in results:
+            if isinstance(md, BaseException):
+                line = {"path": path, "error": "{}: {}".format(type(md).__name__, md)}
+            else:
+                line = {"path": path, "metadata": md}
+            stream.write(json.dumps(line, ensure_ascii=False, default=str))
+            stream.write("\n")
+            count += 1
+    finally:
+        if close:
+            stream.close()
+    return count
+
+
+def export(results, out_path, fmt=None, mode=None, **kwargs):
+    """
+    Write results to a file - the format chosen from its extension if not given.
+    :param results: An iterator of (path, metadata)
+    :param out_path:
+    :param fmt: "sqlite", "csv" or "jsonl". Defaults from the extension (.db, .sqlite and .sqlite3 are sqlite).
+    :param mode: For sqlite, as for export_sqlite - defaults to "upsert". For csv and jsonl, "replace" (rewrite the
+                 file - the default, so running again doesn't duplicate rows) or "append" (add to the end).
+    :param kwargs: Passed to the exporter
+    :return: The number of results written
+    """
+    if fmt is None:
+        extension = os.path.splitext(out_path)[1].lower()
+        fmt = {".db": "sqlite", ".sqlite": "sqlite", ".sqlite3": "sqlite", ".csv": "csv"}.get(extension, "jsonl")
+
+    if fmt == "sqlite":
+        return export_sqlite(results, out_path, mode="upsert" if mode is None else mode, **kwargs)
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("Unknown format - {}".format(fmt))
+    mode = "replace" if mode is None else mode
+    if mode not in FILE_MODES:
+        raise ValueError("Unknown mode for {} - {} (only sqlite can be updated in place)".format(fmt, mode))
+    if fmt == "csv":
+        return export_csv(results, out_path, append=mode == "append", **kwargs)
+    return export_jsonl(results, out_path, append=mode == "append", **kwargs)
@@ -0,0 +1,233 @@
+
+# An on disk cache of files made from pdfs - rendered covers, OCRed copies - so the same pdf turning up twice doesn't
+# cost the work twice.
+# Entries are keyed by a hash of the pdf's content plus the settings the file was made with, and stored in a sharded
+# directory tree (ab/cd/abcd....ext) to keep directories small.
+# Several processes can share one cache - entries are written to a temporary file and moved into place, so a reader
+# never sees a partial file.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+# After an eviction pass the cache is brought down to this fraction of its maximum size - so evictions aren't needed
+# after every put
+EVICT_TO_FRACTION = 0.9
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path):
+    """
+    Return the sha256 hex digest of a file's content.
+    :param path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileCache(object):
+    """
+    A size capped, least recently used, cache of files on disk.
+
+    Usage:
+
+        cache = FileCache("/var/cache/ocred", ext=".pdf")
+        key = cache.key(pdf_path, ocrmypdf_args="--deskew")
+        if not cache.fetch(key, output):
+            ...
+            cache.put(key, output)
+    """
+
+    def __init__(self, root, max_size=DEFAULT_MAX_SIZE, ext=""):
+        """
+        :param root: Directory to keep the cache in - created if it doesn't exist
+        :param max_size: Cap on the total size of the cached files, in bytes
+        :param ext: Extension given to the cached files, unless the call says otherwise
+        """
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.ext = ext
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, pdfpath, **render_params):
+        """
+        The cache key for a file made from a pdf with the given parameters.
+        :param pdfpath:
+        :param render_params: Anything which changes the file made (format, dpi, tool arguments e.t.c.)
+        :return:
+        """
+        params = ",".join("{}={}".format(k, render_params[k]) for k in sorted(render_params))
+        if not params:
+            return file_hash(pdfpath)
+        return hashlib.sha256(
+            (file_hash(pdfpath) + "|" + params).encode("utf-8")
+        ).hexdigest()
+
+    def path_for_key(self, key, ext=None):
+        """
+        Where the file for a key lives (whether or not it exists).
+        :param key:
+        :param ext: Defaults to the cache's ext
+        :return:
+        """
+        if ext is None:
+            ext = self.ext
+        return os.path.join(self.root, key[:2], key[2:4], key + ext)
+
+    def get(self, key, ext=None):
+        """
+        Return the path to the cached file for a key - or None if there isn't one.
+        A hit marks the entry as recently used.
+        :param key:
+        :param ext:
+        :return:
+        """
+        path = self.path_for_key(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def fetch(self, key, dest, ext=None):
+        """
+        Copy the cached file for a key to dest.
+        :param key:
+        :param dest:
+        :param ext:
+        :return: True if the file was in the cache (and has been copied), False otherwise
+        """
+        path = self.get(key, ext)
+        if path is None:
+            return False
+        try:
+            shutil.copyfile(path, dest)
+        except FileNotFoundError:
+            # Evicted by another process between the lookup and the copy
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        return True
+
+    def put(self, key, src, ext=None):
+        """
+        Add a file to the cache - copying it from src.
+        :param key:
+        :param src: Path to the file
+        :param ext:
+        :return: The path of the cached file
+        """
+        path = self.path_for_key(key, ext)
+        shard = os.path.dirname(path)
+        os.makedirs(shard, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=shard, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp, open(src, "rb") as stream:
+                shutil.copyfileobj(stream, tmp)
+            # Replacing an entry - its old size is no longer in the cache
+            try:
+                old_size = os.path.getsize(path)
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        with self._lock:
+            self._size += os.path.getsize(path) - old_size
+            over = self._size > self.max_size
+        if over:
+            self.evict()
+        return path
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache is below EVICT_TO_FRACTION of its maximum size.
+        The cache directory is rescanned, so files added by other processes are accounted for.
+        :return:
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_size * EVICT_TO_FRACTION
+
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process got there first
+                pass
+            else:
+                evicted += 1
+            total -= size
+
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+
+    def _entries(self):
+        """
+        Scan the cache directory.
+        :return: A list of (path, size, last_used) tuples, one per cached file
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.startswith(".tmp-"):
+                    # Left behind by a writer which died - anything more than an hour old is abandoned
+                    try:
+                        if os.stat(path).st_mtime < time.time() - 3600:
+                            os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def stats(self):
+        """
+        The hit, miss and eviction counters of this cache object (not of other processes using the same directory),
+        along with the size of the cache as last seen.
+        :return:
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": self._size,
+            }
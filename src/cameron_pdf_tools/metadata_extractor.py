@@ -26,6 +26,8 @@ from collections import defaultdict
 from xml.etree import ElementTree as ET
 
 from cameron_pdf_tools.constants import iswindows
+from cameron_pdf_tools.tools import find_tool, probe_tool
+from cameron_pdf_tools import process_limits
 
 
 PRODUCER_DROP_REGEX_SET = {r".*LaTeX.*", r".*Acrobat.*"}
@@ -66,18 +68,32 @@ class PdfParseError(Exception):
         return repr(self.argument)
 
 
-def get_metadata(stream):
+def get_metadata(stream, lazy_xref=False, bounded=None):
     """
     Takes a path to a PDF file. Tries to parse it for metadata
     :param stream: The PDF file to be parsed
+    :param lazy_xref: If True, only read as much of the xref chain as is needed for the newest metadata - much quicker
+                      for files with many incremental updates (see xref_revisions)
+    :param bounded: Keep memory use within limits, raising bounded_memory.ResourceLimitError rather than going over
+                    them - True for the default limits, or a bounded_memory.MemoryLimits. Implies lazy_xref.
     :return MetaData object: A metadata object
     """
     print("In get_metadata")
 
     # https://stackoverflow.com/questions/14209214/reading-the-pdf-properties-metadata-in-python
     stream.seek(0)
-    parser = PDFParser(stream)
-    document = PDFDocument(parser)
+    if bounded:
+        from cameron_pdf_tools.bounded_memory import open_bounded
+
+        document = open_bounded(stream, limits=None if bounded is True else bounded)
+    elif lazy_xref:
+        parser = PDFParser(stream)
+        from cameron_pdf_tools.xref_revisions import LazyPDFDocument
+
+        document = LazyPDFDocument(parser)
+    else:
+        parser = PDFParser(stream)
+        document = PDFDocument(parser)
 
     # The info metadata
     # document.info returns a list, with the first element being what appears to be the info dict
@@ -88,21 +104,32 @@ def get_metadata(stream):
 
     # Finding the XMP data, if it exists, and processing it into dictionary form
     if "Metadata" in document.catalog:
-        xmp_metadata = resolve1(document.catalog["Metadata"]).get_data()
+        if bounded:
+            xmp_metadata = document.read_xmp()
+        else:
+            xmp_metadata = resolve1(document.catalog["Metadata"]).get_data()
         xmp_metadata_dict = xmp_to_dict(xmp_metadata)
         metadata_return = process_xmp_metadata_dict(xmp_metadata_dict, metadata_return)
 
     return metadata_return
 
 
-def get_metadata_inplace(target_file):
+def get_metadata_inplace(target_file, guess_missing_title=False, lazy_xref=False, bounded=None):
     """
     Takes a path to a PDF file. Tries to parse it for metadata
     :param target_file: The PDF file to be parsed
+    :param guess_missing_title: If True, and the metadata has no title, guess one from the text of the first page
+    :param lazy_xref: As for get_metadata
+    :param bounded: As for get_metadata
     :return MetaData object: A metadata object
     """
     with open(target_file, "rb") as target_pdf_stream:
-        return get_metadata(target_pdf_stream)
+        md = get_metadata(target_pdf_stream, lazy_xref=lazy_xref, bounded=bounded)
+        if guess_missing_title:
+            from cameron_pdf_tools.title_guess import fill_missing_title
+
+            fill_missing_title(md, target_pdf_stream)
+        return md
 
 
 
@@ -113,25 +140,54 @@ get_quick_metadata = get_metadata
 ########################################################################################################################
 
 
-def read_info(outputdir, get_cover):
+# Everything which changes how read_info renders the cover - used to key the cover cache
+COVER_RENDER_PARAMS = {"fmt": "jpeg", "cropbox": True, "singlefile": True}
+
+
+def read_info(
+    outputdir, get_cover, src="src.pdf", timeout=None, cover_cache=None, limits=None, quarantine=None
+):
     """
     Read info dict and cover from a pdf file named src.pdf in outputdir.
-    Note that this function changes the cwd to outputdir and is therefore not thread safe.
-    Run it using fork_job. This is necessary as there is no safe way to pass unicode paths via command line arguments.
-    This also ensures that if poppler crashes, no stale file handles are left for the original file, only for src.pdf.
-    :param outputdir:
-    :param get_cover:
+    poppler is run with outputdir as its working directory (the cwd of this process is never changed) so this is safe
+    to call from several threads at once. If poppler crashes, no stale file handles are left for the original file, only
+    for src.pdf.
+    :param outputdir: Directory holding the pdf - the cover is written here as cover.jpg
+    :param get_cover: If True, render the first page as the cover
+    :param src: Name of the pdf in outputdir - or an absolute path to a pdf elsewhere
+    :param timeout: Seconds to allow each poppler call before killing it. None waits forever.
+    :param cover_cache: A CoverCache - if the cover of this pdf is in it, it's copied rather than rendered
+    :param limits: A process_limits.ResourceLimits for the poppler calls - defaults to process_limits.default_limits
+    :param quarantine: A process_limits.Quarantine - quarantined files are skipped, and files which time out (or hit
+                       one of the limits) are added to it
     :return:
     """
-    os.chdir(outputdir)
+    outputdir = os.path.abspath(outputdir)
+    src = os.path.join(outputdir, src)
+    if quarantine is not None and src in quarantine:
+        print("Skipping quarantined file: %s" % src)
+        return None
     pdfinfo = get_tool("pdfinfo")
     pdftoppm = get_tool("pdftoppm")
     ans = {}
 
+    # ISO dates, rather than dates in the locale's format - so they can be normalized like pdfminer's
+    cmd = [pdfinfo, "-meta", "-enc", "UTF-8"]
+    if "-isodates" in probe_tool("pdfinfo").flags:
+        cmd.append("-isodates")
+    cmd.append(src)
     try:
-        raw = subprocess.check_output([pdfinfo, "-meta", "-enc", "UTF-8", "src.pdf"])
+        raw = process_limits.check_output(cmd, cwd=outputdir, timeout=timeout, limits=limits)
     except subprocess.CalledProcessError as e:
         print("pdfinfo errored out with return code: %d" % e.returncode)
+        reason = process_limits.hit_limit(e.returncode, limits, e.stderr)
+        if quarantine is not None and reason is not None:
+            quarantine.add(src, "pdfinfo " + reason)
+        return None
+    except subprocess.TimeoutExpired:
+        print("pdfinfo timed out after %s seconds" % timeout)
+        if quarantine is not None:
+            quarantine.add(src, "pdfinfo timeout")
         return None
 
     # The XMP metadata could be in an encoding other than UTF-8, so split it out before trying to decode raw
@@ -153,17 +209,50 @@ def read_info(outputdir, get_cover):
             ans[field] = val.strip()
 
     if get_cover:
+        cover_path = os.path.join(outputdir, "cover.jpg")
+        cover_key = None
+        if cover_cache is not None:
+            cover_key = cover_cache.key(src, **COVER_RENDER_PARAMS)
+            if cover_cache.fetch(cover_key, cover_path):
+                return ans
+
         try:
-            subprocess.check_call(
-                [pdftoppm, "-singlefile", "-jpeg", "-cropbox", "src.pdf", "cover"]
+            process_limits.check_call(
+                [pdftoppm, "-singlefile", "-jpeg", "-cropbox", src, os.path.join(outputdir, "cover")],
+                cwd=outputdir,
+                timeout=timeout,
+                limits=limits,
             )
         except subprocess.CalledProcessError as e:
             print("pdftoppm errored out with return code: %d" % e.returncode)
+            reason = process_limits.hit_limit(e.returncode, limits, e.stderr)
+            if quarantine is not None and reason is not None:
+                quarantine.add(src, "pdftoppm " + reason)
+        except subprocess.TimeoutExpired:
+            print("pdftoppm timed out after %s seconds" % timeout)
+            if quarantine is not None:
+                quarantine.add(src, "pdftoppm timeout")
+        else:
+            if cover_key is not None and os.path.exists(cover_path):
+                cover_cache.put(cover_key, cover_path)
 
     return ans
 
 
-def page_images(pdfpath, outputdir, first=1, last=1):
+def page_images(pdfpath, outputdir, first=1, last=1, timeout=None, limits=None, quarantine=None):
+    """
+    Render pages first to last (inclusive) of a pdf as page-images-N.jpg files in outputdir.
+    :param pdfpath:
+    :param outputdir:
+    :param first:
+    :param last:
+    :param timeout: Seconds to allow pdftoppm before killing it. None waits forever.
+    :param limits: As for read_info
+    :param quarantine: As for read_info - rendering a quarantined file raises ValueError
+    :return:
+    """
+    if quarantine is not None and pdfpath in quarantine:
+        raise ValueError("Failed to render PDF, %s is quarantined" % pdfpath)
     pdf_to_ppm = get_tool("pdftoppm")
     outputdir = os.path.abspath(outputdir)
     args = {}
@@ -174,7 +263,7 @@ def page_images(pdfpath, outputdir, first=1, last=1):
         args["creationflags"] = w.HIGH_PRIORITY_CLASS | w.CREATE_NO_WINDOW
 
     try:
-        subprocess.check_call(
+        process_limits.check_call(
             [
                 pdf_to_ppm,
                 "-cropbox",
@@ -186,10 +275,19 @@ def page_images(pdfpath, outputdir, first=1, last=1):
                 pdfpath,
                 os.path.join(outputdir, "page-images"),
             ],
+            timeout=timeout,
+            limits=limits,
             **args
         )
     except subprocess.CalledProcessError as e:
+        reason = process_limits.hit_limit(e.returncode, limits, e.stderr)
+        if quarantine is not None and reason is not None:
+            quarantine.add(pdfpath, "pdftoppm " + reason)
         raise ValueError("Failed to render PDF, pdftoppm errorcode: %s" % e.returncode)
+    except subprocess.TimeoutExpired:
+        if quarantine is not None:
+            quarantine.add(pdfpath, "pdftoppm timeout")
+        raise ValueError("Failed to render PDF, pdftoppm timed out after %s seconds" % timeout)
 
 
 
@@ -287,24 +385,56 @@ def process_metadata_info_dict(info_dict, md):
 def get_tool(tool_name):
     """
     Return the path to a tool's binary.
+    The lookup is cached - see tools.find_tool.
     :param tool_name:
-    :return:
+    :return: The path - or None if the tool cannot be found
     """
-    from cameron_pdf_tools.constants import PDFTOHTML
+    return find_tool(tool_name)
+
 
-    base = os.path.dirname(PDFTOHTML)
-    tool_path = os.path.join(base, tool_name)
-    if os.path.exists(tool_path):
-        return tool_path
+# A pdf date - D:YYYYMMDDHHmmSSOHH'mm' - where everything after the year is optional (and the D: is sometimes missing)
+_pdf_date_pat = re.compile(
+    r"^(?:D:)?(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?\s*(?:([Zz+\-])\s*(?:(\d{2})'?\s*(?:(\d{2})'?)?)?)?$"
+)
 
-    base_paths = ["/usr", "/usr/bin"]
-    for base_path in base_paths:
-        cand_tool_path = os.path.join(base_path, tool_name)
-        if os.path.exists(cand_tool_path):
-            return cand_tool_path
+# An ISO 8601 date - as in XMP, or from pdfinfo -isodates
+_iso_date_pat = re.compile(
+    r"^(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?(?:[T ](\d{2}):(\d{2})(?::(\d{2}))?(?:\.\d+)?)?"
+    r"(?:([Zz+\-])(?:(\d{2})(?::?(\d{2}))?)?)?$"
+)
 
-    # If the tool cannot be found then return None
-    return None
+# pdfinfo's own format, when it can't give ISO dates - "Mon Jan  1 12:00:00 2020 CET"
+_pdfinfo_date_format = "%a %b %d %H:%M:%S %Y"
+
+
+def normalize_pdf_date(value):
+    """
+    Put a date - from an Info dictionary, XMP or pdfinfo - in one form: YYYY-MM-DDTHH:MM:SS, followed by the UTC offset
+    (+HH:MM) if the date gave one. So every backend gives the same date for the same file.
+    :param value:
+    :return: The normalized date - or value as it was, if it can't be read as a date
+    """
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    match = _pdf_date_pat.match(text) or _iso_date_pat.match(text)
+    if match is None:
+        import time
+
+        try:
+            parsed = time.strptime(" ".join(text.split()[:5]), _pdfinfo_date_format)
+        except ValueError:
+            return value
+        return time.strftime("%Y-%m-%dT%H:%M:%S", parsed)
+
+    year, month, day, hour, minute, second, sign, tz_hour, tz_minute = match.groups()
+    ans = "{}-{}-{}T{}:{}:{}".format(year, month or "01", day or "01", hour or "00", minute or "00", second or "00")
+    if sign is not None:
+        if sign in "Zz":
+            ans += "+00:00"
+        else:
+            ans += "{}{}:{}".format(sign, tz_hour or "00", tz_minute or "00")
+    return ans
 
 
 def process_key_value_pair(key, value, info_dict_keys, md):
@@ -353,7 +483,7 @@ def process_key_value_pair(key, value, info_dict_keys, md):
             md["tags"] = tags
 
     elif key == "last_modified":
-        md["last_modified"] = value
+        md["last_modified"] = normalize_pdf_date(value)
 
     # Another term for producer - should be used iff something more suitable is not present
     elif key == "llc":
@@ -395,7 +525,7 @@ def process_key_value_pair(key, value, info_dict_keys, md):
             md["tags"] = [value, ]
 
     elif key == "timestamp":
-        md["timestamp"] = value
+        md["timestamp"] = normalize_pdf_date(value)
 
     elif key == "title":
         md["title"] = value
@@ -453,9 +583,10 @@ def process_xmp_metadata_dict(xmp_metadata_dict, metadata_return):
         for field in internal_identifier_dict.keys():
 
             if field == "InstanceID":
-                pass
+                metadata_return["instance_id"] = internal_identifier_dict[field]
             elif field == "DocumentID":
                 identifier = internal_identifier_dict[field]
+                metadata_return["document_id"] = identifier
 
                 id_type_tokens = identifier.split(":")
                 if len(id_type_tokens) == 1:
@@ -679,16 +810,7 @@ def xmp_to_dict(xmp):
 
 if __name__ == "__main__":
 
-    test_path = "/home/eric/pdf_test_file_4.pdf"
-
-    assert os.path.exists(test_path) and os.path.isfile(test_path)
-
-    md_dict = get_metadata_inplace(test_path)
-
-    print("-------------------- METADATA DICT --------------------")
-    print(md_dict)
-
-
-
-
+    # Kept so the module can still be run directly - cameron_pdf_tools.cli is the command line interface
+    from cameron_pdf_tools.cli import main
 
+    raise SystemExit(main())
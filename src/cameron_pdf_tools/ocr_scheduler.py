@@ -0,0 +1,383 @@
+
+# Running ocrmypdf over the pdfs which need it (see the README) - a queue of jobs, run a few at a time.
+#   - Only files without a text layer (text_layer.needs_ocr) are queued, unless forced.
+#   - Each ocrmypdf runs with its own --jobs, so the number run at once is the cpu budget divided by that.
+#   - Jobs run highest priority first, then by page count (smallest first by default - so many files finish early).
+#   - Progress is checkpointed to a json lines file - after a crash, a new scheduler on the same checkpoint skips what
+#     was done and picks up what wasn't.
+#   - Outputs are cached by the content hash of the input (and the ocrmypdf arguments), so a scan which turns up twice
+#     is only OCRed once.
+#   - Optionally, page by page - only the pages which are scans (no text, but images) are OCRed, and spliced back into
+#     the original. Documents which are mostly born digital, with a few scanned inserts, then cost only the inserts.
+# As with the poppler tools, each job is a subprocess - a thread per running job is all that's needed.
+
+import heapq
+import itertools
+import json
+import os
+import subprocess
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cameron_pdf_tools.file_cache import FileCache
+from cameron_pdf_tools.tools import find_tool
+from cameron_pdf_tools import process_limits
+
+
+# ocrmypdf's exit code when the file already has text (and neither --skip-text nor --force-ocr was given)
+OCRMYPDF_PRIOR_OCR_FOUND = 6
+
+# Large enough for a good stretch of scans - OCRed pdfs are big
+DEFAULT_CACHE_SIZE = 20 * 1024 ** 3
+
+ORDERS = ("small_first", "large_first", "fifo")
+
+
+class OCRError(Exception):
+    """
+    Raised when ocrmypdf fails on a file - or can't be found.
+    """
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _Checkpoint(object):
+    """
+    A json lines journal of jobs - {"path", "output", "status"} - the last line for a path wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = dict()
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as stream:
+                for line in stream:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.entries[entry["path"]] = entry
+
+    def record(self, path, output, status, **extra):
+        entry = dict(extra, path=path, output=output, status=status)
+        with self._lock:
+            self.entries[path] = entry
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as stream:
+                    stream.write(json.dumps(entry) + "\n")
+                    stream.flush()
+                    os.fsync(stream.fileno())
+
+
+class OCRScheduler(object):
+    """
+    A prioritized queue of ocrmypdf jobs.
+
+    Usage:
+
+        scheduler = OCRScheduler("/srv/ocred", checkpoint="/srv/ocr-checkpoint.jsonl", jobs_per_task=2)
+        for path in pdf_paths:
+            scheduler.submit(path)
+        for path, status in scheduler.run():
+            ...
+    """
+
+    def __init__(
+        self,
+        output_dir=None,
+        checkpoint=None,
+        cache=None,
+        cpu_budget=None,
+        jobs_per_task=1,
+        ocrmypdf_args=(),
+        order="small_first",
+        timeout=None,
+        limits=None,
+        quarantine=None,
+        page_selective=False,
+    ):
+        """
+        :param output_dir: Where OCRed files are written (under the input's name). If None, each is written next to
+                           its input, as name.ocr.pdf
+        :param checkpoint: Path to the checkpoint file - created if it doesn't exist, resumed from if it does
+        :param cache: A file_cache.FileCache (or the path of a directory to keep one in) for OCRed outputs. None
+                      disables caching.
+        :param cpu_budget: Number of cpus to use in all. Defaults to the number of CPUs.
+        :param jobs_per_task: The --jobs given to each ocrmypdf
+        :param ocrmypdf_args: Further arguments for every ocrmypdf (e.g. ["--deskew", "-l", "eng+fra"])
+        :param order: "small_first" or "large_first" (by page count) or "fifo" - among jobs of equal priority
+        :param timeout: Seconds to allow each ocrmypdf before killing it. None waits forever.
+        :param limits: A process_limits.ResourceLimits for each ocrmypdf. Defaults to the memory limit of
+                       process_limits.default_limits, with no cpu limit - OCR's cpu time grows with the page count.
+        :param quarantine: A process_limits.Quarantine - files which time out are added, and skipped after
+        :param page_selective: If True, only OCR the pages which are scans (see ocr_image_pages) - and queue any file
+                               which has such a page
+        """
+        if order not in ORDERS:
+            raise ValueError("Unknown order - {}".format(order))
+        self.output_dir = output_dir
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        self.checkpoint = _Checkpoint(checkpoint)
+        if isinstance(cache, str):
+            cache = FileCache(cache, max_size=DEFAULT_CACHE_SIZE, ext=".pdf")
+        self.cache = cache
+        self.jobs_per_task = max(1, jobs_per_task)
+        self.workers = max(1, (cpu_budget or os.cpu_count() or 1) // self.jobs_per_task)
+        self.ocrmypdf_args = list(ocrmypdf_args)
+        self.order = order
+        self.timeout = timeout
+        if limits is None:
+            limits = process_limits.ResourceLimits(memory=process_limits.default_limits.memory, cpu=None)
+        self.limits = limits
+        self.quarantine = quarantine
+        self.page_selective = page_selective
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._outputs = dict()
+        # Indexes of the scanned pages of queued files, as found by submit - so ocr_image_pages needn't look again
+        self._scanned = dict()
+
+        # Jobs queued (or running) when the last run stopped - resumed. Quarantined files (quite likely why the last run
+        # stopped) are skipped - but left queued in the checkpoint, to be picked up if they're released.
+        for entry in self.checkpoint.entries.values():
+            if entry["status"] in ("queued", "running"):
+                if self.quarantine is not None and entry["path"] in self.quarantine:
+                    continue
+                self._push(entry["path"], entry["output"], entry.get("priority", 0), entry.get("pages"))
+
+    def output_for(self, pdfpath):
+        """
+        Where the OCRed version of a file is written (by default).
+        :param pdfpath:
+        :return:
+        """
+        if self.output_dir is None:
+            stem, _ = os.path.splitext(pdfpath)
+            return stem + ".ocr.pdf"
+        return os.path.join(self.output_dir, os.path.basename(pdfpath))
+
+    def _push(self, pdfpath, output, priority, pages):
+        if self.order == "fifo" or pages is None:
+            size_key = 0
+        else:
+            size_key = pages if self.order == "small_first" else -pages
+        heapq.heappush(self._heap, (-priority, size_key, next(self._counter), pdfpath, output, priority, pages))
+        self._outputs[output] = pdfpath
+
+    def submit(self, pdfpath, priority=0, output=None, force=False):
+        """
+        Queue a file for OCR.
+        :param pdfpath:
+        :param priority: Higher runs sooner
+        :param output: Where to write the OCRed file - defaults to output_for
+        :param force: Queue the file even if it has a text layer, or was done in an earlier run
+        :return: True if the file was queued. False if it has a text layer, was already done (per the checkpoint) or is
+                 quarantined.
+        """
+        from cameron_pdf_tools.text_layer import classify_pages, count_pages, needs_ocr
+
+        pdfpath = os.path.abspath(pdfpath)
+        output = os.path.abspath(output or self.output_for(pdfpath))
+        if self._outputs.get(output, pdfpath) != pdfpath:
+            raise ValueError("{} is already the output of {}".format(output, self._outputs[output]))
+
+        entry = self.checkpoint.entries.get(pdfpath)
+        kinds = None
+        if not force:
+            if entry is not None and entry["status"] in ("done", "skipped"):
+                return False
+            if self.quarantine is not None and pdfpath in self.quarantine:
+                return False
+            if self.page_selective:
+                kinds = classify_pages(pdfpath)
+                scanned = [i for i, kind in enumerate(kinds) if kind == "image"]
+                unneeded = not scanned
+                if scanned:
+                    self._scanned[pdfpath] = scanned
+            else:
+                unneeded = not needs_ocr(pdfpath)
+            if unneeded:
+                self.checkpoint.record(pdfpath, output, "skipped", reason="has text")
+                return False
+        if entry is not None and entry["status"] in ("queued", "running") and self._outputs.get(output) == pdfpath:
+            # Already queued - resumed from the checkpoint
+            return True
+
+        pages = None
+        if self.order != "fifo" and kinds is not None:
+            pages = len(kinds)
+        elif self.order != "fifo":
+            from pdfminer.pdfdocument import PDFDocument
+            from pdfminer.pdfparser import PDFParser
+
+            try:
+                with open(pdfpath, "rb") as stream:
+                    pages = count_pages(PDFDocument(PDFParser(stream)))
+            except Exception:
+                pages = None
+
+        self._push(pdfpath, output, priority, pages)
+        self.checkpoint.record(pdfpath, output, "queued", priority=priority, pages=pages)
+        return True
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _cache_key(self, pdfpath):
+        return self.cache.key(pdfpath, ocrmypdf_args=" ".join(self.ocrmypdf_args))
+
+    def ocr_file(self, pdfpath, output, source=None):
+        """
+        OCR one file - or copy its output from the cache.
+        :param pdfpath:
+        :param output:
+        :param source: The file pdfpath was made from, if it's a temporary file (as in ocr_image_pages) - it's what is
+                       quarantined, and named in errors
+        :return: "cached", "ocred" or "skipped" (ocrmypdf found text already)
+        """
+        source = source or pdfpath
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(pdfpath)
+            if self.cache.fetch(key, output, ext=".pdf"):
+                return "cached"
+
+        ocrmypdf = find_tool("ocrmypdf")
+        if ocrmypdf is None:
+            raise OCRError("ocrmypdf could not be found")
+
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        # Written beside the output and moved into place - so a crash never leaves a partial file at output
+        tmp_output = output + ".part"
+        cmd = [ocrmypdf, "--jobs", str(self.jobs_per_task)] + self.ocrmypdf_args + [pdfpath, tmp_output]
+        try:
+            result = process_limits.run(
+                cmd, timeout=self.timeout, limits=self.limits, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+        except subprocess.TimeoutExpired:
+            _remove(tmp_output)
+            if self.quarantine is not None:
+                self.quarantine.add(source, "ocrmypdf timeout")
+            raise OCRError("ocrmypdf timed out on {} after {} seconds".format(source, self.timeout))
+
+        if result.returncode == OCRMYPDF_PRIOR_OCR_FOUND:
+            _remove(tmp_output)
+            return "skipped"
+        if result.returncode:
+            _remove(tmp_output)
+            reason = process_limits.hit_limit(result.returncode, self.limits, result.stderr)
+            if self.quarantine is not None and reason is not None:
+                self.quarantine.add(source, "ocrmypdf " + reason)
+            raise OCRError(
+                "ocrmypdf errored out on {} with return code: {}\n{}".format(
+                    source, result.returncode, (result.stderr or b"").decode("utf-8", errors="replace")[-2000:]
+                )
+            )
+
+        os.replace(tmp_output, output)
+        if key is not None:
+            self.cache.put(key, output, ext=".pdf")
+        return "ocred"
+
+    def ocr_image_pages(self, pdfpath, output, scanned=None):
+        """
+        OCR only the pages of a file which are scans - image pages with no text (text_layer.classify_pages).
+        Those pages are copied into a pdf of their own, which goes through ocr_file (and so the cache), and the results
+        put back in place of the originals. Every other page is left as it is.
+        :param pdfpath:
+        :param output:
+        :param scanned: The indexes (counting from 0) of the scanned pages, if they're already known
+        :return: A tuple of the status (as for ocr_file - "skipped" if there were no scanned pages) and the list of the
+                 page numbers (counting from 1) which were OCRed
+        """
+        import pikepdf
+
+        from cameron_pdf_tools.text_layer import classify_pages
+
+        if scanned is None:
+            scanned = [i for i, kind in enumerate(classify_pages(pdfpath)) if kind == "image"]
+        if not scanned:
+            return "skipped", []
+
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        scans_path = output + ".scans.pdf"
+        ocred_path = output + ".ocred.pdf"
+        tmp_output = output + ".part"
+        try:
+            with pikepdf.open(pdfpath) as pdf:
+                with pikepdf.new() as scans:
+                    for i in scanned:
+                        scans.pages.append(pdf.pages[i])
+                    # A fixed /ID - so the same pages give the same file, and hit the cache
+                    scans.save(scans_path, deterministic_id=True)
+
+                status = self.ocr_file(scans_path, ocred_path, source=pdfpath)
+                if status == "skipped":
+                    return status, []
+
+                with pikepdf.open(ocred_path) as ocred:
+                    if len(ocred.pages) != len(scanned):
+                        raise OCRError(
+                            "ocrmypdf returned {} pages for the {} scanned pages of {}".format(
+                                len(ocred.pages), len(scanned), pdfpath
+                            )
+                        )
+                    for ocred_page, i in zip(ocred.pages, scanned):
+                        pdf.pages[i] = ocred_page
+                    pdf.save(tmp_output)
+            os.replace(tmp_output, output)
+        finally:
+            for path in (scans_path, ocred_path, tmp_output):
+                _remove(path)
+
+        return status, [i + 1 for i in scanned]
+
+    def _run_job(self, pdfpath, output, priority, pages):
+        self.checkpoint.record(pdfpath, output, "running", priority=priority, pages=pages)
+        try:
+            if self.page_selective:
+                status = self.ocr_image_pages(pdfpath, output, self._scanned.pop(pdfpath, None))[0]
+            else:
+                status = self.ocr_file(pdfpath, output)
+        except Exception as e:
+            self.checkpoint.record(pdfpath, output, "failed", error=str(e))
+            raise
+        self.checkpoint.record(pdfpath, output, "done" if status != "skipped" else "skipped", result=status)
+        return status
+
+    def run(self):
+        """
+        Run every queued job - the highest priority first, workers at a time.
+        A generator - yields (pdfpath, status) as each job finishes. status is "ocred", "cached", "skipped" or the
+        exception raised. Jobs are taken from the queue as workers come free, so jobs submitted while this runs are
+        picked up too.
+        :return:
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocrmypdf") as executor:
+            running = dict()
+            while self._heap or running:
+                while self._heap and len(running) < self.workers:
+                    _, _, _, pdfpath, output, priority, pages = heapq.heappop(self._heap)
+                    running[executor.submit(self._run_job, pdfpath, output, priority, pages)] = pdfpath
+                    self._outputs.pop(output, None)
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pdfpath = running.pop(future)
+                    try:
+                        yield pdfpath, future.result()
+                    except Exception as e:
+                        yield pdfpath, e
@@ -0,0 +1,130 @@
+
+# Runs the poppler tools (pdfinfo, pdftoppm) for many files at once from a single python process.
+# Each call is a subprocess - so a thread per worker is all that's needed to keep N of them running. The threads spend
+# their time waiting on the child process, not holding the GIL.
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cameron_pdf_tools.metadata_extractor import read_info, page_images
+from cameron_pdf_tools.process_limits import DEFAULT_TIMEOUT
+from cameron_pdf_tools.tools import require_tools
+
+
+class PopplerPool(object):
+    """
+    A persistent pool of workers running pdfinfo/pdftoppm calls.
+
+    Calls are queued and run as workers come free. Every submit method returns a concurrent.futures.Future for the
+    result.
+
+    Usage:
+
+        with PopplerPool(workers=8, timeout=60) as pool:
+            for pdfpath, info in pool.map_info(pdf_paths):
+                ...
+    """
+
+    def __init__(self, workers=None, timeout=DEFAULT_TIMEOUT, check_tools=True, limits=None, quarantine=None):
+        """
+        :param workers: Number of poppler processes to run at once. Defaults to the number of CPUs.
+        :param timeout: Default seconds to allow each poppler call before killing it. None waits forever.
+        :param check_tools: If True, raise ToolNotFoundError now if poppler is missing or lacks a needed flag
+        :param limits: A process_limits.ResourceLimits applied to every poppler call - defaults to
+                       process_limits.default_limits
+        :param quarantine: A process_limits.Quarantine shared by every call - files which time out are skipped after
+        """
+        if check_tools:
+            require_tools()
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.limits = limits
+        self.quarantine = quarantine
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="poppler"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _timeout(self, timeout):
+        return self.timeout if timeout is None else timeout
+
+    def submit_info(self, pdfpath, get_cover=False, outputdir=None, timeout=None, cover_cache=None):
+        """
+        Queue a read_info call for a pdf.
+        :param pdfpath: Path to the pdf
+        :param get_cover: If True, also render the cover as cover.jpg in outputdir
+        :param outputdir: Working directory for poppler - the cover is written here. Defaults to the directory holding
+                          the pdf if get_cover is False. Must be given (and be unique to this call) if get_cover is True -
+                          concurrent calls writing cover.jpg to one directory would get each other's covers.
+        :param timeout: Seconds to allow each poppler call. Defaults to the timeout of the pool.
+        :param cover_cache: As for read_info
+        :return Future: Resolves to the info dict - or None if pdfinfo failed
+        """
+        pdfpath = os.path.abspath(pdfpath)
+        if outputdir is None:
+            if get_cover:
+                raise ValueError("An outputdir of its own is needed for each call with get_cover")
+            outputdir = os.path.dirname(pdfpath)
+        return self._executor.submit(
+            read_info,
+            outputdir,
+            get_cover,
+            src=pdfpath,
+            timeout=self._timeout(timeout),
+            cover_cache=cover_cache,
+            limits=self.limits,
+            quarantine=self.quarantine,
+        )
+
+    def submit_page_images(self, pdfpath, outputdir, first=1, last=1, timeout=None):
+        """
+        Queue a page_images call for a pdf.
+        :param pdfpath: Path to the pdf
+        :param outputdir: Directory to write the page images to
+        :param first:
+        :param last:
+        :param timeout: Seconds to allow pdftoppm. Defaults to the timeout of the pool.
+        :return Future: Resolves to None - or raises ValueError if rendering failed
+        """
+        return self._executor.submit(
+            page_images,
+            os.path.abspath(pdfpath),
+            outputdir,
+            first=first,
+            last=last,
+            timeout=self._timeout(timeout),
+            limits=self.limits,
+            quarantine=self.quarantine,
+        )
+
+    def map_info(self, pdfpaths, timeout=None):
+        """
+        Run read_info over many pdfs, yielding (pdfpath, info) pairs as each one finishes (not in input order).
+        Files whose call raised yield the exception in place of the info dict.
+        :param pdfpaths: Iterable of paths to pdfs
+        :param timeout: As for submit_info
+        :return:
+        """
+        futures = {
+            self.submit_info(pdfpath, timeout=timeout): pdfpath
+            for pdfpath in pdfpaths
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting work. If wait is True, block until everything already queued has finished.
+        :param wait:
+        :return:
+        """
+        self._executor.shutdown(wait=wait)
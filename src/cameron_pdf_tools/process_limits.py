@@ -0,0 +1,236 @@
+
+# Running external tools with limits - so one malformed pdf can't hang or exhaust a worker.
+#   - A wall clock deadline per call. When it passes, the whole process group is killed (poppler tools can leave
+#     children behind) rather than just the direct child.
+#   - Memory (RLIMIT_AS) and CPU time (RLIMIT_CPU) limits, set in the child before it runs the tool.
+#   - A quarantine - a list of files which have timed out, so they're skipped rather than retried.
+# The functions here mirror subprocess.run/check_output/check_call, and raise the same exceptions.
+# Resource limits and process groups are posix only - on windows just the deadline applies.
+
+import json
+import os
+import signal
+import subprocess
+import threading
+
+from collections import namedtuple
+
+from cameron_pdf_tools.constants import iswindows
+
+
+# memory - maximum address space of the child, in bytes. cpu - maximum cpu time of the child, in seconds.
+# None for either means unlimited.
+ResourceLimits = namedtuple("ResourceLimits", ["memory", "cpu"])
+
+NO_LIMITS = ResourceLimits(memory=None, cpu=None)
+
+# Defaults which no sound pdf should come near - poppler needs well under 1GB and a few seconds of cpu for all but the
+# largest books - but which still stop a bad file from taking a worker (or the machine) with it
+DEFAULT_TIMEOUT = 300
+DEFAULT_LIMITS = ResourceLimits(memory=4 * 1024 ** 3, cpu=DEFAULT_TIMEOUT)
+
+# Used by any call which doesn't give its own limits
+default_limits = DEFAULT_LIMITS
+
+
+def set_default_limits(memory=None, cpu=None):
+    """
+    Set the resource limits used by every call which doesn't give its own.
+    :param memory: Maximum address space of each child process, in bytes. None for no limit.
+    :param cpu: Maximum cpu time of each child process, in seconds. None for no limit.
+    :return:
+    """
+    global default_limits
+    default_limits = ResourceLimits(memory=memory, cpu=cpu)
+
+
+def _set_rlimits(limits):
+    """
+    Apply resource limits to the current process - run in the child, between fork and exec.
+    :param limits:
+    :return:
+    """
+    import resource
+
+    if limits.memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory, limits.memory))
+    if limits.cpu is not None:
+        # The soft limit sends SIGXCPU - the hard limit a second later SIGKILL, for anything which ignores it
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu, limits.cpu + 1))
+
+
+def popen_kwargs(limits=None):
+    """
+    The keyword arguments for subprocess.Popen which put the child in its own process group and apply resource limits.
+    :param limits: A ResourceLimits - defaults to default_limits
+    :return:
+    """
+    if iswindows:
+        return {}
+    if limits is None:
+        limits = default_limits
+
+    kwargs = {"start_new_session": True}
+    if limits.memory is not None or limits.cpu is not None:
+        kwargs["preexec_fn"] = lambda: _set_rlimits(limits)
+    return kwargs
+
+
+def kill_process_group(proc):
+    """
+    Kill a child process started with popen_kwargs - and everything else in its process group.
+    :param proc:
+    :return:
+    """
+    if iswindows:
+        proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # Already gone
+        pass
+
+
+# What a child which ran out of memory under RLIMIT_AS tends to die of - a failed allocation it didn't check (SIGSEGV,
+# SIGBUS), or one it did, which ends in abort (SIGABRT - as C++'s std::bad_alloc does)
+_MEMORY_SIGNALS = ("SIGSEGV", "SIGBUS", "SIGABRT")
+
+# And what it prints, if it manages to exit cleanly
+_MEMORY_ERROR_PATTERNS = (b"MemoryError", b"bad_alloc", b"out of memory", b"Out of memory", b"Cannot allocate memory")
+
+
+def hit_limit(returncode, limits=None, stderr=None):
+    """
+    Check if a child run under limits was stopped by one of them.
+    Only the limits which were actually set are considered - a SIGKILL, say, only counts as a cpu limit hit if there was
+    a cpu limit.
+    :param returncode:
+    :param limits: The ResourceLimits the child ran under - defaults to default_limits
+    :param stderr: What the child wrote to stderr, as bytes (if it was captured) - a child which exits cleanly after a
+                   failed allocation can only be told apart by what it says
+    :return: "cpu limit" or "memory limit" - or None if neither was hit
+    """
+    if iswindows or not returncode:
+        return None
+    if limits is None:
+        limits = default_limits
+
+    if limits.cpu is not None and returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        return "cpu limit"
+    if limits.memory is not None:
+        if -returncode in tuple(getattr(signal, name) for name in _MEMORY_SIGNALS):
+            return "memory limit"
+        if stderr and any(pattern in stderr for pattern in _MEMORY_ERROR_PATTERNS):
+            return "memory limit"
+    return None
+
+
+def run(cmd, timeout=None, limits=None, check=False, **kwargs):
+    """
+    As subprocess.run - but the child runs under resource limits, and on timeout its whole process group is killed.
+    :param cmd:
+    :param timeout: Seconds to allow the child. None waits forever.
+    :param limits: A ResourceLimits - defaults to default_limits
+    :param check: If True, raise CalledProcessError if the child exits non-zero
+    :param kwargs: Passed to subprocess.Popen
+    :return subprocess.CompletedProcess:
+    """
+    kwargs.setdefault("stdin", subprocess.DEVNULL)
+    kwargs.update(popen_kwargs(limits))
+
+    with subprocess.Popen(cmd, **kwargs) as proc:
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(proc)
+            proc.communicate()
+            raise
+        except BaseException:
+            kill_process_group(proc)
+            raise
+        returncode = proc.poll()
+
+    if check and returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+def check_output(cmd, timeout=None, limits=None, **kwargs):
+    """
+    As subprocess.check_output - with the limits of run.
+    :param cmd:
+    :param timeout:
+    :param limits:
+    :param kwargs:
+    :return:
+    """
+    return run(cmd, timeout=timeout, limits=limits, check=True, stdout=subprocess.PIPE, **kwargs).stdout
+
+
+def check_call(cmd, timeout=None, limits=None, **kwargs):
+    """
+    As subprocess.check_call - with the limits of run.
+    :param cmd:
+    :param timeout:
+    :param limits:
+    :param kwargs:
+    :return:
+    """
+    run(cmd, timeout=timeout, limits=limits, check=True, **kwargs)
+    return 0
+
+
+class Quarantine(object):
+    """
+    The set of files which have made a tool time out (or hit one of its resource limits) - so a batch can skip them
+    rather than letting each tie up a worker again.
+    If given a path, the quarantine is kept on disk as json lines - and loaded from there when created.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._files = dict()
+
+        if path is not None and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as stream:
+                for line in stream:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    self._files[entry["path"]] = entry["reason"]
+
+    def __contains__(self, pdfpath):
+        return os.path.abspath(pdfpath) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def __iter__(self):
+        return iter(list(self._files))
+
+    def reason(self, pdfpath):
+        """
+        Why a file was quarantined - or None if it wasn't.
+        :param pdfpath:
+        :return:
+        """
+        return self._files.get(os.path.abspath(pdfpath))
+
+    def add(self, pdfpath, reason="timeout"):
+        """
+        Quarantine a file.
+        :param pdfpath:
+        :param reason: A short description of what went wrong
+        :return:
+        """
+        pdfpath = os.path.abspath(pdfpath)
+        with self._lock:
+            if pdfpath in self._files:
+                return
+            self._files[pdfpath] = reason
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as stream:
+                    stream.write(json.dumps({"path": pdfpath, "reason": reason}) + "\n")
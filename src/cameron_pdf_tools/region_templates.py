@@ -0,0 +1,323 @@
+
+# Region templates - for series of documents which share a layout (one publisher's reports, say).
+# A template is learnt from a few sample documents whose title/author/date are known. It records where on the page each
+# field's text sits. The rest of the series then has only the text inside those regions extracted. The whole page is
+# still interpreted - every operator parsed, every font loaded, every character placed - so that part of the cost grows
+# with the page as usual. What's saved is what comes after: characters outside the regions are dropped as soon as
+# they're placed, so there's no layout analysis and nothing is kept for them.
+
+import json
+
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LTChar, LTFigure, LTPage
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+
+DEFAULT_FIELDS = ("title", "author", "date")
+
+# Regions are grown by this fraction of the page size in each direction - layouts drift a little between documents
+MARGIN = 0.01
+
+# A field's region is only kept if its text was found in at least this fraction of the samples
+MIN_SUPPORT = 0.5
+
+
+class TemplateError(Exception):
+    """
+    Raised when a template can't be learnt from the samples given.
+    """
+
+
+class _RegionPage(LTPage):
+    """
+    A page which only keeps the characters inside its regions - everything else is dropped as it's added.
+    Characters drawn by form xobjects are taken out of their figures, so they're kept (or dropped) like any other.
+    """
+
+    def __init__(self, pageid, bbox, regions=None):
+        LTPage.__init__(self, pageid, bbox)
+        self.regions = regions
+
+    def add(self, obj):
+        if isinstance(obj, LTFigure):
+            for char in _figure_chars(obj):
+                self.add(char)
+        elif not isinstance(obj, LTChar) or self.regions is None:
+            LTPage.add(self, obj)
+        elif any(_centre_in(obj, region) for region in self.regions):
+            LTPage.add(self, obj)
+
+
+def _figure_chars(figure):
+    for item in figure:
+        if isinstance(item, LTFigure):
+            yield from _figure_chars(item)
+        elif isinstance(item, LTChar):
+            yield item
+
+
+class _RegionAggregator(PDFPageAggregator):
+    """
+    A page aggregator (without layout analysis) which only keeps the characters inside the given regions.
+    Regions are (x0, y0, x1, y1) in fractions of the page - or None to keep everything. They're placed on the page as
+    pdfminer lays it out (the mediabox mapped through the CTM, so from 0, 0 and turned by any /Rotate) - the frame the
+    characters are in.
+    """
+
+    def __init__(self, rsrcmgr, regions=None):
+        PDFPageAggregator.__init__(self, rsrcmgr, laparams=None)
+        self.regions = regions
+
+    def begin_page(self, page, ctm):
+        PDFPageAggregator.begin_page(self, page, ctm)
+        layout = self.cur_item
+        page_regions = None
+        if self.regions is not None:
+            page_regions = [_to_page(region, layout.bbox) for region in self.regions]
+        self.cur_item = _RegionPage(layout.pageid, layout.bbox, page_regions)
+
+
+def _centre_in(char, region):
+    x = (char.x0 + char.x1) / 2
+    y = (char.y0 + char.y1) / 2
+    return region[0] <= x <= region[2] and region[1] <= y <= region[3]
+
+
+def _page_chars(stream, page_index=0, regions=None):
+    """
+    Interpret one page of a pdf.
+    :param stream: An open binary file
+    :param page_index: Which page (counting from 0)
+    :param regions: As for _RegionAggregator
+    :return: A tuple of the page's bounding box (in the frame its characters are in), and the list of LTChar on it
+             (inside the regions, if given)
+    """
+    stream.seek(0)
+    document = PDFDocument(PDFParser(stream))
+    rsrcmgr = PDFResourceManager(caching=True)
+
+    for page_num, page in enumerate(PDFPage.create_pages(document)):
+        if page_num < page_index:
+            continue
+        device = _RegionAggregator(rsrcmgr, regions)
+        PDFPageInterpreter(rsrcmgr, device).process_page(page)
+        layout = device.get_result()
+        return layout.bbox, [item for item in layout if isinstance(item, LTChar)]
+
+    return None, []
+
+
+def _to_page(region, page_box):
+    """
+    Convert a region in fractions of the page size to page coordinates.
+    """
+    x0, y0, x1, y1 = page_box
+    w = x1 - x0
+    h = y1 - y0
+    return (x0 + region[0] * w, y0 + region[1] * h, x0 + region[2] * w, y0 + region[3] * h)
+
+
+def _to_fraction(box, page_box):
+    """
+    Convert a box in page coordinates to fractions of the page size.
+    """
+    x0, y0, x1, y1 = page_box
+    w = (x1 - x0) or 1
+    h = (y1 - y0) or 1
+    return ((box[0] - x0) / w, (box[1] - y0) / h, (box[2] - x0) / w, (box[3] - y0) / h)
+
+
+def _chars_to_text(chars):
+    """
+    Join characters (in content stream order) into text - with spaces at gaps and line breaks.
+    :param chars:
+    :return:
+    """
+    parts = []
+    last = None
+    for char in chars:
+        if last is not None:
+            size = max(char.size, 1)
+            if abs(char.y0 - last.y0) > size * 0.5 or char.x0 - last.x1 > size * 0.25:
+                parts.append(" ")
+        parts.append(char.get_text())
+        last = char
+    return " ".join("".join(parts).split())
+
+
+def find_text_bbox(chars, text):
+    """
+    Find where some text is on a page.
+    Matching ignores case and whitespace.
+    :param chars: The LTChar of the page, in content stream order
+    :param text: The text to look for
+    :return: The bounding box (x0, y0, x1, y1) of the first match - or None if it isn't on the page
+    """
+    target = "".join(text.split()).casefold()
+    if not target:
+        return None
+
+    # The page's text without whitespace - and, for each character of that, the LTChar it came from
+    page_text = []
+    owners = []
+    for char in chars:
+        for c in "".join(char.get_text().split()).casefold():
+            page_text.append(c)
+            owners.append(char)
+    start = "".join(page_text).find(target)
+    if start == -1:
+        return None
+
+    matched = owners[start:start + len(target)]
+    return (
+        min(c.x0 for c in matched),
+        min(c.y0 for c in matched),
+        max(c.x1 for c in matched),
+        max(c.y1 for c in matched),
+    )
+
+
+class RegionTemplate(object):
+    """
+    Where each field's text sits on a page, for one series of documents.
+    Regions are stored as fractions of the page size, so a template copes with small differences in page size.
+
+    Usage:
+
+        template = RegionTemplate.learn([("report-1.pdf", {"title": "...", "date": "..."}), ...])
+        template.save("publisher.json")
+        fields = RegionTemplate.load("publisher.json").extract("report-57.pdf")
+    """
+
+    def __init__(self, regions, page=0, samples=0):
+        """
+        :param regions: A dictionary keyed by field and valued with the region (x0, y0, x1, y1), in fractions of the
+                        page size
+        :param page: The page the regions are on (counting from 0)
+        :param samples: How many sample documents the template was learnt from
+        """
+        self.regions = {field: tuple(region) for field, region in regions.items()}
+        self.page = page
+        self.samples = samples
+
+    @classmethod
+    def learn(cls, samples, fields=DEFAULT_FIELDS, page=0, margin=MARGIN, min_support=MIN_SUPPORT):
+        """
+        Learn a template from sample documents.
+        :param samples: An iterable of (path, values) - values a dictionary keyed by field with the text of that field
+                        in the document. If values is None the title and first author from get_metadata are used.
+        :param fields: The fields to learn regions for
+        :param page: The page the fields are on (counting from 0)
+        :param margin: Grow each region by this fraction of the page size
+        :param min_support: Only keep a field if it was found in at least this fraction of the samples
+        :return RegionTemplate:
+        """
+        boxes = {field: [] for field in fields}
+        count = 0
+        for path, values in samples:
+            with open(path, "rb") as stream:
+                if values is None:
+                    values = _values_from_metadata(stream)
+                page_box, chars = _page_chars(stream, page)
+            if page_box is None:
+                continue
+            count += 1
+            for field in fields:
+                value = values.get(field)
+                if not value:
+                    continue
+                box = find_text_bbox(chars, value)
+                if box is not None:
+                    boxes[field].append(_to_fraction(box, page_box))
+
+        if not count:
+            raise TemplateError("None of the samples could be read")
+
+        regions = dict()
+        for field, field_boxes in boxes.items():
+            if not field_boxes or len(field_boxes) < min_support * count:
+                continue
+            regions[field] = (
+                max(0.0, min(b[0] for b in field_boxes) - margin),
+                max(0.0, min(b[1] for b in field_boxes) - margin),
+                min(1.0, max(b[2] for b in field_boxes) + margin),
+                min(1.0, max(b[3] for b in field_boxes) + margin),
+            )
+        if not regions:
+            raise TemplateError("None of the fields could be found consistently in the samples")
+
+        return cls(regions, page=page, samples=count)
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as stream:
+            json.dump(
+                {"page": self.page, "samples": self.samples, "regions": {k: list(v) for k, v in self.regions.items()}},
+                stream,
+                indent=2,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as stream:
+            data = json.load(stream)
+        return cls(data["regions"], page=data.get("page", 0), samples=data.get("samples", 0))
+
+    def extract(self, stream):
+        """
+        Extract the text of each field's region from a document of the series.
+        :param stream: The pdf - an open binary file, or a path
+        :return: A dictionary keyed by field and valued with the text found (fields with no text are left out)
+        """
+        if isinstance(stream, str):
+            with open(stream, "rb") as pdf_stream:
+                return self.extract(pdf_stream)
+
+        fields = list(self.regions)
+        page_box, chars = _page_chars(stream, self.page, regions=[self.regions[f] for f in fields])
+        if not chars:
+            return dict()
+
+        # _page_chars dropped everything outside the regions - now share what's left between them
+        ans = dict()
+        for field in fields:
+            region = _to_page(self.regions[field], page_box)
+            text = _chars_to_text(c for c in chars if _centre_in(c, region))
+            if text:
+                ans[field] = text
+        return ans
+
+    def apply(self, paths):
+        """
+        Run extract over many documents - yielding (path, fields) for each. Documents which can't be read yield the
+        exception in place of the fields.
+        :param paths:
+        :return:
+        """
+        for path in paths:
+            try:
+                yield path, self.extract(path)
+            except Exception as e:
+                yield path, e
+
+
+def _values_from_metadata(stream):
+    """
+    The title and first author of a document, from its metadata - for learning a template from well tagged samples.
+    :param stream:
+    :return:
+    """
+    from cameron_pdf_tools.metadata_extractor import get_metadata
+
+    md = get_metadata(stream)
+    values = dict()
+    if md.get("title"):
+        values["title"] = md["title"]
+    author = md.get("author")
+    if isinstance(author, list) and author:
+        values["author"] = author[0]
+    elif author:
+        values["author"] = author
+    return values
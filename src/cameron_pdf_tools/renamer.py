@@ -0,0 +1,373 @@
+
+# Renaming pdfs from their metadata - the use the README has in mind for extracted metadata.
+# A filename template (str.format syntax - e.g. "{author[0]} - {title}") is compiled once, then a plan is made for
+# every file - metadata from a cache where there is one, extracted in a pool of processes where not. Collisions are
+# settled in sorted order, so the same tree and template always give the same plan.
+# Plans are applied one rename at a time, each logged (and flushed to disk) before it's made - so a plan can be undone,
+# whether it finished or not. If a rename fails part way through, the ones already made are undone.
+
+import json
+import os
+import string
+
+from collections import OrderedDict, namedtuple
+
+
+# Longest file name allowed - in bytes of utf-8, as most file systems count
+MAX_NAME_LENGTH = 255
+
+# Used for fields the metadata doesn't have
+MISSING = "Unknown"
+
+# Characters which aren't allowed (or are awkward) in file names on one platform or another
+_UNSAFE_CHARS = '<>:"/\\|?*'
+
+_sanitize_table = {ord(c): "_" for c in _UNSAFE_CHARS}
+_sanitize_table.update({i: " " for i in range(32)})
+_sanitize_table[127] = None
+
+Rename = namedtuple("Rename", ["src", "dst"])
+
+
+class RenameError(Exception):
+    """
+    Raised when a plan can't be applied - after undoing any renames already made.
+    """
+
+
+def sanitize_filename(name, max_length=MAX_NAME_LENGTH):
+    """
+    Make a string safe to use as a file name (on any platform).
+    :param name:
+    :param max_length: Longest name allowed, in bytes of utf-8
+    :return:
+    """
+    name = " ".join(name.translate(_sanitize_table).split())
+    # Windows won't have names ending in dots or spaces
+    name = name.rstrip(". ")
+    encoded = name.encode("utf-8")
+    if len(encoded) > max_length:
+        name = encoded[:max_length].decode("utf-8", errors="ignore").rstrip(". ")
+    return name
+
+
+class _Missing(object):
+    """
+    Stands in for a field the metadata doesn't have - indexing and attribute access give more of the same.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def __getitem__(self, key):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+    def __format__(self, spec):
+        return format(self.text, spec)
+
+
+class _Indexed(object):
+    """
+    Wraps the value of an indexed field - an index it doesn't have ({author[1]} with one author) gives missing, rather
+    than failing the whole name.
+    """
+
+    def __init__(self, value, missing):
+        self.value = value
+        self.missing = missing
+
+    def __getitem__(self, key):
+        try:
+            return self.value[key]
+        except (IndexError, KeyError, TypeError):
+            return self.missing
+
+    def __format__(self, spec):
+        return format(self.value, spec)
+
+
+class FilenameTemplate(object):
+    """
+    A filename template, compiled.
+
+    Usage:
+
+        template = FilenameTemplate("{author[0]} - {title}")
+        template.render({"author": ["A. Cameron"], "title": "Some pdf tools"})  # "A. Cameron - Some pdf tools"
+    """
+
+    def __init__(self, template, missing=MISSING, max_length=MAX_NAME_LENGTH):
+        """
+        :param template: In str.format syntax - fields are keys of the metadata dictionary
+        :param missing: Used for fields the metadata doesn't have
+        :param max_length: Longest name allowed (extension included), in bytes of utf-8
+        """
+        self.template = template
+        self.missing = _Missing(missing)
+        self.max_length = max_length
+
+        # Fields used, and which of them are indexed ({author[0]}) - found once, here, rather than on every render
+        self.fields = set()
+        self.indexed = set()
+        for _, field_name, _, _ in string.Formatter().parse(template):
+            if field_name is None:
+                continue
+            root, rest = field_name, ""
+            for i, c in enumerate(field_name):
+                if c in ".[":
+                    root, rest = field_name[:i], field_name[i:]
+                    break
+            if not root or root.isdigit():
+                raise ValueError("Template fields must be named - {}".format(template))
+            self.fields.add(root)
+            if rest.startswith("["):
+                self.indexed.add(root)
+        self._format = template.format_map
+
+    def render(self, md, extension=""):
+        """
+        Make the file name for one document.
+        :param md: The document's metadata dictionary
+        :param extension: Added to the end (kept within max_length)
+        :return:
+        """
+        values = dict()
+        for field in self.fields:
+            value = md.get(field)
+            if value is None or value == "" or value == []:
+                value = self.missing
+            elif field in self.indexed:
+                if isinstance(value, str):
+                    # Some metadata has a single string where a list is more usual (XMP authors, for one)
+                    value = [value]
+                value = _Indexed(value, self.missing)
+            elif isinstance(value, list):
+                value = ", ".join(str(v) for v in value)
+            values[field] = value
+
+        name = self._format(values)
+
+        stem = sanitize_filename(name, self.max_length - len(extension.encode("utf-8"))) or self.missing.text
+        return stem + extension
+
+
+def _extract(path, backend):
+    from cameron_pdf_tools.backends import extract
+
+    try:
+        return path, extract(path, backend=backend)
+    except Exception as e:
+        return path, e
+
+
+def _print_error(path, error):
+    print("Error processing {}: {}".format(path, error))
+
+
+def _iter_pdfs(root_or_paths):
+    if isinstance(root_or_paths, str):
+        for dirpath, dirnames, filenames in os.walk(root_or_paths):
+            for name in filenames:
+                if name.lower().endswith(".pdf"):
+                    yield os.path.join(dirpath, name)
+    else:
+        for path in root_or_paths:
+            yield path
+
+
+def plan_renames(root_or_paths, template, metadata=None, workers=None, backend="auto", on_error=_print_error):
+    """
+    Work out the new name of every pdf.
+    Names are checked against everything already in the directory, and against each other - clashes get " (2)",
+    " (3)" e.t.c. added, in order of the sorted source paths. Comparison ignores case, for case insensitive file systems.
+    The names of files the plan renames away don't count as taken - the plan is ordered so they're moved first.
+    :param root_or_paths: A directory (searched for pdfs) or an iterable of pdf paths
+    :param template: A FilenameTemplate, or a template string
+    :param metadata: A mapping of path -> metadata dictionary (e.g. as kept by watcher.watch_metadata). Files missing
+                     from it have their metadata extracted.
+    :param workers: Number of processes to extract metadata with. Defaults to the number of CPUs.
+    :param backend: As for backends.extract
+    :param on_error: Called with (path, exception) for files whose metadata can't be extracted - they're left out of
+                     the plan
+    :return: A list of Rename(src, dst) - only for files whose name changes
+    """
+    if isinstance(template, str):
+        template = FilenameTemplate(template)
+    metadata = dict() if metadata is None else metadata
+
+    paths = sorted(os.path.abspath(path) for path in _iter_pdfs(root_or_paths))
+    found = dict()
+    missing = []
+    for path in paths:
+        md = metadata.get(path)
+        if md is None:
+            missing.append(path)
+        else:
+            found[path] = md
+
+    if missing:
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, min(64, len(missing) // (workers * 4)))
+            for path, md in executor.map(partial(_extract, backend=backend), missing, chunksize=chunksize):
+                if isinstance(md, Exception):
+                    on_error(path, md)
+                else:
+                    found[path] = md
+
+    # Names taken in each directory (case folded) - listed once per directory. The names of files this plan renames
+    # away are free for the others (apply_renames moves them out of the way first).
+    taken = dict()
+    rendered = dict()
+    for path in paths:
+        md = found.get(path)
+        if md is None:
+            continue
+        dirpath, name = os.path.split(path)
+        if dirpath not in taken:
+            taken[dirpath] = {n.casefold() for n in os.listdir(dirpath)}
+        rendered[path] = template.render(md, os.path.splitext(name)[1])
+        if rendered[path].casefold() != name.casefold():
+            taken[dirpath].discard(name.casefold())
+
+    plan = []
+    for path in paths:
+        if path not in rendered:
+            continue
+        dirpath, name = os.path.split(path)
+        dir_taken = taken[dirpath]
+
+        stem, extension = os.path.splitext(name)
+        new_name = rendered[path]
+        if new_name == name:
+            continue
+        if new_name.casefold() != name.casefold():
+            count = 1
+            new_stem, _ = os.path.splitext(new_name)
+            while new_name.casefold() in dir_taken:
+                count += 1
+                suffix = " ({})".format(count)
+                new_name = (
+                    sanitize_filename(new_stem, template.max_length - len((suffix + extension).encode("utf-8")))
+                    + suffix
+                    + extension
+                )
+            if new_name.casefold() == name.casefold():
+                # Stays where it is after all - so its name is taken again
+                dir_taken.add(name.casefold())
+                continue
+        dir_taken.add(new_name.casefold())
+        plan.append(Rename(path, os.path.join(dirpath, new_name)))
+
+    return _order_renames(plan)
+
+
+def _temporary_name(path):
+    dirpath, name = os.path.split(path)
+    count = 0
+    while True:
+        count += 1
+        temporary = os.path.join(dirpath, ".{}.renaming-{}".format(name, count))
+        if not os.path.lexists(temporary):
+            return temporary
+
+
+def _order_renames(plan):
+    """
+    Order a plan so that each file is renamed away before another is renamed onto its name. Files in a cycle (two
+    swapping names, say) go through a temporary name.
+    :param plan: A list of Rename
+    :return: A list of Rename
+    """
+    pending = OrderedDict((rename.src.casefold(), rename) for rename in plan)
+    ordered = []
+    while pending:
+        progress = False
+        for key, rename in list(pending.items()):
+            blocker = pending.get(rename.dst.casefold())
+            if blocker is None or blocker is rename:
+                ordered.append(rename)
+                del pending[key]
+                progress = True
+        if not progress:
+            key, rename = next(iter(pending.items()))
+            temporary = _temporary_name(rename.src)
+            ordered.append(Rename(rename.src, temporary))
+            del pending[key]
+            pending[temporary.casefold()] = Rename(temporary, rename.dst)
+    return ordered
+
+
+def _rename(src, dst):
+    # os.rename replaces an existing dst on posix - the plan was made against an earlier state of the directory
+    # (on a case insensitive file system dst may be src itself, with its case changed)
+    if os.path.exists(dst) and not os.path.samefile(src, dst):
+        raise FileExistsError("Target already exists - {}".format(dst))
+    os.rename(src, dst)
+
+
+def apply_renames(plan, undo_log=None, dry_run=False):
+    """
+    Carry out a plan made by plan_renames.
+    Each rename is appended to the undo log (and the log flushed to disk) before it's made. If a rename fails, those
+    already made are undone and RenameError raised.
+    :param plan: A list of Rename
+    :param undo_log: Path to a file to log to (appended to) - needed for undo_renames
+    :param dry_run: If True, change nothing - just return the plan
+    :return: The renames made
+    """
+    if dry_run:
+        return list(plan)
+
+    log = open(undo_log, "a", encoding="utf-8") if undo_log is not None else None
+    done = []
+    try:
+        for rename in plan:
+            if log is not None:
+                log.write(json.dumps({"src": rename.src, "dst": rename.dst}, ensure_ascii=False))
+                log.write("\n")
+                log.flush()
+                os.fsync(log.fileno())
+            try:
+                _rename(rename.src, rename.dst)
+            except OSError as e:
+                for made in reversed(done):
+                    try:
+                        os.rename(made.dst, made.src)
+                    except OSError:
+                        pass
+                raise RenameError(
+                    "Could not rename {} to {} - {}. {} earlier renames undone.".format(
+                        rename.src, rename.dst, e, len(done)
+                    )
+                )
+            done.append(rename)
+    finally:
+        if log is not None:
+            log.close()
+    return done
+
+
+def undo_renames(undo_log):
+    """
+    Undo the renames recorded in an undo log - latest first.
+    Entries whose rename never happened (the file is still at its old path) are skipped.
+    :param undo_log:
+    :return: The renames undone - as Rename(src, dst), src being the name the file was given
+    """
+    with open(undo_log, "r", encoding="utf-8") as stream:
+        entries = [json.loads(line) for line in stream if line.strip()]
+
+    undone = []
+    for entry in reversed(entries):
+        if not os.path.exists(entry["dst"]) or os.path.exists(entry["src"]):
+            continue
+        _rename(entry["dst"], entry["src"])
+        undone.append(Rename(entry["dst"], entry["src"]))
+    return undone
@@ -0,0 +1,558 @@
+
+# Rendering pdf pages to images with pdftoppm - for previews and thumbnails.
+# page_images in metadata_extractor makes one pdftoppm call - so one core. page_images_parallel splits the work across
+# several pdftoppm processes. The *_bytes functions render without writing any files at all.
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from cameron_pdf_tools.constants import iswindows
+from cameron_pdf_tools.tools import find_tool, probe_tool
+from cameron_pdf_tools.process_limits import hit_limit, popen_kwargs, kill_process_group
+
+
+IMAGE_FORMATS = {"jpeg": ".jpg", "png": ".png"}
+
+
+def _popen_args(limits=None):
+    """
+    Extra keyword arguments for subprocess calls - rendering runs at high priority, without a console, on windows.
+    Elsewhere it runs in its own process group, under resource limits.
+    :param limits: A process_limits.ResourceLimits - defaults to process_limits.default_limits
+    :return:
+    """
+    args = popen_kwargs(limits)
+    if iswindows:
+        import win32process as w
+
+        args["creationflags"] = w.HIGH_PRIORITY_CLASS | w.CREATE_NO_WINDOW
+    return args
+
+
+def pdftoppm_options(dpi=None, scale_to=None, fmt="jpeg"):
+    """
+    Build the pdftoppm arguments for the given render settings.
+    :param dpi: Resolution to render at. None uses the pdftoppm default (150).
+    :param scale_to: Scale each page so its longest side is this many pixels. Overrides dpi.
+    :param fmt: "jpeg" or "png"
+    :return:
+    """
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError("Unsupported image format - {}".format(fmt))
+
+    options = ["-cropbox", "-" + fmt]
+    if dpi is not None:
+        options.extend(["-r", str(dpi)])
+    if scale_to is not None:
+        options.extend(["-scale-to", str(scale_to)])
+    return options
+
+
+def page_ranges(first, last, chunks):
+    """
+    Split the pages first to last (inclusive) into (at most) the given number of contiguous ranges.
+    :param first:
+    :param last:
+    :param chunks:
+    :return: A list of (first, last) tuples
+    """
+    pages = last - first + 1
+    if pages < 1:
+        return []
+    chunks = max(1, min(chunks, pages))
+    size, extra = divmod(pages, chunks)
+
+    ranges = []
+    start = first
+    for i in range(chunks):
+        end = start + size - 1 + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def page_images_parallel(
+    pdfpath,
+    outputdir,
+    first=1,
+    last=1,
+    workers=None,
+    chunk_size=None,
+    dpi=None,
+    scale_to=None,
+    fmt="jpeg",
+    timeout=None,
+    limits=None,
+    quarantine=None,
+):
+    """
+    Render pages first to last (inclusive) of a pdf with several concurrent pdftoppm processes - one per range of pages.
+    A generator - yields (page_number, image_path) for each page as soon as it has been written. Pages from different
+    ranges come out interleaved, not in page order.
+    Images are named as page_images names them (page-images-N.jpg, with N zero padded by pdftoppm).
+    Closing the generator early kills any pdftoppm processes still running.
+    :param pdfpath:
+    :param outputdir:
+    :param first:
+    :param last:
+    :param workers: Number of pdftoppm processes to run at once. Defaults to the number of CPUs.
+    :param chunk_size: Pages per pdftoppm call. Defaults to splitting the pages evenly between the workers.
+    :param dpi: As for pdftoppm_options
+    :param scale_to: As for pdftoppm_options
+    :param fmt: As for pdftoppm_options
+    :param timeout: Seconds to allow each pdftoppm call before killing it. None waits forever.
+    :param limits: As for _popen_args
+    :param quarantine: A process_limits.Quarantine - rendering a quarantined file raises ValueError, and files which
+                       time out (or hit one of the limits) are added to it
+    :return:
+    """
+    pdf_to_ppm = find_tool("pdftoppm")
+    if pdf_to_ppm is None:
+        raise ValueError("Failed to render PDF, pdftoppm could not be found")
+
+    pdfpath = os.path.abspath(pdfpath)
+    _check_quarantine(pdfpath, quarantine)
+    outputdir = os.path.abspath(outputdir)
+    options = pdftoppm_options(dpi=dpi, scale_to=scale_to, fmt=fmt)
+    ext = IMAGE_FORMATS[fmt]
+    root = os.path.join(outputdir, "page-images")
+
+    # -progress reports each page as it's written - without it pages can only be collected once their range is done
+    progress = "-progress" in probe_tool("pdftoppm").flags
+
+    workers = workers or os.cpu_count() or 1
+    if chunk_size:
+        ranges = page_ranges(first, last, -(-(last - first + 1) // chunk_size))
+    else:
+        ranges = page_ranges(first, last, workers)
+
+    results = Queue()
+    cancelled = threading.Event()
+    running = set()
+    running_lock = threading.Lock()
+
+    def render_range(page_range):
+        range_first, range_last = page_range
+        cmd = [pdf_to_ppm] + options + ["-f", str(range_first), "-l", str(range_last)]
+        if progress:
+            cmd.extend(["-progress", pdfpath, root])
+            range_dir = outputdir
+        else:
+            # Without -progress the images can only be found by listing a directory - a fresh one, so nothing left
+            # from an earlier run is picked up
+            range_dir = tempfile.mkdtemp(prefix="page-images-", dir=outputdir)
+            cmd.extend([pdfpath, os.path.join(range_dir, "page-images")])
+
+        # Started under the lock - so cancelling either sees the process, or stops it being started
+        with running_lock:
+            if cancelled.is_set():
+                _remove_dir(range_dir, outputdir)
+                return
+            proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                cwd=outputdir,
+                **_popen_args(limits)
+            )
+            running.add(proc)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            kill_process_group(proc)
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+
+        try:
+            errors = []
+            for line in proc.stderr:
+                line = line.decode("utf-8", errors="replace").rstrip()
+                # -progress lines look like "<page> <last page> <file name>"
+                parts = line.split(" ", 2)
+                if progress and len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+                    results.put((int(parts[0]), parts[2]))
+                elif line:
+                    errors.append(line)
+            returncode = proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with running_lock:
+                running.discard(proc)
+
+        try:
+            if returncode != 0 and not cancelled.is_set():
+                _quarantine_failure(
+                    pdfpath, quarantine, returncode, limits, "\n".join(errors).encode("utf-8"), timed_out.is_set()
+                )
+                raise ValueError(
+                    "Failed to render PDF pages {}-{}, pdftoppm errorcode: {} - {}".format(
+                        range_first, range_last, returncode, " ".join(errors)
+                    )
+                )
+
+            if not progress and not cancelled.is_set():
+                for page, path in _find_page_images(range_dir, "page-images", ext):
+                    if range_first <= page <= range_last:
+                        dest = os.path.join(outputdir, os.path.basename(path))
+                        os.replace(path, dest)
+                        results.put((page, dest))
+        finally:
+            _remove_dir(range_dir, outputdir)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdftoppm")
+    try:
+        futures = [executor.submit(render_range, r) for r in ranges]
+        for future in futures:
+            future.add_done_callback(lambda f: results.put(None))
+
+        remaining = len(futures)
+        while remaining:
+            item = results.get()
+            if item is None:
+                remaining -= 1
+                continue
+            yield item
+
+        for future in futures:
+            # Raises the first rendering error (if there was one)
+            future.result()
+    finally:
+        cancelled.set()
+        with running_lock:
+            for proc in running:
+                kill_process_group(proc)
+        executor.shutdown(wait=True)
+
+
+def _check_quarantine(pdfpath, quarantine):
+    if quarantine is not None and pdfpath in quarantine:
+        raise ValueError("Failed to render PDF, %s is quarantined" % pdfpath)
+
+
+def _quarantine_failure(pdfpath, quarantine, returncode, limits, stderr, timed_out):
+    """
+    Quarantine a file pdftoppm failed on - if it was killed by the timeout or one of the limits.
+    :param stderr: As bytes
+    """
+    if quarantine is None:
+        return
+    if timed_out:
+        quarantine.add(pdfpath, "pdftoppm timeout")
+        return
+    reason = hit_limit(returncode, limits, stderr)
+    if reason is not None:
+        quarantine.add(pdfpath, "pdftoppm " + reason)
+
+
+def _remove_dir(range_dir, outputdir):
+    if range_dir != outputdir:
+        shutil.rmtree(range_dir, ignore_errors=True)
+
+
+_page_image_pat = re.compile(r"^(?P<root>.+)-(?P<page>\d+)(?P<ext>\.\w+)$")
+
+
+def _find_page_images(outputdir, root_name, ext):
+    """
+    List the images pdftoppm has written to outputdir for the given output root.
+    :param outputdir:
+    :param root_name:
+    :param ext:
+    :return: A list of (page_number, image_path) tuples
+    """
+    found = []
+    for name in os.listdir(outputdir):
+        match = _page_image_pat.match(name)
+        if match and match.group("root") == root_name and match.group("ext") == ext:
+            found.append((int(match.group("page")), os.path.join(outputdir, name)))
+    return found
+
+
+########################################################################################################################
+# In memory rendering - pdftoppm writes the images to stdout (the output root is "-") and they're split apart here, so
+# nothing touches the disk.
+
+
+def iter_page_images_bytes(
+    pdfpath, first=1, last=1, dpi=None, scale_to=None, fmt="jpeg", timeout=None, limits=None, quarantine=None
+):
+    """
+    Render pages first to last (inclusive) of a pdf, without writing any files.
+    A generator - yields (page_number, image_bytes) for each page, in page order, as soon as pdftoppm has written it.
+    :param pdfpath:
+    :param first:
+    :param last:
+    :param dpi: As for pdftoppm_options
+    :param scale_to: As for pdftoppm_options
+    :param fmt: As for pdftoppm_options
+    :param timeout: Seconds to allow pdftoppm before killing it. None waits forever.
+    :param limits: As for _popen_args
+    :param quarantine: As for page_images_parallel
+    :return:
+    """
+    pdf_to_ppm = find_tool("pdftoppm")
+    if pdf_to_ppm is None:
+        raise ValueError("Failed to render PDF, pdftoppm could not be found")
+
+    pdfpath = os.path.abspath(pdfpath)
+    _check_quarantine(pdfpath, quarantine)
+    cmd = [pdf_to_ppm] + pdftoppm_options(dpi=dpi, scale_to=scale_to, fmt=fmt)
+    cmd.extend(["-f", str(first), "-l", str(last), pdfpath, "-"])
+    split_images = _split_png if fmt == "png" else _split_jpeg
+
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        **_popen_args(limits)
+    )
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        kill_process_group(proc)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+
+    # stderr is drained on a thread - otherwise a chatty pdftoppm could fill the pipe and stall
+    errors = []
+    err_reader = threading.Thread(target=lambda: errors.append(proc.stderr.read()))
+    err_reader.daemon = True
+    err_reader.start()
+
+    try:
+        page = first
+        for image in split_images(_StreamReader(proc.stdout)):
+            yield page, image
+            page += 1
+        returncode = proc.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if proc.poll() is None:
+            kill_process_group(proc)
+            proc.wait()
+        proc.stdout.close()
+        err_reader.join()
+        proc.stderr.close()
+
+    if returncode != 0:
+        stderr = b"".join(errors)
+        _quarantine_failure(pdfpath, quarantine, returncode, limits, stderr, timed_out.is_set())
+        if timed_out.is_set():
+            raise ValueError("Failed to render PDF, pdftoppm timed out after %s seconds" % timeout)
+        raise ValueError(
+            "Failed to render PDF, pdftoppm errorcode: {} - {}".format(
+                returncode, stderr.decode("utf-8", errors="replace").strip()
+            )
+        )
+
+
+def render_pages_bytes(
+    pdfpath,
+    first=1,
+    last=1,
+    dpi=None,
+    scale_to=None,
+    fmt="jpeg",
+    timeout=None,
+    callback=None,
+    limits=None,
+    quarantine=None,
+):
+    """
+    Render pages first to last (inclusive) of a pdf, without writing any files.
+    :param pdfpath:
+    :param first:
+    :param last:
+    :param dpi: As for pdftoppm_options
+    :param scale_to: As for pdftoppm_options
+    :param fmt: As for pdftoppm_options
+    :param timeout: As for iter_page_images_bytes
+    :param callback: If given, called as callback(page_number, image_bytes) for each page as it's rendered - and
+                     nothing is returned. Saves holding every page in memory at once.
+    :param limits: As for _popen_args
+    :param quarantine: As for page_images_parallel
+    :return: A list of (page_number, image_bytes) tuples - unless a callback was given
+    """
+    pages = iter_page_images_bytes(
+        pdfpath,
+        first=first,
+        last=last,
+        dpi=dpi,
+        scale_to=scale_to,
+        fmt=fmt,
+        timeout=timeout,
+        limits=limits,
+        quarantine=quarantine,
+    )
+    if callback is None:
+        return list(pages)
+    for page, image in pages:
+        callback(page, image)
+    return None
+
+
+def render_cover_bytes(pdfpath, dpi=None, scale_to=None, fmt="jpeg", timeout=None, limits=None, quarantine=None):
+    """
+    Render the first page of a pdf, without writing any files.
+    :param pdfpath:
+    :param dpi: As for pdftoppm_options
+    :param scale_to: As for pdftoppm_options
+    :param fmt: As for pdftoppm_options
+    :param timeout: As for iter_page_images_bytes
+    :param limits: As for _popen_args
+    :param quarantine: As for page_images_parallel
+    :return: The image, as bytes
+    """
+    for _, image in iter_page_images_bytes(
+        pdfpath,
+        first=1,
+        last=1,
+        dpi=dpi,
+        scale_to=scale_to,
+        fmt=fmt,
+        timeout=timeout,
+        limits=limits,
+        quarantine=quarantine,
+    ):
+        return image
+    raise ValueError("Failed to render PDF, pdftoppm returned no image")
+
+
+class _StreamReader(object):
+    """
+    Buffered reads from a pipe - with the lookahead needed to find where one image ends and the next begins.
+    """
+
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buf = bytearray()
+        self.eof = False
+
+    def fill(self, size):
+        """
+        Read until at least size bytes are buffered (or the stream ends).
+        :param size:
+        :return: True if size bytes are now buffered
+        """
+        while len(self.buf) < size and not self.eof:
+            chunk = self.stream.read1(self.READ_SIZE)
+            if not chunk:
+                self.eof = True
+                break
+            self.buf.extend(chunk)
+        return len(self.buf) >= size
+
+    def take(self, size):
+        """
+        Remove size bytes from the front of the buffer and return them.
+        :param size:
+        :return:
+        """
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _split_png(reader):
+    """
+    Split a stream of concatenated PNG images - yielding each image's bytes.
+    Walks the chunks of each image up to its IEND chunk.
+    :param reader: A _StreamReader
+    :return:
+    """
+    while reader.fill(1):
+        if not reader.fill(8) or reader.buf[:8] != _PNG_SIGNATURE:
+            raise ValueError("Failed to render PDF, pdftoppm returned a malformed PNG")
+        pos = 8
+        while True:
+            if not reader.fill(pos + 8):
+                raise ValueError("Failed to render PDF, pdftoppm returned a truncated PNG")
+            length = int.from_bytes(reader.buf[pos:pos + 4], "big")
+            chunk_type = bytes(reader.buf[pos + 4:pos + 8])
+            # length, type, data, crc
+            pos += 12 + length
+            if chunk_type == b"IEND":
+                break
+        if not reader.fill(pos):
+            raise ValueError("Failed to render PDF, pdftoppm returned a truncated PNG")
+        yield reader.take(pos)
+
+
+# JPEG markers with no length field after them
+_JPEG_STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+
+
+def _split_jpeg(reader):
+    """
+    Split a stream of concatenated JPEG images - yielding each image's bytes.
+    Walks the marker segments of each image. Entropy coded data is searched for the next marker, as 0xFF bytes inside it
+    are always followed by 0x00 or a restart marker.
+    :param reader: A _StreamReader
+    :return:
+    """
+    while reader.fill(1):
+        if not reader.fill(2) or reader.buf[:2] != b"\xff\xd8":
+            raise ValueError("Failed to render PDF, pdftoppm returned a malformed JPEG")
+        pos = 2
+        in_scan = False
+        while True:
+            if in_scan:
+                # Find the marker ending the scan
+                ff = reader.buf.find(b"\xff", pos)
+                while ff == -1 or ff + 1 >= len(reader.buf):
+                    if not reader.fill(len(reader.buf) + 1):
+                        raise ValueError("Failed to render PDF, pdftoppm returned a truncated JPEG")
+                    ff = reader.buf.find(b"\xff", pos)
+                marker = reader.buf[ff + 1]
+                if marker == 0x00 or marker == 0xFF or 0xD0 <= marker <= 0xD7:
+                    pos = ff + 1
+                    continue
+                pos = ff
+                in_scan = False
+                continue
+
+            if not reader.fill(pos + 2):
+                raise ValueError("Failed to render PDF, pdftoppm returned a truncated JPEG")
+            if reader.buf[pos] != 0xFF:
+                raise ValueError("Failed to render PDF, pdftoppm returned a malformed JPEG")
+            marker = reader.buf[pos + 1]
+            if marker == 0xFF:
+                # Fill byte
+                pos += 1
+                continue
+            if marker == 0xD9:
+                pos += 2
+                break
+            if marker in _JPEG_STANDALONE_MARKERS:
+                pos += 2
+                continue
+            if not reader.fill(pos + 4):
+                raise ValueError("Failed to render PDF, pdftoppm returned a truncated JPEG")
+            pos += 2 + int.from_bytes(reader.buf[pos + 2:pos + 4], "big")
+            if marker == 0xDA:
+                in_scan = True
+        yield reader.take(pos)
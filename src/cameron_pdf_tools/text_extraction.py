@@ -0,0 +1,281 @@
+
+# Full text extraction with pdftohtml - as recommended in the README for making documents searchable.
+# pdftohtml is run in xml mode, writing to stdout, and the text of each page is pulled out of that.
+# Extracted text is kept in a TextStore - one file per pdf, pages separated by form feeds (as pdftotext does), with a
+# one line header recording which pdf it came from. Files whose text is newer than the pdf are skipped.
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from cameron_pdf_tools import decode_entities
+from cameron_pdf_tools.tools import find_tool
+from cameron_pdf_tools import process_limits
+
+
+PAGE_SEPARATOR = "\f"
+
+# Documents with more pages than this are split into ranges, each handled by its own pdftohtml process
+PAGES_PER_RANGE = 200
+
+_page_pat = re.compile(r'<page number="(\d+)"[^>]*>(.*?)</page>', re.S)
+_text_pat = re.compile(r"<text\b[^>]*>(.*?)</text>", re.S)
+_tag_pat = re.compile(r"<[^>]+>")
+
+
+class TextExtractionError(Exception):
+    """
+    Raised when pdftohtml fails on a file.
+    """
+
+
+class TextStore(object):
+    """
+    Extracted text, on disk.
+
+    Layout - for each pdf, root/ab/abcdef....txt (named by a hash of the pdf's absolute path). The first line is a json
+    header ({"source": <pdf path>, "pages": <page count>}), the rest the text of each page, separated by form feeds.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, pdfpath):
+        """
+        Where the text for a pdf lives (whether or not it exists).
+        :param pdfpath:
+        :return:
+        """
+        key = hashlib.sha1(os.path.abspath(pdfpath).encode("utf-8", errors="surrogateescape")).hexdigest()
+        return os.path.join(self.root, key[:2], key + ".txt")
+
+    def is_up_to_date(self, pdfpath):
+        """
+        Check if the stored text for a pdf was written after the pdf was last modified.
+        :param pdfpath:
+        :return:
+        """
+        try:
+            return os.stat(self.path_for(pdfpath)).st_mtime_ns >= os.stat(pdfpath).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def write(self, pdfpath, pages):
+        """
+        Store the text of a pdf - replacing anything stored for it before.
+        :param pdfpath:
+        :param pages: A list of strings - the text of each page, in order
+        :return: The path the text was written to
+        """
+        path = self.path_for(pdfpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({"source": os.path.abspath(pdfpath), "pages": len(pages)})
+
+        # Page text can't contain the separator - pdftohtml doesn't emit form feeds, but be sure
+        body = PAGE_SEPARATOR.join(page.replace(PAGE_SEPARATOR, " ") for page in pages)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", errors="surrogateescape", newline="") as stream:
+                stream.write(header)
+                stream.write("\n")
+                stream.write(body)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return path
+
+    def read(self, pdfpath):
+        """
+        Return the stored text of a pdf as a list of pages - or None if there is none.
+        :param pdfpath:
+        :return:
+        """
+        try:
+            return read_text_file(self.path_for(pdfpath))[1]
+        except FileNotFoundError:
+            return None
+
+    def remove(self, pdfpath):
+        """
+        Remove the stored text of a pdf, if there is any.
+        :param pdfpath:
+        :return:
+        """
+        try:
+            os.remove(self.path_for(pdfpath))
+        except FileNotFoundError:
+            pass
+
+    def text_files(self):
+        """
+        Iterate over the paths of every stored text file.
+        :return:
+        """
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".txt") and not name.startswith(".tmp-"):
+                    yield os.path.join(dirpath, name)
+
+
+def read_text_file(path):
+    """
+    Read one file of a TextStore.
+    :param path:
+    :return: A tuple of the header dictionary, and the list of page texts
+    """
+    with open(path, "r", encoding="utf-8", errors="surrogateescape", newline="") as stream:
+        header = json.loads(stream.readline())
+        body = stream.read()
+    pages = body.split(PAGE_SEPARATOR) if header["pages"] else []
+    return header, pages
+
+
+def parse_pdftohtml_xml(raw):
+    """
+    Pull the text of each page out of the output of pdftohtml -xml.
+    :param raw: The xml, as a string
+    :return: A list of (page_number, text) tuples, in the order found
+    """
+    pages = []
+    for page_match in _page_pat.finditer(raw):
+        lines = []
+        for text_match in _text_pat.finditer(page_match.group(2)):
+            line = decode_entities(_tag_pat.sub("", text_match.group(1)))
+            if line.strip():
+                lines.append(line)
+        pages.append((int(page_match.group(1)), "\n".join(lines)))
+    return pages
+
+
+def run_pdftohtml(pdfpath, first=None, last=None, timeout=None, limits=None):
+    """
+    Extract the text of a pdf (or a range of its pages) with pdftohtml.
+    :param pdfpath:
+    :param first: First page to extract - None for the start of the document
+    :param last: Last page to extract - None for the end of the document
+    :param timeout: Seconds to allow pdftohtml before killing it. None waits forever.
+    :param limits: A process_limits.ResourceLimits - defaults to process_limits.default_limits
+    :return: A list of (page_number, text) tuples
+    """
+    pdftohtml = find_tool("pdftohtml")
+    if pdftohtml is None:
+        raise TextExtractionError("pdftohtml could not be found")
+
+    cmd = [pdftohtml, "-xml", "-stdout", "-i", "-q", "-enc", "UTF-8"]
+    if first is not None:
+        cmd.extend(["-f", str(first)])
+    if last is not None:
+        cmd.extend(["-l", str(last)])
+    cmd.append(os.path.abspath(pdfpath))
+
+    try:
+        raw = process_limits.check_output(cmd, timeout=timeout, limits=limits)
+    except subprocess.CalledProcessError as e:
+        raise TextExtractionError(
+            "pdftohtml errored out on {} with return code: {}".format(pdfpath, e.returncode)
+        )
+    except subprocess.TimeoutExpired:
+        raise TextExtractionError(
+            "pdftohtml timed out on {} after {} seconds".format(pdfpath, timeout)
+        )
+
+    return parse_pdftohtml_xml(raw.decode("utf-8", errors="replace"))
+
+
+def page_count(pdfpath, timeout=None):
+    """
+    The number of pages in a pdf, from pdfinfo - or None if it can't be found.
+    :param pdfpath:
+    :param timeout:
+    :return:
+    """
+    from cameron_pdf_tools.metadata_extractor import read_info
+
+    pdfpath = os.path.abspath(pdfpath)
+    info = read_info(os.path.dirname(pdfpath), False, src=pdfpath, timeout=timeout)
+    try:
+        return int(info["Pages"])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def extract_text(pdfpath, store=None, workers=1, pages_per_range=PAGES_PER_RANGE, timeout=None):
+    """
+    Extract the text of every page of a pdf.
+    Documents longer than pages_per_range are split into ranges, run as concurrent pdftohtml processes.
+    :param pdfpath:
+    :param store: A TextStore - if given the text is written to it
+    :param workers: Number of pdftohtml processes to run at once for this document
+    :param pages_per_range:
+    :param timeout: Seconds to allow each pdftohtml (and pdfinfo) call
+    :return: A list of the text of each page, in order
+    """
+    pages = None
+    if workers > 1 and find_tool("pdfinfo") is not None:
+        pages = page_count(pdfpath, timeout=timeout)
+
+    if pages is None or pages <= pages_per_range:
+        found = run_pdftohtml(pdfpath, timeout=timeout)
+    else:
+        from cameron_pdf_tools.rendering import page_ranges
+
+        ranges = page_ranges(1, pages, -(-pages // pages_per_range))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdftohtml") as executor:
+            futures = [
+                executor.submit(run_pdftohtml, pdfpath, first=first, last=last, timeout=timeout)
+                for first, last in ranges
+            ]
+            found = [page for future in futures for page in future.result()]
+
+    found.sort(key=lambda page: page[0])
+    text = [page_text for _, page_text in found]
+
+    if store is not None:
+        store.write(pdfpath, text)
+    return text
+
+
+def extract_text_batch(
+    pdfpaths, store, workers=None, range_workers=1, pages_per_range=PAGES_PER_RANGE, timeout=None, force=False
+):
+    """
+    Extract the text of many pdfs into a TextStore - several files at once.
+    A generator - yields (pdfpath, status) as each file finishes (not in input order). status is "extracted", "skipped"
+    (the stored text was already up to date) or the exception raised for that file.
+    :param pdfpaths: Iterable of paths to pdfs
+    :param store: The TextStore to write to
+    :param workers: Number of files to work on at once. Defaults to the number of CPUs.
+    :param range_workers: As the workers argument of extract_text - per file
+    :param pages_per_range: As for extract_text
+    :param timeout: As for extract_text
+    :param force: If True, extract files even if their text is up to date
+    :return:
+    """
+    workers = workers or os.cpu_count() or 1
+
+    def extract_one(pdfpath):
+        if not force and store.is_up_to_date(pdfpath):
+            return "skipped"
+        extract_text(
+            pdfpath, store=store, workers=range_workers, pages_per_range=pages_per_range, timeout=timeout
+        )
+        return "extracted"
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdftohtml") as executor:
+        futures = {executor.submit(extract_one, pdfpath): pdfpath for pdfpath in pdfpaths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
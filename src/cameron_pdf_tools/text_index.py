@@ -0,0 +1,631 @@
+
+# An inverted index over the page text held in a TextStore - so a search is a lookup rather than a scan of every file.
+#
+# The index is a directory of immutable segments plus a manifest (index.json) saying which segments are live, which
+# documents they hold and which documents have since been deleted.
+# Each segment is three files
+#   - <name>.post - the postings. For each term, the pages it occurs on and where, as varints (see encode_postings).
+#   - <name>.terms - json, term -> [offset into .post, length in bytes, number of pages the term is on]
+#   - <name>.docs - json, doc id -> {"source": pdf path, "page_lengths": [tokens on each page]}
+# Adding documents writes a new segment. Updating a document deletes it (in the manifest) and adds it again. Segments
+# are merged - dropping deleted documents - to keep their number down, either on request or by a background thread.
+# Merging is tiered: segments are grouped by size (a tier per MERGE_FACTOR times bigger) and only MERGE_FACTOR segments
+# of one tier are merged at a time - so each document is rewritten once per tier, not once per commit.
+
+import json
+import math
+import mmap
+import os
+import re
+import tempfile
+import threading
+import uuid
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+MANIFEST_NAME = "index.json"
+
+# Merge the smallest segments once there are more than this - even if no tier is full
+MAX_SEGMENTS = 8
+
+# Segments in one tier merged at a time - and the ratio between the sizes of neighbouring tiers
+MERGE_FACTOR = 4
+
+# Segments with postings smaller than this (in bytes) are all in the bottom tier
+MIN_TIER_SIZE = 64 * 1024
+
+_token_pat = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Split text into lower case word tokens.
+    :param text:
+    :return: A list of tokens - a token's position is its index in the list
+    """
+    return _token_pat.findall(text.lower())
+
+
+########################################################################################################################
+# Postings encoding
+
+
+def encode_varints(values, out):
+    """
+    Append each (non-negative) integer to a bytearray as a varint - 7 bits per byte, high bit set on all but the last.
+    :param values:
+    :param out:
+    :return:
+    """
+    for value in values:
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(buf, start=0, end=None):
+    """
+    Decode a run of varints.
+    :param buf: bytes, bytearray, memoryview or mmap
+    :param start:
+    :param end:
+    :return: A list of integers
+    """
+    if end is None:
+        end = len(buf)
+    values = []
+    append = values.append
+    value = 0
+    shift = 0
+    for byte in buf[start:end]:
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            append(value | (byte << shift))
+            value = 0
+            shift = 0
+    return values
+
+
+def encode_postings(postings):
+    """
+    Encode the postings of one term.
+    :param postings: A list of (doc_id, page, positions) tuples, sorted by doc_id then page. Positions sorted.
+    :return bytes: For each entry - doc id delta, page (delta from the last page if the doc id is unchanged), the number
+                   of positions, then the position deltas. All varints.
+    """
+    out = bytearray()
+    last_doc = 0
+    last_page = 0
+    for doc_id, page, positions in postings:
+        if doc_id != last_doc:
+            last_page = 0
+        encode_varints((doc_id - last_doc, page - last_page, len(positions)), out)
+        last_pos = 0
+        for pos in positions:
+            encode_varints((pos - last_pos,), out)
+            last_pos = pos
+        last_doc = doc_id
+        last_page = page
+    return bytes(out)
+
+
+def decode_postings(buf, start=0, end=None):
+    """
+    Decode the postings of one term - the reverse of encode_postings.
+    :param buf:
+    :param start:
+    :param end:
+    :return: A list of (doc_id, page, positions) tuples
+    """
+    values = decode_varints(buf, start, end)
+    postings = []
+    i = 0
+    doc_id = 0
+    page = 0
+    n = len(values)
+    while i < n:
+        doc_delta, page_delta, count = values[i], values[i + 1], values[i + 2]
+        i += 3
+        if doc_delta:
+            doc_id += doc_delta
+            page = 0
+        page += page_delta
+        positions = []
+        pos = 0
+        for delta in values[i:i + count]:
+            pos += delta
+            positions.append(pos)
+        i += count
+        postings.append((doc_id, page, positions))
+    return postings
+
+
+########################################################################################################################
+# Segments
+
+
+def _atomic_write(path, data, mode="wb"):
+    """
+    Write a file by writing a temporary file next to it and moving it into place.
+    :param path:
+    :param data:
+    :param mode:
+    :return:
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as stream:
+            stream.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_segment(root, docs, term_postings):
+    """
+    Write a new segment.
+    :param root: The index directory
+    :param docs: A dictionary keyed by doc id and valued with {"source": ..., "page_lengths": [...]}
+    :param term_postings: A dictionary keyed by term and valued with the postings list for that term (as for
+                          encode_postings)
+    :return: The name of the new segment
+    """
+    name = "seg-" + uuid.uuid4().hex[:16]
+    post = bytearray()
+    terms = dict()
+    for term in sorted(term_postings):
+        postings = term_postings[term]
+        encoded = encode_postings(postings)
+        terms[term] = [len(post), len(encoded), len(postings)]
+        post.extend(encoded)
+
+    # Postings and terms before docs - a segment is only complete (and only listed in the manifest) once all three exist
+    _atomic_write(os.path.join(root, name + ".post"), bytes(post))
+    _atomic_write(os.path.join(root, name + ".terms"), json.dumps(terms), mode="w")
+    _atomic_write(
+        os.path.join(root, name + ".docs"),
+        json.dumps({str(doc_id): doc for doc_id, doc in docs.items()}),
+        mode="w",
+    )
+    return name
+
+
+class Segment(object):
+    """
+    A read only view of one segment on disk. The postings file is memory mapped.
+    Readers hold a reference (acquire/release) while they use it - a segment merged away is closed once the last one is
+    released.
+    """
+
+    def __init__(self, root, name):
+        self.root = root
+        self.name = name
+        self._refs_lock = threading.Lock()
+        self._refs = 0
+        self._retired = False
+        with open(os.path.join(root, name + ".terms"), "r", encoding="utf-8") as stream:
+            self.terms = json.load(stream)
+        with open(os.path.join(root, name + ".docs"), "r", encoding="utf-8") as stream:
+            self.docs = {int(doc_id): doc for doc_id, doc in json.load(stream).items()}
+
+        with open(os.path.join(root, name + ".post"), "rb") as stream:
+            if os.fstat(stream.fileno()).st_size:
+                self.post = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.post = b""
+
+    def postings(self, term):
+        """
+        The postings of a term in this segment.
+        :param term:
+        :return: A list of (doc_id, page, positions) tuples - empty if the term isn't in the segment
+        """
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        offset, length, _ = entry
+        return decode_postings(self.post, offset, offset + length)
+
+    @property
+    def size(self):
+        """
+        The size of the postings, in bytes.
+        """
+        return len(self.post)
+
+    def tier(self, merge_factor=MERGE_FACTOR):
+        """
+        Which merge tier the segment is in - 0 for the smallest.
+        """
+        if self.size < MIN_TIER_SIZE:
+            return 0
+        return 1 + int(math.log(self.size / MIN_TIER_SIZE, merge_factor))
+
+    def acquire(self):
+        with self._refs_lock:
+            self._refs += 1
+
+    def release(self):
+        with self._refs_lock:
+            self._refs -= 1
+            close = self._retired and not self._refs
+        if close:
+            self.close()
+
+    def retire(self):
+        """
+        Close the segment once nothing is reading it - it's been merged away.
+        """
+        with self._refs_lock:
+            self._retired = True
+            close = not self._refs
+        if close:
+            self.close()
+
+    def close(self):
+        if isinstance(self.post, mmap.mmap):
+            self.post.close()
+
+    def files(self):
+        return [os.path.join(self.root, self.name + ext) for ext in (".post", ".terms", ".docs")]
+
+
+########################################################################################################################
+# The index
+
+
+class TextIndex(object):
+    """
+    An incrementally updated inverted index of page text.
+
+    Usage:
+
+        index = TextIndex("/var/index")
+        index.update_from_store(text_store)
+        for source, page, positions in index.lookup("poppler"):
+            ...
+    """
+
+    def __init__(self, root, max_segments=MAX_SEGMENTS, merge_factor=MERGE_FACTOR):
+        """
+        :param root: Directory to keep the index in - created if it doesn't exist
+        :param max_segments: Merge the smallest segments once there are more than this
+        :param merge_factor: Merge this many segments of the same tier at once
+        """
+        self.root = os.path.abspath(root)
+        self.max_segments = max_segments
+        self.merge_factor = max(2, merge_factor)
+        os.makedirs(self.root, exist_ok=True)
+
+        # Guards the manifest state and the segment list
+        self._lock = threading.RLock()
+        # Only one merge at a time
+        self._merge_lock = threading.Lock()
+        self._merger = None
+        self._stop_merger = threading.Event()
+
+        self._pending_docs = dict()
+        self._pending_postings = defaultdict(list)
+        self._load()
+
+    # Manifest
+
+    def _load(self):
+        path = os.path.join(self.root, MANIFEST_NAME)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as stream:
+                manifest = json.load(stream)
+        else:
+            manifest = {"next_doc_id": 1, "segments": [], "sources": {}, "deleted": []}
+
+        self.next_doc_id = manifest["next_doc_id"]
+        # source -> [doc id, mtime_ns of the text it was indexed from]
+        self.sources = manifest["sources"]
+        self.deleted = set(manifest["deleted"])
+        self.segments = [Segment(self.root, name) for name in manifest["segments"]]
+
+    def _save(self):
+        manifest = {
+            "next_doc_id": self.next_doc_id,
+            "segments": [segment.name for segment in self.segments],
+            "sources": self.sources,
+            "deleted": sorted(self.deleted),
+        }
+        _atomic_write(os.path.join(self.root, MANIFEST_NAME), json.dumps(manifest), mode="w")
+
+    # Changes
+
+    def add_document(self, source, pages, mtime_ns=None):
+        """
+        Add (or replace) the text of a pdf. Nothing is written until commit is called.
+        :param source: The path of the pdf
+        :param pages: A list of the text of each page
+        :param mtime_ns: The modification time of the text - used by update_from_store to spot changes
+        :return: The doc id given to the document
+        """
+        with self._lock:
+            self._delete(source)
+            doc_id = self.next_doc_id
+            self.next_doc_id += 1
+
+            page_lengths = []
+            for page_number, text in enumerate(pages, start=1):
+                positions = defaultdict(list)
+                tokens = tokenize(text)
+                for pos, token in enumerate(tokens):
+                    positions[token].append(pos)
+                for token, token_positions in positions.items():
+                    self._pending_postings[token].append((doc_id, page_number, token_positions))
+                page_lengths.append(len(tokens))
+
+            self._pending_docs[doc_id] = {"source": source, "page_lengths": page_lengths}
+            self.sources[source] = [doc_id, mtime_ns]
+            return doc_id
+
+    def delete_document(self, source):
+        """
+        Remove a pdf from the index. Nothing is written until commit is called.
+        :param source: The path of the pdf
+        :return: True if the pdf was in the index
+        """
+        with self._lock:
+            return self._delete(source)
+
+    def _delete(self, source):
+        entry = self.sources.pop(source, None)
+        if entry is None:
+            return False
+        doc_id = entry[0]
+        if doc_id in self._pending_docs:
+            # Not yet written - just forget it
+            del self._pending_docs[doc_id]
+            for postings in self._pending_postings.values():
+                postings[:] = [p for p in postings if p[0] != doc_id]
+        else:
+            self.deleted.add(doc_id)
+        return True
+
+    def commit(self):
+        """
+        Write any added documents as a new segment, and save the manifest.
+        Merges segments if a tier is now full (and no background merger is running).
+        :return:
+        """
+        with self._lock:
+            if self._pending_docs:
+                term_postings = {t: p for t, p in self._pending_postings.items() if p}
+                name = write_segment(self.root, self._pending_docs, term_postings)
+                self.segments.append(Segment(self.root, name))
+                self._pending_docs = dict()
+                self._pending_postings = defaultdict(list)
+            self._save()
+
+        if self._merger is None:
+            self._merge_tiers()
+
+    def update_from_store(self, store, commit=True):
+        """
+        Bring the index in line with a TextStore - adding new and changed documents and deleting ones which are gone.
+        Only text files modified since they were last indexed are read.
+        :param store: A text_extraction.TextStore
+        :param commit: If True, commit when done
+        :return: A tuple of the number of documents (added or updated, deleted)
+        """
+        from cameron_pdf_tools.text_extraction import read_text_file
+
+        seen = set()
+        changed = 0
+        for path in store.text_files():
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                header, pages = read_text_file(path)
+            except (FileNotFoundError, ValueError):
+                continue
+            source = header["source"]
+            seen.add(source)
+            entry = self.sources.get(source)
+            if entry is not None and entry[1] == mtime_ns:
+                continue
+            self.add_document(source, pages, mtime_ns=mtime_ns)
+            changed += 1
+
+        deleted = 0
+        for source in list(self.sources):
+            if source not in seen:
+                self.delete_document(source)
+                deleted += 1
+
+        if commit:
+            self.commit()
+        return changed, deleted
+
+    # Merging
+
+    def merge_candidates(self):
+        """
+        The segments the merge policy would merge next - MERGE_FACTOR segments from the smallest full tier. If no tier
+        is full but there are more than max_segments, the smallest segments, enough to bring the count back down.
+        :return: A list of segments - empty if nothing needs merging
+        """
+        with self._lock:
+            segments = sorted(self.segments, key=lambda segment: segment.size)
+        tiers = defaultdict(list)
+        for segment in segments:
+            tiers[segment.tier(self.merge_factor)].append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        if len(segments) > self.max_segments:
+            return segments[:len(segments) - self.max_segments + 1]
+        return []
+
+    def _merge_tiers(self):
+        """
+        Merge until the policy is satisfied - a merge can fill the tier above.
+        """
+        candidates = self.merge_candidates()
+        while candidates:
+            self.merge(candidates)
+            candidates = self.merge_candidates()
+
+    def merge(self, segments=None):
+        """
+        Merge segments into one - dropping deleted documents.
+        Searches can carry on while this runs; the merged segment replaces the originals once it's written.
+        :param segments: The segments to merge - defaults to all of them
+        :return:
+        """
+        with self._merge_lock:
+            with self._lock:
+                if segments is None:
+                    segments = list(self.segments)
+                # Another merge may have got to some of these first
+                live = {segment.name for segment in self.segments}
+                segments = [segment for segment in segments if segment.name in live]
+                deleted = set(self.deleted)
+            if len(segments) < 2 and not any(d in deleted for s in segments for d in s.docs):
+                return
+
+            docs = dict()
+            for segment in segments:
+                for doc_id, doc in segment.docs.items():
+                    if doc_id not in deleted:
+                        docs[doc_id] = doc
+
+            term_postings = defaultdict(list)
+            for segment in segments:
+                for term in segment.terms:
+                    term_postings[term].extend(
+                        p for p in segment.postings(term) if p[0] not in deleted
+                    )
+            term_postings = {t: sorted(p, key=lambda x: (x[0], x[1])) for t, p in term_postings.items() if p}
+
+            name = write_segment(self.root, docs, term_postings)
+            merged = Segment(self.root, name)
+
+            with self._lock:
+                # Documents deleted while the merge ran are still in the merged segment - but still marked deleted
+                old_names = {segment.name for segment in segments}
+                self.segments = [merged] + [s for s in self.segments if s.name not in old_names]
+                # Deletions of documents which were merged away no longer need remembering
+                self.deleted -= {d for d in deleted if not any(d in s.docs for s in self.segments)}
+                self._save()
+
+            # Closed now - or, if a search is still reading one, when it's done
+            for segment in segments:
+                segment.retire()
+                for path in segment.files():
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def start_background_merger(self, interval=30.0):
+        """
+        Start a thread which merges segments whenever the merge policy calls for it (see merge_candidates).
+        :param interval: Seconds between checks
+        :return:
+        """
+        if self._merger is not None:
+            return
+        self._stop_merger.clear()
+
+        def run():
+            while not self._stop_merger.wait(interval):
+                self._merge_tiers()
+
+        self._merger = threading.Thread(target=run, name="text-index-merger")
+        self._merger.daemon = True
+        self._merger.start()
+
+    def stop_background_merger(self):
+        """
+        Stop the background merge thread - waiting for any merge in progress to finish.
+        :return:
+        """
+        if self._merger is None:
+            return
+        self._stop_merger.set()
+        self._merger.join()
+        self._merger = None
+
+    # Queries
+
+    def live_segments(self):
+        """
+        The current segments and deleted doc ids. A segment merged away is closed - use snapshot to search while the
+        index may be changing.
+        :return:
+        """
+        with self._lock:
+            return list(self.segments), set(self.deleted)
+
+    @contextmanager
+    def snapshot(self):
+        """
+        The current segments and deleted doc ids - kept open until the with block ends, whatever merges happen.
+
+            with index.snapshot() as (segments, deleted):
+                ...
+        """
+        with self._lock:
+            segments = list(self.segments)
+            deleted = set(self.deleted)
+            for segment in segments:
+                segment.acquire()
+        try:
+            yield segments, deleted
+        finally:
+            for segment in segments:
+                segment.release()
+
+    def lookup(self, term):
+        """
+        Find every page a term occurs on.
+        :param term: A single token (it's lower cased)
+        :return: A list of (source, page, positions) tuples
+        """
+        term = term.lower()
+        results = []
+        with self.snapshot() as (segments, deleted):
+            for segment in segments:
+                for doc_id, page, positions in segment.postings(term):
+                    if doc_id not in deleted:
+                        results.append((segment.docs[doc_id]["source"], page, positions))
+        return results
+
+    def search(self, query):
+        """
+        Find the pages containing every token of a query (in any order).
+        :param query: A string
+        :return: A sorted list of (source, page) tuples
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        pages = None
+        for token in set(tokens):
+            found = {(source, page) for source, page, _ in self.lookup(token)}
+            pages = found if pages is None else pages & found
+            if not pages:
+                return []
+        return sorted(pages)
+
+    def close(self):
+        """
+        Stop the background merger and release the segment files.
+        :return:
+        """
+        self.stop_background_merger()
+        with self._lock:
+            for segment in self.segments:
+                segment.close()
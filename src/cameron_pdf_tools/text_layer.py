@@ -0,0 +1,269 @@
+
+# Telling whether a pdf has embedded text - so only the ones which don't are sent to OCR (see the README).
+# Nothing is laid out or decoded as text. A few pages are sampled, and for each the resources are checked for fonts and
+# the content streams scanned for the operators which show text (Tj, TJ, ' and ") - including inside form xobjects,
+# one level down. Text made invisible (as OCR tools leave it) still counts - it's still a text layer.
+
+import os
+import re
+import zlib
+
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import LITERALS_FLATE_DECODE, PDFStream, int_value, resolve1
+
+
+# Pages sampled, by default - the first, the last and some evenly spaced between
+SAMPLE_PAGES = 3
+
+# Confidence at or above which a file is taken to have a text layer
+TEXT_THRESHOLD = 0.5
+
+# Bytes of each content stream decompressed and scanned - text operators almost always show up well before this.
+# Flate streams (nearly all of them) are only decompressed this far - others are decoded whole, then cut short.
+MAX_SCAN_BYTES = 1024 * 1024
+
+# A string (or array of strings) operand followed by a text showing operator
+_show_text_pat = re.compile(rb"[)>\]]\s*(?:Tj|TJ|'|\")(?![A-Za-z])")
+
+# The start of an inline image
+_inline_image_pat = re.compile(rb"(?<![A-Za-z])BI\s*/")
+
+# Confidence for a page - by (text operators found, fonts found)
+_PAGE_SCORES = {
+    (True, True): 1.0,
+    # Fonts can be missing from the page's own resources and still be found by viewers - from the page tree, say
+    (True, False): 0.8,
+    # Fonts which are declared but never used - common in templates and scanned pages made by some software
+    (False, True): 0.2,
+    (False, False): 0.0,
+}
+
+
+def _name(value):
+    value = resolve1(value)
+    return getattr(value, "name", value)
+
+
+def _stream_start(stream, size=MAX_SCAN_BYTES):
+    """
+    The first size bytes of a stream, decoded - only decompressing that much of it where the filters allow.
+    The stream itself is left as it was - the partial data isn't cached on it.
+    :param stream: A pdfminer PDFStream
+    :param size:
+    :return:
+    """
+    if stream.data is not None:
+        return stream.data[:size]
+
+    filters = stream.get_filters()
+    if len(filters) == 1 and filters[0][0] in LITERALS_FLATE_DECODE:
+        params = filters[0][1] if isinstance(filters[0][1], dict) else dict()
+        if int_value(resolve1(params.get("Predictor", 1))) <= 1:
+            data = stream.rawdata
+            if stream.decipher:
+                data = stream.decipher(stream.objid, stream.genno, data, stream.attrs)
+            try:
+                return zlib.decompressobj().decompress(data, size)
+            except zlib.error:
+                # Damaged - pdfminer has its own ways of recovering what it can
+                pass
+    return stream.get_data()[:size]
+
+
+def _stream_has_text(stream):
+    try:
+        data = _stream_start(stream)
+    except Exception:
+        return False
+    return _show_text_pat.search(data) is not None
+
+
+def _resources_have_fonts(resources):
+    fonts = resolve1(resources.get("Font")) if isinstance(resources, dict) else None
+    return bool(fonts)
+
+
+def page_text_evidence(page):
+    """
+    Look for text on one page - without interpreting it.
+    :param page: A pdfminer PDFPage
+    :return: A tuple (text_operators_found, fonts_found)
+    """
+    resources = resolve1(page.resources) or dict()
+    fonts = _resources_have_fonts(resources)
+
+    for content in page.contents:
+        content = resolve1(content)
+        if isinstance(content, PDFStream) and _stream_has_text(content):
+            return True, fonts
+
+    # Text can live in form xobjects drawn by the page
+    xobjects = resolve1(resources.get("XObject")) or dict()
+    for xobject in xobjects.values():
+        xobject = resolve1(xobject)
+        if not isinstance(xobject, PDFStream) or _name(xobject.get("Subtype")) != "Form":
+            continue
+        form_fonts = _resources_have_fonts(resolve1(xobject.get("Resources")) or dict())
+        if _stream_has_text(xobject):
+            return True, fonts or form_fonts
+        fonts = fonts or form_fonts
+
+    return False, fonts
+
+
+def page_has_images(page):
+    """
+    Check if a page draws any images - image xobjects (its own, or in form xobjects one level down) or inline images.
+    :param page: A pdfminer PDFPage
+    :return:
+    """
+    resources = resolve1(page.resources) or dict()
+    xobjects = resolve1(resources.get("XObject")) or dict()
+    for xobject in xobjects.values():
+        xobject = resolve1(xobject)
+        if not isinstance(xobject, PDFStream):
+            continue
+        subtype = _name(xobject.get("Subtype"))
+        if subtype == "Image":
+            return True
+        if subtype == "Form":
+            form_resources = resolve1(xobject.get("Resources")) or dict()
+            form_xobjects = resolve1(form_resources.get("XObject")) or dict()
+            if any(_name(resolve1(x).get("Subtype")) == "Image" for x in form_xobjects.values()):
+                return True
+
+    for content in page.contents:
+        content = resolve1(content)
+        if isinstance(content, PDFStream):
+            try:
+                data = _stream_start(content)
+            except Exception:
+                continue
+            if _inline_image_pat.search(data):
+                return True
+    return False
+
+
+def classify_pages(path):
+    """
+    Sort every page of a pdf into "text" (has text showing operators), "image" (draws images, but shows no text - a
+    scan) or "blank" (neither).
+    :param path: The pdf - a path, or an open binary file
+    :return: A list of the class of each page, in order
+    """
+    if isinstance(path, str):
+        with open(path, "rb") as stream:
+            return classify_pages(stream)
+
+    path.seek(0)
+    document = PDFDocument(PDFParser(path))
+    kinds = []
+    for page in PDFPage.create_pages(document):
+        try:
+            has_text, _ = page_text_evidence(page)
+            if has_text:
+                kinds.append("text")
+            elif page_has_images(page):
+                kinds.append("image")
+            else:
+                kinds.append("blank")
+        except Exception:
+            # Can't tell - OCR will sort it out
+            kinds.append("image")
+    return kinds
+
+
+def _sample_indices(count, pages):
+    if count <= pages:
+        return set(range(count))
+    if pages == 1:
+        return {0}
+    return {round(i * (count - 1) / (pages - 1)) for i in range(pages)}
+
+
+def count_pages(document):
+    """
+    The number of pages in a document - from the page tree's /Count, without walking the tree.
+    :param document: A pdfminer PDFDocument
+    :return: The count - or None if the page tree doesn't give one
+    """
+    try:
+        return int(resolve1(resolve1(document.catalog["Pages"])["Count"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def has_text_layer(path, pages=SAMPLE_PAGES):
+    """
+    How confident we are that a pdf has embedded text.
+    :param path: The pdf - a path, or an open binary file
+    :param pages: Number of pages to sample (the first, the last and evenly spaced between)
+    :return: A confidence between 0 and 1 - the average over the pages sampled. At or above TEXT_THRESHOLD the file can
+             be taken to have a text layer.
+    """
+    if isinstance(path, str):
+        with open(path, "rb") as stream:
+            return has_text_layer(stream, pages=pages)
+
+    path.seek(0)
+    document = PDFDocument(PDFParser(path))
+    count = count_pages(document)
+    if count is None or count <= 0:
+        # Missing or plainly wrong (as /Count 0 in a file with pages is) - walk the first few pages instead
+        count = pages
+    wanted = _sample_indices(count, max(1, pages))
+    last = max(wanted)
+
+    scores = []
+    for page_num, page in enumerate(PDFPage.create_pages(document)):
+        if page_num in wanted:
+            try:
+                scores.append(_PAGE_SCORES[page_text_evidence(page)])
+            except Exception:
+                # A damaged page says nothing either way
+                pass
+        if page_num >= last:
+            break
+
+    if not scores:
+        return 0.0
+    return sum(scores) / len(scores)
+
+
+def needs_ocr(path, pages=SAMPLE_PAGES, threshold=TEXT_THRESHOLD):
+    """
+    Check if a pdf looks like it has no text layer - and so should be OCRed.
+    :param path:
+    :param pages: As for has_text_layer
+    :param threshold: Confidence below which a file needs OCR
+    :return:
+    """
+    return has_text_layer(path, pages=pages) < threshold
+
+
+def _checked(path, pages):
+    try:
+        return path, has_text_layer(path, pages=pages)
+    except Exception as e:
+        return path, e
+
+
+def scan_text_layers(paths, workers=None, pages=SAMPLE_PAGES):
+    """
+    Run has_text_layer over many files in a pool of processes.
+    A generator - yields (path, confidence) in input order. confidence is the exception raised if the file couldn't be
+    read.
+    :param paths: An iterable of paths
+    :param workers: Number of processes. Defaults to the number of CPUs.
+    :param pages: As for has_text_layer
+    :return:
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(partial(_checked, pages=pages), paths, chunksize=16):
+            yield result
@@ -0,0 +1,231 @@
+
+# Guessing a document's title from its text - for pdfs whose metadata has no title.
+# The title is taken to be the largest run of text near the top of the first page. Only the first page (or first few
+# pages) is interpreted, and without pdfminer's full layout analysis - just the characters, their fonts and positions.
+# Work per file is capped - in characters interpreted and in time - so this can be run over a whole corpus.
+
+import time
+
+from statistics import median
+
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LTChar, LTFigure
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+
+# Characters interpreted per page before stopping - a title page rarely has more, and the title comes early anyway
+MAX_CHARS = 20000
+
+# The clock is checked once every this many drawing operations (characters, paths, images and form xobjects)
+CLOCK_INTERVAL = 256
+
+# Seconds to spend on one file
+TIME_BUDGET = 2.0
+
+# The title must be at least this much larger than the median text size of the page
+MIN_SIZE_RATIO = 1.25
+
+# The title must start in this top fraction of the page
+TOP_FRACTION = 0.5
+
+MIN_TITLE_LENGTH = 3
+MAX_TITLE_LENGTH = 300
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class _BoundedAggregator(PDFPageAggregator):
+    """
+    A page aggregator which stops interpreting once it has seen too many characters or run out of time.
+    Every render hook counts towards the time check - a page of nothing but vector paths or images is bounded too.
+    """
+
+    def __init__(self, rsrcmgr, max_chars, deadline):
+        PDFPageAggregator.__init__(self, rsrcmgr, laparams=None)
+        self.max_chars = max_chars
+        self.deadline = deadline
+        self.chars = 0
+        self.ops = 0
+        self.page_item = None
+
+    def begin_page(self, page, ctm):
+        PDFPageAggregator.begin_page(self, page, ctm)
+        # Kept so what was collected before the budget ran out can still be used
+        self.page_item = self.cur_item
+
+    def partial_result(self):
+        """
+        The page as far as it was interpreted - the characters before the budget ran out (those in an unfinished form
+        xobject excepted).
+        """
+        return self.page_item
+
+    def _check_time(self):
+        self.ops += 1
+        if not self.ops % CLOCK_INTERVAL and time.monotonic() > self.deadline:
+            raise _BudgetExceeded("Out of time")
+
+    def render_char(self, *args, **kwargs):
+        self.chars += 1
+        if self.chars > self.max_chars:
+            raise _BudgetExceeded("Too many characters on page")
+        self._check_time()
+        return PDFPageAggregator.render_char(self, *args, **kwargs)
+
+    def render_image(self, *args, **kwargs):
+        self._check_time()
+        return PDFPageAggregator.render_image(self, *args, **kwargs)
+
+    def paint_path(self, *args, **kwargs):
+        self._check_time()
+        return PDFPageAggregator.paint_path(self, *args, **kwargs)
+
+    def begin_figure(self, *args, **kwargs):
+        self._check_time()
+        return PDFPageAggregator.begin_figure(self, *args, **kwargs)
+
+
+def _runs(chars):
+    """
+    Group characters into runs - consecutive characters of the same font and size.
+    :param chars: LTChar objects, in content stream order
+    :return: A list of (size, top, text) tuples
+    """
+    runs = []
+    current = None
+    last = None
+    for char in chars:
+        size = round(char.size, 1)
+        key = (char.fontname, size)
+        if current is None or key != current[0]:
+            if current is not None:
+                runs.append(current)
+            current = [key, char.y1, [char.get_text()]]
+        else:
+            # Gaps between words, and line breaks within the run, become spaces
+            if abs(char.y0 - last.y0) > size * 0.5 or char.x0 - last.x1 > size * 0.25:
+                current[2].append(" ")
+            current[2].append(char.get_text())
+            current[1] = max(current[1], char.y1)
+        last = char
+    if current is not None:
+        runs.append(current)
+
+    return [(key[1], top, " ".join("".join(text).split())) for key, top, text in runs]
+
+
+def _chars(container):
+    """
+    The characters of a page, in content stream order - including those drawn by form xobjects (LTFigure), which are
+    already placed in page coordinates.
+    :param container: An LTPage or LTFigure
+    :return:
+    """
+    for item in container:
+        if isinstance(item, LTChar):
+            yield item
+        elif isinstance(item, LTFigure):
+            yield from _chars(item)
+
+
+def _title_from_page(page_layout):
+    """
+    Pick the title out of one page - the largest text in the top part of the page.
+    :param page_layout: An LTPage (made without layout analysis)
+    :return: A tuple of the title and its size ratio to the page's median text size - or (None, 0) if there's nothing
+             which could be a title
+    """
+    chars = list(_chars(page_layout))
+    if not chars:
+        return None, 0
+
+    body_size = median(char.size for char in chars)
+    if body_size <= 0:
+        return None, 0
+    top_limit = page_layout.y0 + (page_layout.y1 - page_layout.y0) * (1 - TOP_FRACTION)
+
+    candidates = [
+        (size, top, text)
+        for size, top, text in _runs(chars)
+        if top >= top_limit and len(text) >= MIN_TITLE_LENGTH and any(c.isalpha() for c in text)
+    ]
+    if not candidates:
+        return None, 0
+
+    best_size = max(size for size, _, _ in candidates)
+    # A title split over several lines (or text objects) shows up as several runs at the same size
+    title = " ".join(text for size, _, text in candidates if size == best_size)
+    if len(title) > MAX_TITLE_LENGTH:
+        return None, 0
+    return title, best_size / body_size
+
+
+def guess_title(stream, max_pages=1, max_chars=MAX_CHARS, time_budget=TIME_BUDGET):
+    """
+    Guess the title of a pdf from the text of its first pages.
+    Pages are looked at in order, stopping at the first one with a confident candidate - text at least MIN_SIZE_RATIO
+    times the size of the page's body text, in its top part.
+    :param stream: The pdf - an open binary file, or a path
+    :param max_pages: Number of pages to look at, at most
+    :param max_chars: Stop interpreting a page once this many characters have been seen - the title is picked from
+                      those
+    :param time_budget: Seconds to spend on the file, at most - the page being interpreted when it runs out is judged on
+                        what was seen of it
+    :return: The title - or None if no confident guess could be made
+    """
+    if isinstance(stream, str):
+        with open(stream, "rb") as pdf_stream:
+            return guess_title(pdf_stream, max_pages=max_pages, max_chars=max_chars, time_budget=time_budget)
+
+    deadline = time.monotonic() + time_budget
+    stream.seek(0)
+    document = PDFDocument(PDFParser(stream))
+    rsrcmgr = PDFResourceManager(caching=True)
+
+    for page_num, page in enumerate(PDFPage.create_pages(document)):
+        if page_num >= max_pages or time.monotonic() > deadline:
+            break
+
+        device = _BoundedAggregator(rsrcmgr, max_chars, deadline)
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        try:
+            interpreter.process_page(page)
+            layout = device.get_result()
+        except _BudgetExceeded:
+            # The title is near the top - so almost always among the characters already seen
+            layout = device.partial_result()
+            if layout is None:
+                continue
+        title, ratio = _title_from_page(layout)
+        if title is not None and ratio >= MIN_SIZE_RATIO:
+            return title
+
+    return None
+
+
+def fill_missing_title(md, stream, **kwargs):
+    """
+    Add a guessed title to a metadata dictionary (as returned by get_metadata) - if it doesn't have a title already.
+    As in process_key_value_pair, the title is added to the tags too.
+    :param md: The metadata dictionary - changed in place
+    :param stream: As for guess_title
+    :param kwargs: Passed to guess_title
+    :return: md
+    """
+    if md.get("title"):
+        return md
+
+    title = guess_title(stream, **kwargs)
+    if title is not None:
+        md["title"] = title
+        md["title_guessed"] = True
+        if "tags" in md:
+            md["tags"].extend([title, ])
+        else:
+            md["tags"] = [title, ]
+    return md
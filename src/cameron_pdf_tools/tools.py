@@ -0,0 +1,152 @@
+
+# Finding and probing the external binaries (the poppler tools) this package drives.
+# Lookups are done once per process and cached - batch jobs call these for every file.
+# Kept free of heavy imports, so it's cheap to check for the tools before doing anything else.
+
+import os
+import re
+import shutil
+import subprocess
+
+from collections import namedtuple
+from functools import lru_cache
+
+
+POPPLER_TOOLS = ("pdfinfo", "pdftoppm", "pdftohtml")
+
+# Flags which some builds of poppler lack - and which the code here relies on
+PROBE_FLAGS = ("-meta", "-isodates", "-singlefile", "-cropbox", "-scale-to", "-progress")
+
+# The tools (and flags of those tools) read_info and page_images need
+REQUIRED_FLAGS = {
+    "pdfinfo": ("-meta",),
+    "pdftoppm": ("-singlefile", "-cropbox"),
+}
+
+# Searched if a tool is neither next to PDFTOHTML nor on the PATH
+LEGACY_BASE_PATHS = ["/usr", "/usr/bin"]
+
+PROBE_TIMEOUT = 10
+
+ToolInfo = namedtuple("ToolInfo", ["name", "path", "version", "flags"])
+
+
+class ToolNotFoundError(Exception):
+    """
+    Raised when a required tool is missing, or doesn't support a required flag.
+    """
+
+
+@lru_cache(maxsize=None)
+def find_tool(tool_name):
+    """
+    Return the absolute path to a tool's binary - or None if it cannot be found.
+    Looks in the directory of PDFTOHTML, then on the PATH, then in LEGACY_BASE_PATHS.
+    The result is cached for the life of the process.
+    :param tool_name:
+    :return:
+    """
+    from cameron_pdf_tools.constants import PDFTOHTML
+
+    base = os.path.dirname(PDFTOHTML)
+    if base:
+        tool_path = os.path.join(base, tool_name)
+        if os.path.isfile(tool_path) and os.access(tool_path, os.X_OK):
+            return os.path.abspath(tool_path)
+
+    tool_path = shutil.which(tool_name)
+    if tool_path is not None:
+        return os.path.abspath(tool_path)
+
+    for base_path in LEGACY_BASE_PATHS:
+        tool_path = os.path.join(base_path, tool_name)
+        if os.path.exists(tool_path):
+            return tool_path
+
+    return None
+
+
+@lru_cache(maxsize=None)
+def probe_tool(tool_name):
+    """
+    Find a tool and work out its version and which of PROBE_FLAGS it supports.
+    The result is cached for the life of the process.
+    :param tool_name:
+    :return ToolInfo: path is None if the tool could not be found - version is None if it could not be determined
+    """
+    tool_path = find_tool(tool_name)
+    if tool_path is None:
+        return ToolInfo(tool_name, None, None, frozenset())
+
+    # poppler prints both the version and the help to stderr - and some builds exit non-zero for -h
+    try:
+        version_out = _run_probe([tool_path, "-v"])
+        help_out = _run_probe([tool_path, "-h"])
+    except (OSError, subprocess.TimeoutExpired):
+        return ToolInfo(tool_name, tool_path, None, frozenset())
+
+    version_match = re.search(r"version\s+(\S+)", version_out)
+    version = version_match.group(1) if version_match else None
+
+    help_tokens = set(re.split(r"[\s,=<>\[\]]+", help_out))
+    flags = frozenset(flag for flag in PROBE_FLAGS if flag in help_tokens)
+
+    return ToolInfo(tool_name, tool_path, version, flags)
+
+
+def _run_probe(cmd):
+    """
+    Run a command, returning its combined stdout and stderr as a string whatever its exit status.
+    :param cmd:
+    :return:
+    """
+    proc = subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+        timeout=PROBE_TIMEOUT,
+    )
+    return proc.stdout.decode("utf-8", errors="replace")
+
+
+def probe_tools(tool_names=POPPLER_TOOLS):
+    """
+    Probe several tools at once.
+    :param tool_names:
+    :return: A dictionary keyed by tool name and valued with the ToolInfo for that tool
+    """
+    return {tool_name: probe_tool(tool_name) for tool_name in tool_names}
+
+
+def require_tools(required=None):
+    """
+    Check that every required tool is present and supports the flags it's needed for - raising if not.
+    Call this before starting a batch, so a missing tool fails the run at once rather than on the first file.
+    :param required: A dictionary keyed by tool name and valued with an iterable of required flags.
+                     Defaults to REQUIRED_FLAGS.
+    :return: A dictionary keyed by tool name and valued with the ToolInfo for that tool
+    """
+    if required is None:
+        required = REQUIRED_FLAGS
+
+    tools = probe_tools(tuple(required))
+
+    errs = []
+    for tool_name, flags in required.items():
+        tool = tools[tool_name]
+        if tool.path is None:
+            errs.append("{} could not be found".format(tool_name))
+            continue
+        missing_flags = [flag for flag in flags if flag not in tool.flags]
+        if missing_flags:
+            errs.append(
+                "{} ({}, version {}) does not support {}".format(
+                    tool_name, tool.path, tool.version, ", ".join(missing_flags)
+                )
+            )
+
+    if errs:
+        raise ToolNotFoundError("\n".join(errs))
+
+    return tools
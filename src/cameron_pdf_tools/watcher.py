@@ -0,0 +1,432 @@
+
+# Watching a directory tree for pdfs which are created, modified, moved or deleted - so metadata (and extracted text)
+# can be kept current without re-running over the whole tree.
+# On Linux the kernel's inotify is used (through ctypes - no extra dependency). Elsewhere, or if inotify can't be set
+# up, the tree is polled - snapshots of (size, mtime, inode) compared between polls.
+#
+# Either way events only mark paths as dirty. A dirty path is settled once it has been quiet for the debounce period -
+# so a burst of writes gives one event - by comparing its current state to the last one reported. A file which vanished
+# from one path and turned up at another with the same inode, size and mtime is reported as moved, not as a deletion
+# and a new file.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from collections import namedtuple
+
+from cameron_pdf_tools.constants import islinux
+
+
+# Seconds a path must be quiet before it's reported
+DEBOUNCE = 2.0
+
+# Seconds between scans of the tree, when polling
+POLL_INTERVAL = 5.0
+
+PDF_SUFFIXES = (".pdf",)
+
+# kind is "changed" (created or modified), "moved" or "deleted". old_path is only set for "moved".
+WatchEvent = namedtuple("WatchEvent", ["kind", "path", "old_path"])
+
+
+########################################################################################################################
+# inotify
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_event_header = struct.Struct("iIII")
+
+
+class _Inotify(object):
+    """
+    A minimal wrapper around the inotify system calls.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds for events.
+        :param timeout:
+        :return: A list of (wd, mask, cookie, name) tuples
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def inotify_available():
+    """
+    Check if inotify can be used here.
+    :return:
+    """
+    if not islinux:
+        return False
+    try:
+        _Inotify().close()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+########################################################################################################################
+
+
+def _stat_key(path):
+    """
+    What's compared to tell if a file changed - or None if it doesn't exist.
+    :param path:
+    :return:
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class DirectoryWatcher(object):
+    """
+    Watch a directory tree for pdfs being created, modified, moved or deleted.
+    handler is called with a WatchEvent for each - from the thread running the watcher.
+
+    Usage:
+
+        watcher = DirectoryWatcher("/srv/pdfs", handle_event)
+        watcher.start()
+        ...
+        watcher.stop()
+    """
+
+    def __init__(
+        self, root, handler, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, use_inotify=None, suffixes=PDF_SUFFIXES
+    ):
+        """
+        :param root: The directory to watch - including every directory below it
+        :param handler: Called with each WatchEvent
+        :param debounce: Seconds a file must be quiet before it's reported
+        :param poll_interval: Seconds between scans of the tree, when polling
+        :param use_inotify: True to insist on inotify, False to poll, None to use inotify if it's available
+        :param suffixes: Only files with these (lower case) suffixes are watched
+        """
+        self.root = os.path.abspath(root)
+        self.handler = handler
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.suffixes = tuple(suffixes)
+        if use_inotify is None:
+            use_inotify = inotify_available()
+        self.use_inotify = use_inotify
+
+        # The state of each file as last reported
+        self.snapshot = self._scan(self.root)
+        # Path -> time it was last seen to change
+        self._dirty = dict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _wanted(self, path):
+        return path.lower().endswith(self.suffixes)
+
+    def _scan(self, top):
+        """
+        The state of every watched file below a directory.
+        :param top:
+        :return: A dictionary keyed by path and valued with (size, mtime_ns, inode)
+        """
+        ans = dict()
+        for dirpath, _, filenames in os.walk(top):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if self._wanted(path):
+                    key = _stat_key(path)
+                    if key is not None:
+                        ans[path] = key
+        return ans
+
+    def _mark(self, path, now):
+        if self._wanted(path):
+            self._dirty[path] = now
+
+    def _mark_differences(self, now):
+        """
+        Mark every path whose state differs from the snapshot - by scanning the whole tree.
+        :param now:
+        :return:
+        """
+        scan = self._scan(self.root)
+        for path in set(scan) | set(self.snapshot):
+            if scan.get(path) != self.snapshot.get(path):
+                self._mark(path, now)
+
+    def _settle(self, now, force=False):
+        """
+        Report every dirty path which has been quiet for the debounce period.
+        :param now:
+        :param force: Report every dirty path, quiet or not
+        :return:
+        """
+        ready = [path for path, seen in self._dirty.items() if force or now - seen >= self.debounce]
+        if not ready:
+            return
+        for path in ready:
+            del self._dirty[path]
+
+        current = {path: _stat_key(path) for path in ready}
+        gone = {
+            self.snapshot[path]: path for path in ready if current[path] is None and path in self.snapshot
+        }
+
+        events = []
+        for path in ready:
+            key = current[path]
+            if key is None:
+                continue
+            old_path = None if path in self.snapshot else gone.pop(key, None)
+            if old_path is not None:
+                del self.snapshot[old_path]
+                events.append(WatchEvent("moved", path, old_path))
+            elif self.snapshot.get(path) != key:
+                events.append(WatchEvent("changed", path, None))
+            self.snapshot[path] = key
+
+        for path in gone.values():
+            del self.snapshot[path]
+            events.append(WatchEvent("deleted", path, None))
+
+        for event in events:
+            try:
+                self.handler(event)
+            except Exception as e:
+                # One bad event mustn't stop the watcher
+                print("Error handling {} event for {}: {!r}".format(event.kind, event.path, e))
+
+    def _run_polling(self):
+        last_scan = dict(self.snapshot)
+        while not self._stop.is_set():
+            now = time.monotonic()
+            scan = self._scan(self.root)
+            for path in set(scan) | set(last_scan):
+                if scan.get(path) != last_scan.get(path):
+                    self._mark(path, now)
+            last_scan = scan
+            self._settle(now)
+            self._stop.wait(min(self.poll_interval, self.debounce) if self._dirty else self.poll_interval)
+
+    def _run_inotify(self):
+        inotify = _Inotify()
+        # Watch descriptor -> directory
+        watches = dict()
+
+        def watch_tree(top, now, mark=True):
+            for dirpath, _, filenames in os.walk(top):
+                try:
+                    watches[inotify.add_watch(dirpath)] = dirpath
+                except OSError:
+                    continue
+                # Files may have been written before the watch was in place
+                if mark:
+                    for name in filenames:
+                        self._mark(os.path.join(dirpath, name), now)
+
+        def unwatch_tree(top, now):
+            prefix = top + os.sep
+            for wd, dirpath in list(watches.items()):
+                if dirpath == top or dirpath.startswith(prefix):
+                    inotify.rm_watch(wd)
+                    del watches[wd]
+            for path in self.snapshot:
+                if path.startswith(prefix):
+                    self._mark(path, now)
+
+        try:
+            watch_tree(self.root, None, mark=False)
+            # Catch anything which changed between the snapshot being taken and the watches being in place
+            self._mark_differences(time.monotonic())
+
+            while not self._stop.is_set():
+                timeout = self.debounce if self._dirty else 1.0
+                events = inotify.read(timeout)
+                now = time.monotonic()
+                for wd, mask, cookie, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost - fall back to comparing the whole tree
+                        self._mark_differences(now)
+                        continue
+                    if mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                        continue
+                    dirpath = watches.get(wd)
+                    if dirpath is None:
+                        continue
+                    path = os.path.join(dirpath, name) if name else dirpath
+
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_tree(path, now)
+                        elif mask & IN_MOVED_FROM:
+                            unwatch_tree(path, now)
+                    else:
+                        self._mark(path, now)
+                self._settle(now)
+        finally:
+            inotify.close()
+
+    def run(self):
+        """
+        Watch until stop is called - blocking.
+        :return:
+        """
+        if self.use_inotify:
+            self._run_inotify()
+        else:
+            self._run_polling()
+        self._settle(time.monotonic(), force=True)
+
+    def start(self):
+        """
+        Watch in a background thread.
+        :return:
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="pdf-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching - anything still waiting out its debounce period is reported first.
+        :return:
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def _print_error(path, error):
+    print("Error processing {}: {}".format(path, error))
+
+
+def watch_metadata(
+    root,
+    metadata,
+    text_store=None,
+    guess_missing_title=False,
+    sync=True,
+    on_error=_print_error,
+    **kwargs
+):
+    """
+    Keep a store of metadata (and, optionally, extracted text) current with a directory tree.
+    Created and modified pdfs go through get_metadata_inplace (and extract_text). Moved pdfs have their stored metadata
+    and text moved with them, without being parsed again. Deleted pdfs are dropped from the stores.
+    :param root: The directory to watch
+    :param metadata: A mutable mapping, keyed by absolute pdf path - a dict, or a shelve for something persistent
+    :param text_store: A text_extraction.TextStore - if given text is kept current too
+    :param guess_missing_title: As for get_metadata_inplace
+    :param sync: If True, first process every pdf already in the tree which is missing from the stores (or whose
+                 stored text is out of date)
+    :param on_error: Called with (path, exception) when a file can't be processed
+    :param kwargs: Passed to DirectoryWatcher
+    :return: The DirectoryWatcher - already started
+    """
+    from cameron_pdf_tools.metadata_extractor import get_metadata_inplace
+    from cameron_pdf_tools.text_extraction import extract_text
+
+    def process(path):
+        try:
+            metadata[path] = get_metadata_inplace(path, guess_missing_title=guess_missing_title)
+            if text_store is not None:
+                extract_text(path, store=text_store)
+        except Exception as e:
+            on_error(path, e)
+
+    def handler(event):
+        if event.kind == "changed":
+            process(event.path)
+        elif event.kind == "moved":
+            md = metadata.pop(event.old_path, None)
+            if md is None:
+                process(event.path)
+                return
+            metadata[event.path] = md
+            if text_store is not None:
+                try:
+                    pages = text_store.read(event.old_path)
+                    if pages is not None:
+                        text_store.write(event.path, pages)
+                        text_store.remove(event.old_path)
+                except Exception:
+                    # A text file which can't be read (truncated, say) or moved - extract it all again instead
+                    pages = None
+                if pages is None:
+                    process(event.path)
+        elif event.kind == "deleted":
+            metadata.pop(event.path, None)
+            if text_store is not None:
+                try:
+                    text_store.remove(event.path)
+                except Exception as e:
+                    on_error(event.path, e)
+
+    watcher = DirectoryWatcher(root, handler, **kwargs)
+    if sync:
+        for path in sorted(watcher.snapshot):
+            if path not in metadata or (text_store is not None and not text_store.is_up_to_date(path)):
+                process(path)
+    watcher.start()
+    return watcher
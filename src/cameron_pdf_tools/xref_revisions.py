@@ -0,0 +1,251 @@
+
+# Reading only as much of a pdf's cross reference chain as is needed.
+# Each incremental update of a pdf appends a new xref section, with a /Prev pointing at the one before. pdfminer's
+# PDFDocument reads every section when it's opened - for a file edited hundreds of times, most of the work of getting
+# its metadata. LazyPDFDocument reads the newest section only, and the older ones as lookups fall through to them. When
+# the updates rewrote the catalog, /Info and /Metadata (as editors saving metadata do) nothing older is read at all. An
+# object untouched since the original still costs a walk down the whole chain - no worse than reading it all up front.
+# It can also walk the revisions one at a time - list_revision_metadata gives the metadata as each revision left it.
+
+from pdfminer.pdfdocument import PDFDocument, PDFNoValidXRef, PDFXRef, PDFXRefStream
+from pdfminer.pdfparser import PDFParser, PDFSyntaxError
+from pdfminer.pdftypes import PDFObjectNotFound, PDFStream, decipher_all, dict_value, int_value, stream_value
+from pdfminer.psparser import PSEOF
+
+
+class _LazyXRefs(list):
+    """
+    The xref sections of a document, newest first - read from the file as iteration reaches them.
+    """
+
+    def __init__(self, document, parser):
+        list.__init__(self)
+        self.document = document
+        self.parser = parser
+        # Offsets of sections still to be read - a stack, popped from the end
+        self.pending = []
+        self.seen = set()
+        # Index (into this list) of the first section of each revision - an /XRefStm section belongs to the revision
+        # of the table which points at it
+        self.revision_starts = []
+        self.revision_offsets = []
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self):
+                yield list.__getitem__(self, i)
+                i += 1
+            elif not self.load_next():
+                return
+
+    def load_all(self):
+        while self.load_next():
+            pass
+
+    def load_next(self):
+        """
+        Read the next section of the chain.
+        :return: False if there are none left
+        """
+        while self.pending:
+            start, new_revision = self.pending.pop()
+            # A /Prev pointing back into the chain would loop forever
+            if start in self.seen:
+                continue
+            self.seen.add(start)
+
+            xref = self.document._read_xref_section(self.parser, start)
+            if new_revision:
+                self.revision_starts.append(len(self))
+                self.revision_offsets.append(start)
+            self.append(xref)
+
+            trailer = xref.get_trailer()
+            if "Prev" in trailer:
+                self.pending.append((int_value(trailer["Prev"]), True))
+            if "XRefStm" in trailer:
+                self.pending.append((int_value(trailer["XRefStm"]), False))
+            return True
+        return False
+
+
+def _read_xref(parser, start, table_class=PDFXRef, stream_class=PDFXRefStream):
+    """
+    Read the one xref section at an offset - table or stream - as PDFDocument.read_xref_from does, but without going on
+    to /Prev.
+    :param parser:
+    :param start:
+    :param table_class: Called to make the xref for a table
+    :param stream_class: Called to make the xref for a stream
+    """
+    parser.seek(start)
+    parser.reset()
+    try:
+        (pos, token) = parser.nexttoken()
+    except PSEOF:
+        raise PDFNoValidXRef("Unexpected EOF")
+    if isinstance(token, int):
+        parser.seek(pos)
+        parser.reset()
+        xref = stream_class()
+        xref.load(parser)
+    else:
+        if token is parser.KEYWORD_XREF:
+            parser.nextline()
+        xref = table_class()
+        xref.load(parser)
+    return xref
+
+
+class LazyPDFDocument(PDFDocument):
+    """
+    A PDFDocument which reads its xref chain lazily - see the top of the module.
+    Files whose xref can't be read fall back to pdfminer's reconstruction (which reads the whole file) as usual.
+    """
+
+    def read_xref_from(self, parser, start, xrefs):
+        if isinstance(self.xrefs, _LazyXRefs):
+            return
+        lazy = _LazyXRefs(self, parser)
+        lazy.pending.append((start, True))
+        # Raises PDFNoValidXRef if the newest section is bad - before anything is replaced, so the fallback works
+        lazy.load_next()
+        self.xrefs = lazy
+
+    def _read_xref_section(self, parser, start):
+        return _read_xref(parser, start)
+
+    @property
+    def sections_read(self):
+        """
+        The number of xref sections read so far.
+        """
+        return len(self.xrefs)
+
+    def revision_count(self):
+        """
+        The number of revisions (the original plus each incremental update) - reading the whole chain.
+        :return:
+        """
+        if not isinstance(self.xrefs, _LazyXRefs):
+            return 1
+        self.xrefs.load_all()
+        return len(self.xrefs.revision_starts)
+
+    def revision_trailer(self, revision):
+        """
+        The trailer of a revision.
+        :param revision: Counting from 0 for the newest
+        :return:
+        """
+        self._load_revision(revision)
+        return self.xrefs[self.xrefs.revision_starts[revision]].get_trailer()
+
+    def _load_revision(self, revision):
+        if not isinstance(self.xrefs, _LazyXRefs):
+            if revision != 0:
+                raise IndexError("Revision {} - the xref was reconstructed, so only the newest is known".format(
+                    revision
+                ))
+            return
+        # The sections of a revision are all read once the first of the next is
+        while len(self.xrefs.revision_starts) <= revision + 1 and self.xrefs.load_next():
+            pass
+        if len(self.xrefs.revision_starts) <= revision:
+            raise IndexError("Revision {} - the document has {}".format(revision, len(self.xrefs.revision_starts)))
+
+    def getobj_at(self, objid, revision):
+        """
+        Get an object as it was in a revision - ignoring any later updates. Not cached.
+        :param objid:
+        :param revision: Counting from 0 for the newest
+        :return:
+        """
+        self._load_revision(revision)
+        first = self.xrefs.revision_starts[revision] if isinstance(self.xrefs, _LazyXRefs) else 0
+        for i, xref in enumerate(self.xrefs):
+            if i < first:
+                continue
+            try:
+                (strmid, index, genno) = xref.get_pos(objid)
+            except KeyError:
+                continue
+            try:
+                if strmid is not None:
+                    stream = stream_value(self.getobj_at(strmid, revision))
+                    objs, n = self._get_objects(stream)
+                    obj = objs[n * 2 + index]
+                else:
+                    obj = self._getobj_parse(index, objid)
+                    if self.decipher:
+                        obj = decipher_all(self.decipher, objid, genno, obj)
+                if isinstance(obj, PDFStream):
+                    obj.set_objid(objid, genno)
+                return obj
+            except (PSEOF, PDFSyntaxError, IndexError):
+                continue
+        raise PDFObjectNotFound(objid)
+
+    def resolve_at(self, value, revision):
+        """
+        As pdfminer's resolve1 - but resolving references as of a revision.
+        """
+        while hasattr(value, "objid") and hasattr(value, "resolve"):
+            value = self.getobj_at(value.objid, revision)
+        return value
+
+
+def list_revision_metadata(stream, max_revisions=None):
+    """
+    The metadata of a pdf as each of its revisions left it - newest first.
+    Only the xref sections down to the oldest revision asked for are read.
+    :param stream: An open binary file
+    :param max_revisions: Stop after this many revisions - None for all of them
+    :return: A list of dictionaries, in the form get_metadata returns, with the extra keys "revision" (0 for the
+             newest), "xref_offset" (where the revision's xref section starts - None if the xref had to be
+             reconstructed) and "changed" (whether the metadata differs from the revision before it - None for the
+             last one listed)
+    """
+    from cameron_pdf_tools.metadata_extractor import (
+        process_metadata_info_dict,
+        process_xmp_metadata_dict,
+        xmp_to_dict,
+    )
+
+    stream.seek(0)
+    document = LazyPDFDocument(PDFParser(stream))
+
+    found = []
+    revision = 0
+    while max_revisions is None or revision < max_revisions:
+        try:
+            trailer = document.revision_trailer(revision)
+        except IndexError:
+            break
+
+        md = dict()
+        try:
+            if "Info" in trailer:
+                md = process_metadata_info_dict(dict_value(document.resolve_at(trailer["Info"], revision)), md)
+            if "Root" in trailer:
+                catalog = dict_value(document.resolve_at(trailer["Root"], revision))
+                if "Metadata" in catalog:
+                    xmp = stream_value(document.resolve_at(catalog["Metadata"], revision)).get_data()
+                    md = process_xmp_metadata_dict(xmp_to_dict(xmp), md)
+        except Exception as e:
+            md["error"] = repr(e)
+        found.append(md)
+        revision += 1
+
+    for revision, md in enumerate(found):
+        if revision + 1 < len(found):
+            md["changed"] = md != found[revision + 1]
+        else:
+            md["changed"] = None
+    for revision, md in enumerate(found):
+        md["revision"] = revision
+        md["xref_offset"] = (
+            document.xrefs.revision_offsets[revision] if isinstance(document.xrefs, _LazyXRefs) else None
+        )
+    return found
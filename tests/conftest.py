@@ -0,0 +1,76 @@
+import pikepdf
+import pytest
+
+
+def write_pdf(path, pages, info=None, xmp=None, object_streams=False):
+    """
+    Write a small pdf for a test.
+    :param path:
+    :param pages: A list of pages - each "blank", "image" (a scan - one image, no text) or a list of (size, y, text)
+                  lines of text in Helvetica
+    :param info: The Info dictionary, as a dictionary of str
+    :param xmp: An XMP packet (str) to put in the catalog's /Metadata
+    :param object_streams: If True, save with object streams (and so an xref stream)
+    :return: The path, as a str
+    """
+    path = str(path)
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(
+        pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica)
+    )
+    for page_spec in pages:
+        pdf.add_blank_page(page_size=(612, 792))
+        page = pdf.pages[-1]
+        if page_spec == "blank":
+            continue
+        if page_spec == "image":
+            image = pdf.make_stream(
+                b"\x80" * 64,
+                Type=pikepdf.Name.XObject,
+                Subtype=pikepdf.Name.Image,
+                Width=8,
+                Height=8,
+                BitsPerComponent=8,
+                ColorSpace=pikepdf.Name.DeviceGray,
+            )
+            page.Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image))
+            page.Contents = pdf.make_stream(b"q 612 0 0 792 0 0 cm /Im0 Do Q")
+            continue
+        ops = []
+        for size, y, text in page_spec:
+            escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append("BT /F1 {} Tf 72 {} Td ({}) Tj ET".format(size, y, escaped))
+        page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+        page.Contents = pdf.make_stream("\n".join(ops).encode("latin-1"))
+
+    if info:
+        for key, value in info.items():
+            pdf.docinfo["/" + key] = value
+    if xmp is not None:
+        pdf.Root.Metadata = pdf.make_stream(
+            xmp.encode("utf-8"), Type=pikepdf.Name.Metadata, Subtype=pikepdf.Name.XML
+        )
+
+    mode = pikepdf.ObjectStreamMode.generate if object_streams else pikepdf.ObjectStreamMode.disable
+    pdf.save(path, object_stream_mode=mode, deterministic_id=True)
+    return path
+
+
+@pytest.fixture
+def text_pdf(tmp_path):
+    """
+    A one page pdf with a large title near the top, and some body text.
+    """
+    return write_pdf(
+        tmp_path / "text.pdf",
+        [[(24, 700, "A Study of Things"), (10, 650, "Some body text follows here."), (10, 636, "And more of it.")]],
+        info={"Title": "Info Title", "Author": "A. Cameron"},
+    )
+
+
+@pytest.fixture
+def scan_pdf(tmp_path):
+    """
+    A three page pdf of scans - images, no text.
+    """
+    return write_pdf(tmp_path / "scan.pdf", ["image", "image", "image"])
@@ -0,0 +1,104 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from cameron_pdf_tools import bm25
+from cameron_pdf_tools.bm25 import BM25Engine, _sorted_unique, compile_index, parse_query
+from cameron_pdf_tools.text_index import TextIndex, tokenize
+
+
+_WORDS = ["alpha", "beta", "gamma", "delta", "annual", "report", "tools", "poppler", "pdf", "index"]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    rng = random.Random(0)
+    docs = dict()
+    index = TextIndex(str(tmp_path / "index"))
+    for d in range(30):
+        pages = [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 40))) for _ in range(rng.randint(1, 4))]
+        docs["/{}.pdf".format(d)] = pages
+        index.add_document("/{}.pdf".format(d), pages)
+        if d % 10 == 9:
+            index.commit()
+    # Deleted documents mustn't be found
+    index.delete_document("/0.pdf")
+    del docs["/0.pdf"]
+    index.add_document("/phrase.pdf", ["the annual report of the tools", "report annual"])
+    docs["/phrase.pdf"] = ["the annual report of the tools", "report annual"]
+    index.commit()
+
+    compile_index(index, str(tmp_path / "compiled"))
+    index.close()
+    return docs, BM25Engine(str(tmp_path / "compiled"))
+
+
+def _brute_force(docs, terms, k1=bm25.K1, b=bm25.B):
+    pages = [(source, number, tokenize(text)) for source, texts in docs.items() for number, text in
+             enumerate(texts, start=1)]
+    avg = sum(len(tokens) for _, _, tokens in pages) / len(pages)
+    scores = dict()
+    for term in set(terms):
+        df = sum(1 for _, _, tokens in pages if term in tokens)
+        idf = math.log1p((len(pages) - df + 0.5) / (df + 0.5))
+        for source, number, tokens in pages:
+            tf = tokens.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(tokens) / max(avg, 1.0))
+                scores[(source, number)] = scores.get((source, number), 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def test_parse_query():
+    assert parse_query('pdf "annual report" x') == (["pdf", "x", "annual", "report"], [["annual", "report"]])
+
+
+def test_sorted_unique():
+    values = np.array([5, 1, 5, 3, 1, 9], dtype=np.int32)
+    assert _sorted_unique(values).tolist() == np.unique(values).tolist()
+    assert _sorted_unique(np.zeros(0, dtype=np.int32)).tolist() == []
+
+
+@pytest.mark.parametrize("fraction", [0, 10 ** 9])
+def test_scores_match_brute_force(corpus, monkeypatch, fraction):
+    # Both ways of finding the candidates - scanning every page, and sorting the postings touched
+    monkeypatch.setattr(bm25, "DENSE_CANDIDATES_FRACTION", fraction)
+    docs, engine = corpus
+    for query in ("alpha", "poppler pdf", "gamma delta index"):
+        expected = _brute_force(docs, tokenize(query))
+        results = engine.search(query, k=5)
+        assert len(results) == 5
+        best = sorted(expected.values(), reverse=True)[:5]
+        assert [score for _, _, score in results] == pytest.approx(best, rel=1e-4)
+        for source, page, score in results:
+            assert expected[(source, page)] == pytest.approx(score, rel=1e-4)
+
+
+def test_deleted_documents_not_found(corpus):
+    docs, engine = corpus
+    assert "/0.pdf" not in {source for source, _, _ in engine.search("alpha beta gamma", k=1000)}
+
+
+def test_phrase_query(corpus):
+    docs, engine = corpus
+
+    def has_phrase(text):
+        tokens = tokenize(text)
+        return any(tokens[i:i + 2] == ["annual", "report"] for i in range(len(tokens) - 1))
+
+    expected = {(source, page) for source, texts in docs.items() for page, text in enumerate(texts, start=1)
+                if has_phrase(text)}
+    results = engine.search('"annual report" tools', k=1000)
+    assert {(source, page) for source, page, _ in results} == expected
+    # "report annual" isn't the phrase
+    assert ("/phrase.pdf", 1) in expected and ("/phrase.pdf", 2) not in expected
+
+
+def test_no_results(corpus):
+    docs, engine = corpus
+    assert engine.search("") == []
+    assert engine.search("nothing") == []
+    # Both terms are on /phrase.pdf, but never in this order
+    assert engine.search('"tools the"') == []
@@ -0,0 +1,124 @@
+import zlib
+
+import pikepdf
+import pytest
+
+from pdfminer.pdftypes import PDFStream
+from pdfminer.psparser import LIT
+
+from cameron_pdf_tools.bounded_memory import (
+    DEFAULT_MEMORY_LIMITS,
+    MemoryLimits,
+    ResourceLimitError,
+    _LRUCache,
+    check_decoded_size,
+    open_bounded,
+)
+from cameron_pdf_tools.metadata_extractor import get_metadata
+
+from conftest import write_pdf
+
+
+_XMP = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Hello XMP</rdf:li></rdf:Alt></dc:title>
+</rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+def _flate_stream(data):
+    return PDFStream({"Filter": LIT("FlateDecode"), "Length": 0}, zlib.compress(data))
+
+
+def test_lru_cache_bounds_entries_and_bytes():
+    cache = _LRUCache(3)
+    for i in range(5):
+        cache[i] = i
+    assert list(cache) == [2, 3, 4]
+    cache[2]
+    cache[5] = 5
+    assert list(cache) == [4, 2, 5]
+
+    cache = _LRUCache(None, max_bytes=10, weigh=len)
+    cache["a"] = b"x" * 6
+    cache["b"] = b"y" * 6
+    assert list(cache) == ["b"]
+    assert cache.bytes == 6
+
+
+def test_flate_bomb_refused_early():
+    stream = _flate_stream(b"\0" * (32 * 1024 * 1024))
+    with pytest.raises(ResourceLimitError) as e:
+        check_decoded_size(stream, 1024 * 1024)
+    assert e.value.limit == "stream_size"
+    # Given up on a chunk past the limit - not decompressed to the end
+    assert e.value.size < 4 * 1024 * 1024
+
+
+def test_flate_decompressed_once():
+    data = b"0123456789" * 1000
+    stream = _flate_stream(data)
+    check_decoded_size(stream, len(data))
+    # Kept as the decoded stream - pdfminer won't decompress it again
+    assert stream.rawdata is None
+    assert stream.get_data() == data
+
+
+def test_defaults_read_ordinary_files(tmp_path):
+    path = write_pdf(tmp_path / "xmp.pdf", ["blank"] * 3, info={"Title": "Info"}, xmp=_XMP, object_streams=True)
+    with open(path, "rb") as stream:
+        md = get_metadata(stream, bounded=True)
+    with open(path, "rb") as stream:
+        assert md == get_metadata(stream)
+    assert md["title"] == "Info"
+    with open(path, "rb") as stream:
+        assert b"Hello XMP" in open_bounded(stream).read_xmp()
+
+
+def test_xmp_over_the_limit(tmp_path):
+    path = write_pdf(tmp_path / "xmp.pdf", ["blank"], info={"Title": "Info"}, xmp=_XMP)
+    limits = DEFAULT_MEMORY_LIMITS._replace(xmp_size=100)
+    with open(path, "rb") as stream:
+        with pytest.raises(ResourceLimitError) as e:
+            get_metadata(stream, bounded=limits)
+    assert e.value.limit == "xmp_size"
+
+
+def test_long_stream_refused_before_reading(tmp_path):
+    path = write_pdf(tmp_path / "big.pdf", ["blank"])
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        pdf.Root.Big = pdf.make_stream(b"x" * 100000)
+        pdf.save(path, compress_streams=False, object_stream_mode=pikepdf.ObjectStreamMode.disable)
+
+    limits = DEFAULT_MEMORY_LIMITS._replace(stream_size=1000)
+    with open(path, "rb") as stream:
+        document = open_bounded(stream, limits=limits)
+        with pytest.raises(ResourceLimitError):
+            document.catalog["Big"].resolve()
+
+
+def test_xref_entries_limit(tmp_path):
+    path = write_pdf(tmp_path / "pages.pdf", ["blank"] * 50)
+    limits = MemoryLimits(None, None, None, None, None, xref_entries=20)
+    with open(path, "rb") as stream:
+        with pytest.raises(ResourceLimitError) as e:
+            open_bounded(stream, limits=limits)
+    assert e.value.limit == "xref_entries"
+
+
+def test_caches_stay_within_limits(tmp_path):
+    path = write_pdf(tmp_path / "pages.pdf", ["image"] * 40, object_streams=True)
+    limits = DEFAULT_MEMORY_LIMITS._replace(cached_objects=10, object_streams=1)
+    with open(path, "rb") as stream:
+        document = open_bounded(stream, limits=limits)
+        for objid in range(1, 120):
+            try:
+                document.getobj(objid)
+            except Exception:
+                pass
+        assert len(document._cached_objs) <= 10
+        assert len(document._parsed_objs) <= 1
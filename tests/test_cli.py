@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import signal
+
+from cameron_pdf_tools import cli, tools
+
+from conftest import write_pdf
+
+
+def _crash_on_bad(path, **kwargs):
+    # Kills its worker outright for paths containing "bad" - as a crash in a C extension would
+    if "bad" in os.path.basename(path):
+        os.kill(os.getpid(), signal.SIGKILL)
+    return {"path": path, "ok": True, "metadata": {}}
+
+
+def _lines(out):
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def test_iter_paths(tmp_path):
+    (tmp_path / "sub").mkdir()
+    for name in ("b.pdf", "a.PDF", "notes.txt", "sub/c.pdf"):
+        (tmp_path / name).write_bytes(b"")
+
+    assert list(cli.iter_paths([str(tmp_path)])) == [
+        str(tmp_path / "a.PDF"), str(tmp_path / "b.pdf"), str(tmp_path / "sub" / "c.pdf")
+    ]
+    assert list(cli.iter_paths([str(tmp_path / "*.pdf")])) == [str(tmp_path / "b.pdf")]
+    manifest = io.StringIO("one.pdf\n\n  two.pdf\n")
+    assert list(cli.iter_paths(["-", "three.pdf"], stdin=manifest)) == ["one.pdf", "two.pdf", "three.pdf"]
+
+
+def test_main_writes_a_line_per_file(tmp_path, capsys, text_pdf):
+    missing = str(tmp_path / "missing.pdf")
+    code = cli.main(["--backend", "pdfminer", "-j", "1", text_pdf, missing])
+    assert code == cli.EXIT_SOME_FAILED
+
+    results = {result["path"]: result for result in _lines(capsys.readouterr().out)}
+    assert results[text_pdf]["ok"]
+    assert results[text_pdf]["metadata"]["title"] == "Info Title"
+    assert results[missing]["error"]["type"] == "FileNotFoundError"
+
+
+def test_main_all_failed(tmp_path, capsys):
+    assert cli.main(["--backend", "pdfminer", str(tmp_path / "missing.pdf")]) == cli.EXIT_ALL_FAILED
+
+
+def test_main_guess_title(tmp_path, capsys):
+    path = write_pdf(
+        tmp_path / "untitled.pdf", [[(24, 700, "Guessed"), (10, 600, "body text " * 5)]], info={"Author": "Someone"}
+    )
+    assert cli.main(["--backend", "pdfminer", "--guess-title", path]) == cli.EXIT_OK
+    (result,) = _lines(capsys.readouterr().out)
+    assert result["metadata"]["title"] == "Guessed"
+
+
+def test_bad_limits(capsys):
+    assert cli.main(["--timeout", "-1", "x.pdf"]) == cli.EXIT_USAGE
+    assert cli.main(["-j", "0", "x.pdf"]) == cli.EXIT_USAGE
+
+
+def test_poppler_missing(monkeypatch, capsys, text_pdf):
+    def require_tools(required=None):
+        raise tools.ToolNotFoundError("pdfinfo could not be found")
+
+    monkeypatch.setattr(tools, "require_tools", require_tools)
+    assert cli.main(["--backend", "poppler", text_pdf]) == cli.EXIT_TOOLS_MISSING
+    assert "pdfinfo" in capsys.readouterr().err
+
+    # auto falls back to pdfminer
+    assert cli.main(["--backend", "auto", text_pdf]) == cli.EXIT_OK
+    (result,) = _lines(capsys.readouterr().out)
+    assert result["metadata"]["backend"] == "pdfminer"
+
+
+def test_parallel(tmp_path, capsys, text_pdf):
+    code = cli.main(["--backend", "pdfminer", "-j", "2", text_pdf, text_pdf, str(tmp_path / "missing.pdf")])
+    assert code == cli.EXIT_SOME_FAILED
+    assert sorted(result["ok"] for result in _lines(capsys.readouterr().out)) == [False, True, True]
+
+
+def test_worker_crash_only_fails_its_file(monkeypatch):
+    monkeypatch.setattr(cli, "process_file", _crash_on_bad)
+    paths = ["file{}.pdf".format(i) for i in range(20)]
+    paths[3] = "bad1.pdf"
+    paths[12] = "bad2.pdf"
+
+    results = list(cli._run_parallel(paths, 3, {}))
+    assert sorted(result["path"] for result in results) == sorted(paths)
+    assert sorted(result["path"] for result in results if not result["ok"]) == ["bad1.pdf", "bad2.pdf"]
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+from cameron_pdf_tools import duplicates
+from cameron_pdf_tools.duplicates import (
+    canonical_map,
+    cluster_by_xmp,
+    extract_deduplicated,
+    find_duplicates,
+    parse_xmp_ids,
+)
+
+from conftest import write_pdf
+
+
+_XMP = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/" xmpMM:DocumentID="uuid:doc-{doc}">
+<xmpMM:InstanceID>uuid:instance-{instance}</xmpMM:InstanceID>
+</rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>"""
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    # Small enough that the partial and full hashes differ
+    monkeypatch.setattr(duplicates, "HEAD_TAIL_SIZE", 4)
+    a = _write(tmp_path / "a", b"0123-middle-4567")
+    b = _write(tmp_path / "b", b"0123-middle-4567")
+    c = _write(tmp_path / "c", b"0123-MIDDLE-4567")
+    _write(tmp_path / "d", b"same size, other")
+    link = str(tmp_path / "link")
+    os.link(a, link)
+    lone = _write(tmp_path / "lone", b"x" * 20)
+    lone_link = str(tmp_path / "lone_link")
+    os.link(lone, lone_link)
+
+    paths = sorted(str(p) for p in tmp_path.iterdir())
+    groups = find_duplicates(paths, workers=2)
+    assert groups == [[a, b, link], [lone, lone_link]]
+    assert c not in canonical_map(groups)
+    assert canonical_map(groups) == {b: a, link: a, lone_link: lone}
+
+
+def test_path_given_twice_is_not_a_duplicate(tmp_path):
+    a = _write(tmp_path / "a", b"content")
+    assert find_duplicates([a, a]) == []
+    assert canonical_map([[a, a]]) == {}
+
+
+def test_extract_deduplicated(tmp_path, text_pdf):
+    copy = str(tmp_path / "copy.pdf")
+    shutil.copy(text_pdf, copy)
+    other = write_pdf(tmp_path / "other.pdf", [[(10, 700, "Other")]], info={"Title": "Other"})
+
+    found = extract_deduplicated([text_pdf, copy, other], workers=2, backend="pdfminer")
+    results = {path: (md, canonical) for path, md, canonical in found}
+    assert results[text_pdf][1] == results[copy][1]
+    assert results[other][1] == other
+    assert results[text_pdf][0]["title"] == results[copy][0]["title"] == "Info Title"
+    # Each copy has its own dictionary
+    assert results[text_pdf][0] is not results[copy][0]
+
+
+def test_extract_deduplicated_path_given_twice(tmp_path, text_pdf):
+    results = list(extract_deduplicated([text_pdf, text_pdf], workers=1, backend="pdfminer"))
+    assert [(path, canonical) for path, _, canonical in results] == [(text_pdf, text_pdf)]
+
+    results = list(extract_deduplicated([text_pdf], workers=1, backend="pdfminer", groups=[[text_pdf, text_pdf]]))
+    assert [path for path, _, _ in results] == [text_pdf]
+
+
+def test_parse_xmp_ids():
+    assert parse_xmp_ids(_XMP.format(doc=1, instance=2)) == ("uuid:doc-1", "uuid:instance-2")
+    assert parse_xmp_ids("not xml") == (None, None)
+
+
+def test_cluster_by_xmp(tmp_path):
+    first = write_pdf(tmp_path / "v1.pdf", ["blank"], xmp=_XMP.format(doc=1, instance=1))
+    second = write_pdf(tmp_path / "v2.pdf", ["blank", "blank"], xmp=_XMP.format(doc=1, instance=2))
+    copy = write_pdf(tmp_path / "v2-copy.pdf", ["blank"], xmp=_XMP.format(doc=1, instance=2))
+    write_pdf(tmp_path / "none.pdf", ["blank"])
+
+    clusters = cluster_by_xmp(sorted(str(p) for p in tmp_path.iterdir()), workers=2)
+    assert clusters["document_id"] == {"uuid:doc-1": sorted([first, second, copy])}
+    assert clusters["instance_id"] == {"uuid:instance-2": sorted([second, copy])}
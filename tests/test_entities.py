@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from cameron_pdf_tools import decode_entities, encode_entities
+
+
+# Characters which exercise every path - the XML specials, the C1 controls, latin-1, named entities, astral planes and
+# lone surrogates
+_ALPHABET = (
+    [chr(n) for n in range(0x00, 0x100)]
+    + ["—", "€", "’", "α", "≤", " ", "�", "\U0001d538", "\U0001f600", "\ud800"]
+    + list("&;#x<>\"'amp")
+)
+
+_C1 = {chr(n) for n in range(0x80, 0xA0)}
+
+
+def _random_strings(count=2000, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 40)))
+
+
+@pytest.mark.parametrize("mode", ["xml", "html5", "ascii"])
+def test_round_trip(mode):
+    for text in _random_strings():
+        # The C1 controls only round trip in ascii mode when decoded as UCS - see encode_entities
+        if mode == "ascii" and _C1.intersection(text):
+            assert decode_entities(encode_entities(text, mode), encoding=None) == text
+        else:
+            assert decode_entities(encode_entities(text, mode)) == text
+
+
+@pytest.mark.parametrize("mode", ["xml", "html5", "ascii"])
+def test_round_trip_every_bmp_character(mode):
+    chars = [chr(n) for n in range(0x10000) if chr(n) not in _C1]
+    text = "".join(chars)
+    assert decode_entities(encode_entities(text, mode)) == text
+
+
+def test_ascii_mode_is_ascii():
+    for text in _random_strings(500, seed=1):
+        encoded = encode_entities(text, "ascii")
+        assert all(ord(ch) < 128 for ch in encoded)
+
+
+def test_c1_controls_in_ascii_mode():
+    text = "\x80\x9f"
+    assert encode_entities(text, "ascii") == "&#128;&#159;"
+    assert decode_entities(encode_entities(text, "ascii")) == "€Ÿ"
+    assert decode_entities(encode_entities(text, "ascii"), encoding=None) == text
+
+
+@pytest.mark.parametrize("entity", ["&#-1;", "&#x-1;", "&#-255;"])
+def test_negative_numeric_entities_left_alone(entity):
+    assert decode_entities(entity) == entity
+    assert decode_entities(entity, encoding=None) == entity
+
+
+def test_numeric_entities():
+    assert decode_entities("&#128;&#x80;&#233;&#8212;") == "€€é—"
+    assert decode_entities("&#128;", encoding=None) == "\x80"
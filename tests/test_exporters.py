@@ -0,0 +1,88 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+from cameron_pdf_tools.exporters import COLUMNS, export, flatten_metadata
+
+
+_RESULTS = [
+    ("/a.pdf", {"title": "A", "author": ["X", "Y"], "tags": ["A"], "backend": "pdfminer", "pages": 3}),
+    ("/b.pdf", ValueError("broken xref")),
+]
+
+
+def _sqlite_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0]: row for row in conn.execute("SELECT path, title, author, extra, error FROM metadata")}
+    finally:
+        conn.close()
+
+
+def test_flatten_metadata():
+    row = flatten_metadata(*_RESULTS[0])
+    assert set(row) == set(COLUMNS)
+    assert row["author"] == "X; Y"
+    assert json.loads(row["extra"]) == {"pages": 3}
+    assert flatten_metadata(*_RESULTS[1])["error"] == "ValueError: broken xref"
+
+
+def test_sqlite(tmp_path):
+    db_path = str(tmp_path / "out.db")
+    assert export(iter(_RESULTS), db_path) == 2
+    rows = _sqlite_rows(db_path)
+    assert rows["/a.pdf"][1:3] == ("A", "X; Y")
+    assert rows["/b.pdf"][4] == "ValueError: broken xref"
+
+
+def test_sqlite_modes(tmp_path):
+    db_path = str(tmp_path / "out.db")
+    export(iter(_RESULTS), db_path)
+
+    export([("/a.pdf", {"title": "Kept?"})], db_path, mode="keep_existing")
+    assert _sqlite_rows(db_path)["/a.pdf"][1] == "A"
+
+    export([("/a.pdf", {"title": "New"})], db_path, mode="upsert")
+    rows = _sqlite_rows(db_path)
+    assert rows["/a.pdf"][1] == "New"
+    assert len(rows) == 2
+
+    export([("/c.pdf", {"title": "C"})], db_path, mode="replace")
+    assert list(_sqlite_rows(db_path)) == ["/c.pdf"]
+
+
+def test_sqlite_batches(tmp_path):
+    db_path = str(tmp_path / "out.db")
+    results = (("/{}.pdf".format(i), {"title": str(i)}) for i in range(25))
+    assert export(results, db_path, batch_size=10) == 25
+    assert len(_sqlite_rows(db_path)) == 25
+
+
+def test_csv_replace_and_append(tmp_path):
+    out = str(tmp_path / "out.csv")
+    export(iter(_RESULTS), out)
+    export(iter(_RESULTS), out)
+    export([("/c.pdf", {"title": "C"})], out, mode="append")
+
+    with open(out, newline="", encoding="utf-8") as stream:
+        rows = list(csv.DictReader(stream))
+    assert [row["path"] for row in rows] == ["/a.pdf", "/b.pdf", "/c.pdf"]
+    assert rows[0]["author"] == "X; Y"
+
+
+def test_jsonl_keeps_metadata_as_is(tmp_path):
+    out = str(tmp_path / "out.jsonl")
+    assert export(iter(_RESULTS), out) == 2
+    with open(out, encoding="utf-8") as stream:
+        lines = [json.loads(line) for line in stream]
+    assert lines[0] == {"path": "/a.pdf", "metadata": _RESULTS[0][1]}
+    assert lines[1] == {"path": "/b.pdf", "error": "ValueError: broken xref"}
+
+
+def test_bad_format_and_mode(tmp_path):
+    with pytest.raises(ValueError):
+        export([], str(tmp_path / "out.xml"), fmt="xml")
+    with pytest.raises(ValueError):
+        export([], str(tmp_path / "out.csv"), mode="upsert")
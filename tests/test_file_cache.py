@@ -0,0 +1,65 @@
+import os
+
+from cameron_pdf_tools.cover_cache import CoverCache
+from cameron_pdf_tools.file_cache import FileCache
+
+
+def _write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_key_depends_on_content_and_params(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    a = _write(tmp_path / "a.pdf", b"content")
+    b = _write(tmp_path / "b.pdf", b"content")
+    c = _write(tmp_path / "c.pdf", b"other")
+
+    assert cache.key(a) == cache.key(b) != cache.key(c)
+    assert cache.key(a, dpi=100) != cache.key(a, dpi=200)
+    assert cache.key(a, dpi=100, fmt="png") == cache.key(a, fmt="png", dpi=100)
+
+
+def test_put_get_fetch(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), ext=".pdf")
+    src = _write(tmp_path / "out.pdf", b"made")
+    key = cache.key(src)
+
+    assert cache.get(key) is None
+    assert not cache.fetch(key, str(tmp_path / "dest.pdf"))
+    path = cache.put(key, src)
+    assert path.endswith(".pdf")
+    assert cache.get(key) == path
+    assert cache.fetch(key, str(tmp_path / "dest.pdf"))
+    assert (tmp_path / "dest.pdf").read_bytes() == b"made"
+    assert cache.stats() == {"hits": 2, "misses": 2, "evictions": 0, "size": 4}
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"), max_size=250)
+    keys = []
+    for i in range(3):
+        src = _write(tmp_path / "{}.bin".format(i), bytes([i]) * 100)
+        key = cache.key(src)
+        os.utime(cache.put(key, src), (i, i))
+        keys.append(key)
+
+    # The third put took the cache over its size - the oldest went
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 200
+
+
+def test_size_is_picked_up_when_reopened(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    src = _write(tmp_path / "a.bin", b"x" * 10)
+    cache.put(cache.key(src), src)
+    assert FileCache(str(tmp_path / "cache")).stats()["size"] == 10
+
+
+def test_cover_cache_keeps_jpgs(tmp_path):
+    cache = CoverCache(str(tmp_path / "covers"))
+    src = _write(tmp_path / "cover.jpg", b"jpg")
+    assert cache.put(cache.key(src), src).endswith(".jpg")
@@ -0,0 +1,157 @@
+import os
+import stat
+
+import pikepdf
+import pytest
+
+from cameron_pdf_tools import ocr_scheduler, text_layer
+from cameron_pdf_tools.ocr_scheduler import OCRError, OCRScheduler
+from cameron_pdf_tools.process_limits import Quarantine
+
+from conftest import write_pdf
+
+
+# Stands in for ocrmypdf - copies its input to its output, logging each call. FAKE_OCR=sleep makes it hang.
+_FAKE_OCRMYPDF = """#!/bin/sh
+for last; do :; done
+out="$last"
+in=""
+for arg; do
+    if [ "$arg" = "$out" ]; then break; fi
+    in="$arg"
+done
+echo "$in" >> "{log}"
+if [ "$FAKE_OCR" = "sleep" ]; then sleep 10; fi
+cp "$in" "$out"
+"""
+
+
+@pytest.fixture
+def fake_ocrmypdf(tmp_path, monkeypatch):
+    log = tmp_path / "ocr_calls.log"
+    script = tmp_path / "ocrmypdf"
+    script.write_text(_FAKE_OCRMYPDF.format(log=log))
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setattr(ocr_scheduler, "find_tool", lambda name: str(script))
+
+    def calls():
+        return log.read_text().splitlines() if log.exists() else []
+
+    return calls
+
+
+def test_only_files_without_text_are_queued(tmp_path, fake_ocrmypdf, text_pdf, scan_pdf):
+    scheduler = OCRScheduler(str(tmp_path / "out"), checkpoint=str(tmp_path / "checkpoint.jsonl"))
+    assert scheduler.submit(scan_pdf)
+    assert not scheduler.submit(text_pdf)
+    assert len(scheduler) == 1
+
+    results = dict(scheduler.run())
+    assert results == {scan_pdf: "ocred"}
+    assert os.path.exists(tmp_path / "out" / "scan.pdf")
+    assert scheduler.checkpoint.entries[text_pdf]["status"] == "skipped"
+
+
+def test_resume_from_checkpoint(tmp_path, fake_ocrmypdf):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    paths = [write_pdf(tmp_path / "scan{}.pdf".format(i), ["image"]) for i in range(3)]
+
+    scheduler = OCRScheduler(str(tmp_path / "out"), checkpoint=checkpoint)
+    for path in paths:
+        assert scheduler.submit(path)
+    # Stop after the first job - as a crash would
+    run = scheduler.run()
+    first, status = next(run)
+    run.close()
+    assert status == "ocred"
+
+    resumed = OCRScheduler(str(tmp_path / "out"), checkpoint=checkpoint)
+    assert len(resumed) == len(paths) - 1
+    # Submitting again is harmless - done files are skipped, queued ones aren't queued twice
+    assert not resumed.submit(first)
+    for path in paths:
+        if path != first:
+            assert resumed.submit(path)
+    assert len(resumed) == len(paths) - 1
+
+    assert sorted(path for path, _ in resumed.run()) == sorted(p for p in paths if p != first)
+    assert sorted(fake_ocrmypdf()) == sorted(paths)
+
+
+def test_priority_then_page_count(tmp_path, fake_ocrmypdf):
+    small = write_pdf(tmp_path / "small.pdf", ["image"])
+    large = write_pdf(tmp_path / "large.pdf", ["image"] * 3)
+    urgent = write_pdf(tmp_path / "urgent.pdf", ["image"] * 5)
+
+    scheduler = OCRScheduler(str(tmp_path / "out"), cpu_budget=1)
+    scheduler.submit(large)
+    scheduler.submit(small)
+    scheduler.submit(urgent, priority=1)
+    assert [path for path, _ in scheduler.run()] == [urgent, small, large]
+
+
+def test_outputs_are_cached(tmp_path, fake_ocrmypdf, scan_pdf):
+    cache = str(tmp_path / "cache")
+    first = OCRScheduler(str(tmp_path / "out1"), cache=cache)
+    first.submit(scan_pdf)
+    assert dict(first.run()) == {scan_pdf: "ocred"}
+
+    second = OCRScheduler(str(tmp_path / "out2"), cache=cache)
+    second.submit(scan_pdf)
+    assert dict(second.run()) == {scan_pdf: "cached"}
+    assert len(fake_ocrmypdf()) == 1
+    assert os.path.exists(tmp_path / "out2" / "scan.pdf")
+
+
+def test_timeout_quarantines(tmp_path, fake_ocrmypdf, scan_pdf, monkeypatch):
+    monkeypatch.setenv("FAKE_OCR", "sleep")
+    quarantine = Quarantine()
+    scheduler = OCRScheduler(str(tmp_path / "out"), timeout=0.5, quarantine=quarantine)
+    scheduler.submit(scan_pdf)
+    (path, status), = scheduler.run()
+    assert isinstance(status, OCRError)
+    assert quarantine.reason(scan_pdf) == "ocrmypdf timeout"
+    assert not scheduler.submit(scan_pdf)
+
+
+def test_page_selective_replaces_only_scanned_pages(tmp_path, fake_ocrmypdf):
+    mixed = write_pdf(tmp_path / "mixed.pdf", ["image", [(10, 700, "Born digital")], "image"])
+    output = str(tmp_path / "out" / "mixed.pdf")
+    scheduler = OCRScheduler(str(tmp_path / "out"), page_selective=True)
+
+    assert scheduler.ocr_image_pages(mixed, output) == ("ocred", [1, 3])
+    with pikepdf.open(output) as pdf:
+        assert len(pdf.pages) == 3
+    # Only the scans were sent to ocrmypdf - as a pdf of their own, which is cleaned up after
+    assert fake_ocrmypdf() == [output + ".scans.pdf"]
+    assert not os.path.exists(output + ".scans.pdf")
+
+
+def test_page_selective_classifies_once(tmp_path, fake_ocrmypdf, monkeypatch):
+    mixed = write_pdf(tmp_path / "mixed.pdf", ["image", [(10, 700, "Born digital")]])
+    classified = []
+    classify_pages = text_layer.classify_pages
+
+    def counting(path):
+        if isinstance(path, str):
+            classified.append(path)
+        return classify_pages(path)
+
+    monkeypatch.setattr(text_layer, "classify_pages", counting)
+    scheduler = OCRScheduler(str(tmp_path / "out"), page_selective=True)
+    assert scheduler.submit(mixed)
+    assert dict(scheduler.run()) == {mixed: "ocred"}
+    assert classified == [mixed]
+
+
+def test_page_selective_timeout_quarantines_the_input(tmp_path, fake_ocrmypdf, monkeypatch):
+    monkeypatch.setenv("FAKE_OCR", "sleep")
+    mixed = write_pdf(tmp_path / "mixed.pdf", ["image", [(10, 700, "Born digital")]])
+    quarantine = Quarantine()
+    scheduler = OCRScheduler(str(tmp_path / "out"), page_selective=True, timeout=0.5, quarantine=quarantine)
+    scheduler.submit(mixed)
+    (path, status), = scheduler.run()
+
+    assert isinstance(status, OCRError)
+    assert mixed in str(status)
+    assert list(quarantine) == [mixed]
@@ -0,0 +1,66 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from cameron_pdf_tools import process_limits
+from cameron_pdf_tools.constants import iswindows
+from cameron_pdf_tools.process_limits import NO_LIMITS, Quarantine, ResourceLimits, hit_limit
+
+
+posix_only = pytest.mark.skipif(iswindows, reason="Resource limits and process groups are posix only")
+
+
+def test_defaults_are_finite():
+    assert process_limits.DEFAULT_TIMEOUT
+    assert process_limits.default_limits.memory and process_limits.default_limits.cpu
+
+
+def test_check_output():
+    assert process_limits.check_output([sys.executable, "-c", "print('hi')"]).strip() == b"hi"
+    with pytest.raises(subprocess.CalledProcessError):
+        process_limits.check_call([sys.executable, "-c", "raise SystemExit(3)"])
+
+
+@posix_only
+def test_timeout_kills_the_process_group():
+    # The grandchild would keep the pipe open - and the call waiting - if only the child were killed
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        process_limits.run(["sh", "-c", "sleep 30 & sleep 30"], timeout=0.5, stdout=subprocess.PIPE)
+    assert time.monotonic() - start < 10
+
+
+@posix_only
+def test_memory_limit():
+    limits = ResourceLimits(memory=256 * 1024 * 1024, cpu=None)
+    result = process_limits.run(
+        [sys.executable, "-c", "b = bytearray(1024 ** 3)"], limits=limits, stderr=subprocess.PIPE
+    )
+    assert result.returncode
+    assert hit_limit(result.returncode, limits, result.stderr) == "memory limit"
+    # Not counted when there was no such limit
+    assert hit_limit(result.returncode, NO_LIMITS, result.stderr) is None
+
+
+@posix_only
+def test_cpu_limit():
+    limits = ResourceLimits(memory=None, cpu=1)
+    result = process_limits.run([sys.executable, "-c", "while True: pass"], limits=limits, timeout=30)
+    assert hit_limit(result.returncode, limits) == "cpu limit"
+
+
+def test_quarantine_is_kept_on_disk(tmp_path):
+    path = str(tmp_path / "quarantine.jsonl")
+    quarantine = Quarantine(path)
+    quarantine.add("a.pdf", "pdftoppm timeout")
+    quarantine.add("a.pdf", "again")
+    quarantine.add(str(tmp_path / "b.pdf"))
+
+    reloaded = Quarantine(path)
+    assert len(reloaded) == 2
+    assert "a.pdf" in reloaded
+    assert reloaded.reason("a.pdf") == "pdftoppm timeout"
+    assert reloaded.reason(str(tmp_path / "b.pdf")) == "timeout"
+    assert reloaded.reason("c.pdf") is None
@@ -0,0 +1,56 @@
+import pytest
+
+from cameron_pdf_tools.region_templates import RegionTemplate, TemplateError
+
+from conftest import write_pdf
+
+
+def _report(tmp_path, number, title, author, title_y=700):
+    lines = [
+        (20, title_y, title),
+        (12, 660, author),
+        (10, 400, "Body text which changes from report to report - number {}".format(number)),
+    ]
+    return write_pdf(tmp_path / "report-{}.pdf".format(number), [lines], info={"Author": author})
+
+
+def test_learn_and_extract(tmp_path):
+    samples = [
+        (_report(tmp_path, 1, "Annual Review", "Jane Smith"), {"title": "Annual Review", "author": "Jane Smith"}),
+        (
+            _report(tmp_path, 2, "Quarterly Note", "Li Wei", title_y=705),
+            {"title": "Quarterly Note", "author": "Li Wei"},
+        ),
+    ]
+    template = RegionTemplate.learn(samples)
+    assert set(template.regions) == {"title", "author"}
+    assert template.samples == 2
+
+    new = _report(tmp_path, 3, "Special Report", "Ana Lopez")
+    assert template.extract(new) == {"title": "Special Report", "author": "Ana Lopez"}
+
+
+def test_save_and_load(tmp_path):
+    samples = [(_report(tmp_path, 1, "Annual Review", "Jane Smith"), {"title": "Annual Review"})]
+    template = RegionTemplate.learn(samples, fields=("title",))
+    path = str(tmp_path / "template.json")
+    template.save(path)
+
+    loaded = RegionTemplate.load(path)
+    assert loaded.regions == template.regions
+    assert loaded.extract(_report(tmp_path, 2, "Other Title", "X")) == {"title": "Other Title"}
+
+
+def test_fields_not_found(tmp_path):
+    samples = [(_report(tmp_path, 1, "Annual Review", "Jane Smith"), {"title": "Not On The Page"})]
+    with pytest.raises(TemplateError):
+        RegionTemplate.learn(samples)
+
+
+def test_apply_yields_errors(tmp_path):
+    template = RegionTemplate({"title": (0.0, 0.86, 1.0, 1.0)})
+    good = _report(tmp_path, 1, "Annual Review", "Jane Smith")
+    missing = str(tmp_path / "missing.pdf")
+    results = dict(template.apply([good, missing]))
+    assert results[good] == {"title": "Annual Review"}
+    assert isinstance(results[missing], Exception)
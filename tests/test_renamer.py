@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from cameron_pdf_tools.renamer import (
+    FilenameTemplate,
+    Rename,
+    RenameError,
+    apply_renames,
+    plan_renames,
+    sanitize_filename,
+    undo_renames,
+)
+
+
+def _touch(path):
+    path.write_bytes(b"%PDF-1.4\n")
+    return str(path)
+
+
+def test_template_render():
+    template = FilenameTemplate("{author[0]} - {title}")
+    assert template.render({"author": ["A. Cameron", "B"], "title": "Tools"}, ".pdf") == "A. Cameron - Tools.pdf"
+    assert template.render({"author": "Solo", "title": "a/b"}, ".pdf") == "Solo - a_b.pdf"
+    assert template.render({}, ".pdf") == "Unknown - Unknown.pdf"
+
+
+def test_template_needs_named_fields():
+    with pytest.raises(ValueError):
+        FilenameTemplate("{0} - {title}")
+
+
+def test_sanitize_keeps_within_length():
+    name = sanitize_filename("é" * 300, max_length=255)
+    assert len(name.encode("utf-8")) <= 255
+    assert sanitize_filename('a<b>c:"d') == "a_b_c__d"
+
+
+def test_plan_settles_collisions_in_order(tmp_path):
+    paths = [_touch(tmp_path / name) for name in ("a.pdf", "b.pdf", "c.pdf")]
+    _touch(tmp_path / "Same.pdf")
+    metadata = {path: {"title": "Same"} for path in paths}
+
+    plan = plan_renames(paths, "{title}", metadata=metadata)
+    assert sorted(os.path.basename(rename.dst) for rename in plan) == ["Same (2).pdf", "Same (3).pdf", "Same (4).pdf"]
+    assert dict(plan)[paths[0]].endswith("Same (2).pdf")
+
+
+def test_plan_skips_unchanged_names(tmp_path):
+    path = _touch(tmp_path / "Title.pdf")
+    assert plan_renames([path], "{title}", metadata={path: {"title": "Title"}}) == []
+
+
+def test_swap_goes_through_a_temporary_name(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"was a")
+    (tmp_path / "b.pdf").write_bytes(b"was b")
+    a, b = str(tmp_path / "a.pdf"), str(tmp_path / "b.pdf")
+
+    plan = plan_renames([a, b], "{title}", metadata={a: {"title": "b"}, b: {"title": "a"}})
+    assert len(plan) == 3
+    apply_renames(plan)
+    assert (tmp_path / "a.pdf").read_bytes() == b"was b"
+    assert (tmp_path / "b.pdf").read_bytes() == b"was a"
+
+
+def test_apply_then_undo(tmp_path):
+    paths = [_touch(tmp_path / name) for name in ("one.pdf", "two.pdf")]
+    metadata = {paths[0]: {"title": "First"}, paths[1]: {"title": "Second"}}
+    undo_log = str(tmp_path / "undo.jsonl")
+
+    plan = plan_renames(paths, "{title}", metadata=metadata)
+    assert apply_renames(plan, undo_log=undo_log) == plan
+    assert sorted(os.listdir(tmp_path)) == ["First.pdf", "Second.pdf", "undo.jsonl"]
+
+    assert len(undo_renames(undo_log)) == 2
+    assert sorted(os.listdir(tmp_path)) == ["one.pdf", "two.pdf", "undo.jsonl"]
+
+
+def test_dry_run_changes_nothing(tmp_path):
+    path = _touch(tmp_path / "one.pdf")
+    plan = plan_renames([path], "{title}", metadata={path: {"title": "First"}})
+    assert apply_renames(plan, dry_run=True) == plan
+    assert os.listdir(tmp_path) == ["one.pdf"]
+
+
+def test_failed_rename_undoes_earlier_ones(tmp_path):
+    first = _touch(tmp_path / "one.pdf")
+    plan = [Rename(first, str(tmp_path / "First.pdf")), Rename(str(tmp_path / "missing.pdf"), str(tmp_path / "x.pdf"))]
+    with pytest.raises(RenameError):
+        apply_renames(plan)
+    assert os.listdir(tmp_path) == ["one.pdf"]
@@ -0,0 +1,94 @@
+import random
+
+from cameron_pdf_tools.text_index import TextIndex, decode_postings, encode_postings, tokenize
+
+
+def test_postings_round_trip():
+    rng = random.Random(0)
+    postings = []
+    doc_id = 0
+    for _ in range(200):
+        doc_id += rng.randint(1, 1000)
+        for page in sorted(rng.sample(range(1, 500), 3)):
+            positions = sorted(rng.sample(range(100000), rng.randint(1, 5)))
+            postings.append((doc_id, page, positions))
+    assert list(decode_postings(encode_postings(postings))) == postings
+
+
+def test_tokenize():
+    assert tokenize("Hello, World - it's 2024") == ["hello", "world", "it", "s", "2024"]
+
+
+def test_add_search_and_reopen(tmp_path):
+    index = TextIndex(str(tmp_path))
+    index.add_document("/a.pdf", ["the quick brown fox", "jumps over"])
+    index.add_document("/b.pdf", ["a lazy dog", "the fox sleeps"])
+    index.commit()
+
+    assert index.search("fox") == [("/a.pdf", 1), ("/b.pdf", 2)]
+    assert index.search("the fox") == [("/a.pdf", 1), ("/b.pdf", 2)]
+    assert index.search("brown dog") == []
+    assert index.lookup("Quick") == [("/a.pdf", 1, [1])]
+    index.close()
+
+    reopened = TextIndex(str(tmp_path))
+    assert reopened.search("fox") == [("/a.pdf", 1), ("/b.pdf", 2)]
+    reopened.close()
+
+
+def test_replace_and_delete(tmp_path):
+    index = TextIndex(str(tmp_path))
+    index.add_document("/a.pdf", ["old text"])
+    index.add_document("/b.pdf", ["other text"])
+    index.commit()
+
+    index.add_document("/a.pdf", ["new text"])
+    assert index.delete_document("/b.pdf")
+    assert not index.delete_document("/missing.pdf")
+    index.commit()
+
+    assert index.search("old") == []
+    assert index.search("text") == [("/a.pdf", 1)]
+    index.close()
+
+
+def test_merge_drops_deleted_documents(tmp_path):
+    index = TextIndex(str(tmp_path), max_segments=100, merge_factor=100)
+    for i in range(5):
+        index.add_document("/{}.pdf".format(i), ["common word{}".format(i)])
+        index.commit()
+    index.delete_document("/2.pdf")
+    index.commit()
+    assert len(index.segments) == 5
+
+    before = index.search("common")
+    index.merge()
+    assert len(index.segments) == 1
+    assert index.search("common") == before == [("/{}.pdf".format(i), 1) for i in (0, 1, 3, 4)]
+    assert index.deleted == set()
+    # Only the merged segment's files are left
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".docs", ".json", ".post", ".terms"]
+    index.close()
+
+
+def test_tiered_merging_bounds_segments(tmp_path):
+    index = TextIndex(str(tmp_path), max_segments=3, merge_factor=2)
+    for i in range(20):
+        index.add_document("/{}.pdf".format(i), ["page {}".format(i)])
+        index.commit()
+        assert len(index.segments) <= 3
+    assert len(index.search("page")) == 20
+    index.close()
+
+
+def test_search_while_merging(tmp_path):
+    index = TextIndex(str(tmp_path), max_segments=100, merge_factor=100)
+    for i in range(3):
+        index.add_document("/{}.pdf".format(i), ["shared"])
+        index.commit()
+    with index.snapshot() as (segments, deleted):
+        index.merge()
+        # The old segments stay readable until the snapshot is released
+        assert sum(len(segment.postings("shared")) for segment in segments) == 3
+    assert len(index.search("shared")) == 3
+    index.close()
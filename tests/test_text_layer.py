@@ -0,0 +1,59 @@
+import pikepdf
+
+from cameron_pdf_tools.text_layer import (
+    TEXT_THRESHOLD,
+    classify_pages,
+    has_text_layer,
+    needs_ocr,
+    scan_text_layers,
+)
+
+from conftest import write_pdf
+
+
+def test_classify_pages(tmp_path):
+    path = write_pdf(tmp_path / "mixed.pdf", ["image", "blank", [(10, 700, "Text")], "image"])
+    assert classify_pages(path) == ["image", "blank", "text", "image"]
+    with open(path, "rb") as stream:
+        assert classify_pages(stream) == ["image", "blank", "text", "image"]
+
+
+def test_text_and_scans(text_pdf, scan_pdf):
+    assert has_text_layer(text_pdf) == 1.0
+    assert has_text_layer(scan_pdf) == 0.0
+    assert not needs_ocr(text_pdf)
+    assert needs_ocr(scan_pdf)
+
+
+def test_text_inside_form_xobjects(tmp_path):
+    path = write_pdf(tmp_path / "form.pdf", ["blank"])
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        font = pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1, BaseFont=pikepdf.Name.Helvetica)
+        form = pdf.make_stream(
+            b"BT /F1 12 Tf 72 700 Td (In a form) Tj ET",
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Form,
+            BBox=[0, 0, 612, 792],
+            Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)),
+        )
+        pdf.pages[0].Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(Fm0=form))
+        pdf.pages[0].Contents = pdf.make_stream(b"/Fm0 Do")
+        pdf.save(path)
+    assert classify_pages(path) == ["text"]
+    assert not needs_ocr(path)
+
+
+def test_sampled_pages(tmp_path):
+    # Text on the first page only - one of the three sampled
+    path = write_pdf(tmp_path / "mostly_scans.pdf", [[(10, 700, "Text")]] + ["image"] * 9)
+    assert has_text_layer(path) < TEXT_THRESHOLD
+    assert has_text_layer(path, pages=1) == 1.0
+
+
+def test_scan_text_layers(tmp_path, text_pdf, scan_pdf):
+    missing = str(tmp_path / "missing.pdf")
+    results = list(scan_text_layers([text_pdf, scan_pdf, missing], workers=2))
+    assert [path for path, _ in results] == [text_pdf, scan_pdf, missing]
+    assert results[0][1] == 1.0
+    assert results[1][1] == 0.0
+    assert isinstance(results[2][1], Exception)
@@ -0,0 +1,68 @@
+import time
+
+import pikepdf
+
+from cameron_pdf_tools.title_guess import fill_missing_title, guess_title
+
+from conftest import write_pdf
+
+
+_BODY = [(10, 600 - 14 * i, "A line of ordinary body text, number {}.".format(i)) for i in range(10)]
+
+
+def test_largest_text_near_the_top(tmp_path):
+    path = write_pdf(tmp_path / "paper.pdf", [[(24, 700, "A Study of Things")] + _BODY])
+    assert guess_title(path) == "A Study of Things"
+
+
+def test_no_confident_guess(tmp_path):
+    path = write_pdf(tmp_path / "flat.pdf", [_BODY])
+    assert guess_title(path) is None
+    # Large text, but low on the page
+    path = write_pdf(tmp_path / "low.pdf", [[(24, 100, "Footer Banner")] + _BODY])
+    assert guess_title(path) is None
+
+
+def test_title_split_over_lines(tmp_path):
+    path = write_pdf(tmp_path / "split.pdf", [[(24, 720, "A Very Long"), (24, 690, "Title Indeed")] + _BODY])
+    assert guess_title(path) == "A Very Long Title Indeed"
+
+
+def test_title_in_a_form_xobject(tmp_path):
+    path = write_pdf(tmp_path / "form.pdf", [_BODY])
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        page = pdf.pages[0]
+        form = pdf.make_stream(
+            b"BT /F1 24 Tf 72 700 Td (Drawn By A Form) Tj ET",
+            Type=pikepdf.Name.XObject,
+            Subtype=pikepdf.Name.Form,
+            BBox=[0, 0, 612, 792],
+            Resources=page.Resources,
+        )
+        page.Resources.XObject = pikepdf.Dictionary(Fm0=form)
+        page.Contents = pdf.make_stream(b"/Fm0 Do\n" + page.Contents.read_bytes())
+        pdf.save(path)
+    assert guess_title(path) == "Drawn By A Form"
+
+
+def test_time_budget_holds_without_text(tmp_path):
+    path = write_pdf(tmp_path / "paths.pdf", ["blank"])
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        pdf.pages[0].Contents = pdf.make_stream(b"0 0 1 1 re f\n" * 200000)
+        pdf.save(path)
+
+    start = time.monotonic()
+    assert guess_title(path, time_budget=0.2) is None
+    assert time.monotonic() - start < 2
+
+
+def test_max_chars_keeps_what_was_seen(tmp_path):
+    path = write_pdf(tmp_path / "long.pdf", [[(24, 700, "Early Title")] + _BODY * 20])
+    assert guess_title(path, max_chars=300) == "Early Title"
+
+
+def test_fill_missing_title(tmp_path):
+    path = write_pdf(tmp_path / "paper.pdf", [[(24, 700, "A Study of Things")] + _BODY])
+    md = fill_missing_title({"tags": ["x"]}, path)
+    assert md == {"title": "A Study of Things", "title_guessed": True, "tags": ["x", "A Study of Things"]}
+    assert fill_missing_title({"title": "Kept"}, path) == {"title": "Kept"}
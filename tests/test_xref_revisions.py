@@ -0,0 +1,95 @@
+import pikepdf
+import pytest
+
+from pdfminer.pdfparser import PDFParser
+
+from cameron_pdf_tools.metadata_extractor import get_metadata
+from cameron_pdf_tools.xref_revisions import LazyPDFDocument, list_revision_metadata
+
+from conftest import write_pdf
+
+
+def add_revision(path, title, rewrite_catalog=False):
+    """
+    Append an incremental update to a pdf (saved without object streams) - a new Info dictionary with the given title
+    and, optionally, a copy of the catalog.
+    """
+    with open(path, "rb") as stream:
+        data = stream.read()
+    prev = int(data.rsplit(b"startxref", 1)[1].split()[0])
+    with pikepdf.open(path) as pdf:
+        size = int(pdf.trailer.Size)
+        root = pdf.Root.objgen[0]
+        pages = pdf.Root.Pages.objgen[0]
+    if not data.endswith(b"\n"):
+        data += b"\n"
+
+    objects = [(size, b"<< /Title (%s) >>" % title.encode("latin-1"))]
+    if rewrite_catalog:
+        objects.append((root, b"<< /Type /Catalog /Pages %d 0 R >>" % pages))
+
+    body = b""
+    xref = b"xref\n"
+    for objid, obj in objects:
+        xref += b"%d 1\n%010d 00000 n \n" % (objid, len(data) + len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (objid, obj)
+    trailer = b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (
+        size + 1, root, size, prev, len(data) + len(body)
+    )
+    with open(path, "wb") as stream:
+        stream.write(data + body + xref + trailer)
+
+
+@pytest.fixture
+def revised_pdf(tmp_path):
+    path = write_pdf(tmp_path / "revised.pdf", ["blank"], info={"Title": "Original"})
+    add_revision(path, "Second")
+    add_revision(path, "Second")
+    add_revision(path, "Third")
+    return path
+
+
+def test_list_revision_metadata(revised_pdf):
+    with open(revised_pdf, "rb") as stream:
+        found = list_revision_metadata(stream)
+    assert [md["title"] for md in found] == ["Third", "Second", "Second", "Original"]
+    assert [md["changed"] for md in found] == [True, False, True, None]
+    assert [md["revision"] for md in found] == [0, 1, 2, 3]
+    offsets = [md["xref_offset"] for md in found]
+    assert offsets == sorted(offsets, reverse=True)
+
+
+def test_max_revisions_reads_only_what_is_needed(revised_pdf):
+    with open(revised_pdf, "rb") as stream:
+        found = list_revision_metadata(stream, max_revisions=2)
+    assert [md["title"] for md in found] == ["Third", "Second"]
+
+
+def test_newest_revision_only_read_when_it_has_everything(tmp_path):
+    path = write_pdf(tmp_path / "edited.pdf", ["blank"], info={"Title": "Original"})
+    for i in range(10):
+        add_revision(path, "Edit {}".format(i), rewrite_catalog=True)
+
+    with open(path, "rb") as stream:
+        document = LazyPDFDocument(PDFParser(stream))
+        assert document.sections_read == 1
+        assert document.revision_count() == 11
+        assert document.sections_read == 11
+
+    with open(path, "rb") as stream:
+        assert get_metadata(stream, lazy_xref=True)["title"] == "Edit 9"
+
+
+def test_objects_from_older_revisions_are_found(revised_pdf):
+    with open(revised_pdf, "rb") as stream:
+        md = get_metadata(stream, lazy_xref=True)
+    with open(revised_pdf, "rb") as stream:
+        assert md == get_metadata(stream)
+    assert md["title"] == "Third"
+
+
+def test_bad_revision(revised_pdf):
+    with open(revised_pdf, "rb") as stream:
+        document = LazyPDFDocument(PDFParser(stream))
+        with pytest.raises(IndexError):
+            document.revision_trailer(4)